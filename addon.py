@@ -11,6 +11,7 @@ from os.path import (
 )
 
 import bpy
+from bpy.app.handlers import persistent
 from bpy.props import (
     StringProperty,
     PointerProperty,
@@ -21,11 +22,13 @@ from bpy.types import PropertyGroup
 
 try:
     import render_manager
+    import render_worker
     import local_processor
     import path_utils
 except ImportError:
     # Initialize these so we can test against them.
     render_manager = None
+    render_worker = None
     local_processor = None
     path_utils = None
     # TODO(mattkeller): find some way to report this in the UI?
@@ -77,6 +80,128 @@ class DepRenderPanel(bpy.types.Panel):
         row = layout.row(align=True)
         row.prop(settings, "local_parallelism")
 
+        row = layout.row(align=True)
+        row.prop(settings, "preview_stride")
+        row.prop(settings, "preview_resolution_percentage")
+
+
+class ReferenceCache:
+    """ Remembers the references of the open blend file between renders.
+
+    Walking every element of every image strip in the sequencer and working out which target or asset each file
+    belongs to is slow in big files, so the files referenced by each scene's sequencer and what every file resolved to
+    are kept until a scene update tells us the scene changed (or another file is loaded).
+    """
+
+    def __init__(self):
+        # scene name -> the set of files referenced by its sequencer.
+        self.sequencer_files = {}
+        self.dirty_scenes = set()
+
+        # file -> ('asset' | 'dependency' | None, asset or target) for the project root and blend file below.
+        self.resolved_files = {}
+        self.resolved_context = None
+
+    def clear(self):
+        self.sequencer_files = {}
+        self.dirty_scenes = set()
+        self.resolved_files = {}
+        self.resolved_context = None
+
+    def mark_scene_dirty(self, scene_name):
+        self.dirty_scenes.add(scene_name)
+
+    def get_sequencer_files(self, scene):
+        if scene.name in self.dirty_scenes or scene.name not in self.sequencer_files:
+            self.dirty_scenes.discard(scene.name)
+            self.sequencer_files[scene.name] = get_sequencer_files(scene)
+        return self.sequencer_files[scene.name]
+
+    def resolve(self, project_root, file):
+        # Relative paths depend on where the blend file is so a save as invalidates everything.
+        context = (project_root, bpy.data.filepath)
+        if context != self.resolved_context:
+            self.resolved_files = {}
+            self.resolved_context = context
+        if file not in self.resolved_files:
+            self.resolved_files[file] = resolve_reference(project_root, file)
+        return self.resolved_files[file]
+
+
+reference_cache = ReferenceCache()
+
+
+@persistent
+def on_depsgraph_update(scene, depsgraph=None):
+    if depsgraph is None:
+        reference_cache.mark_scene_dirty(scene.name)
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Scene):
+            reference_cache.mark_scene_dirty(update.id.name)
+
+
+@persistent
+def on_scene_update(scene):
+    # Blender < 2.80 calls this after every redraw, not only when something changed.
+    if scene.is_updated:
+        reference_cache.mark_scene_dirty(scene.name)
+
+
+def get_scene_update_handler():
+    """ Returns the handler list that tells us about changes to scenes and our handler for it, depsgraph_update_post
+    only exists since Blender 2.80.
+    """
+    if hasattr(bpy.app.handlers, 'depsgraph_update_post'):
+        return (bpy.app.handlers.depsgraph_update_post, on_depsgraph_update)
+    return (bpy.app.handlers.scene_update_post, on_scene_update)
+
+
+@persistent
+def on_save_post(*args):
+    # Bring the cache up to date now so that starting a render doesn't have to.
+    project_root = bpy.context.scene.dep_render_settings.project_root
+    if project_root:
+        evaluate_references(bpy.path.abspath(project_root))
+
+
+@persistent
+def on_load_post(*args):
+    reference_cache.clear()
+
+
+def get_sequencer_files(scene):
+    files = set()
+    if scene.sequence_editor and scene.sequence_editor.sequences_all:
+        for seq in scene.sequence_editor.sequences_all:
+            if seq.type == 'IMAGE' and hasattr(seq, 'directory'):
+                directory = seq.directory
+                for element in seq.elements:
+                    files.add(join(directory, element.filename))
+            elif seq.type == 'MOVIE':
+                files.add(seq.filepath)
+    return files
+
+
+def resolve_reference(project_root, file):
+    """ Works out whether a referenced file is the output of a target or an asset.
+
+    :returns a ('dependency', target), ('asset', asset) or (None, None) tuple.
+    """
+    absolute_file = os.path.abspath(bpy.path.abspath(file))
+    absolute_file_directory = dirname(absolute_file)
+    if basename(absolute_file_directory) == 'latest':
+        target = path_utils.get_target_for_latest_image_sequence_directory(project_root, absolute_file_directory)
+        if target:
+            print('We got the target %s from the absolute file %s' % (target, absolute_file))
+            return ('dependency', target)
+        return (None, None)
+    try:
+        return ('asset', path_utils.replace_absolute_project_prefix(project_root, absolute_file))
+    except ValueError:
+        print('DepRender used relativize on %s ...but it failed!' % absolute_file)
+        return (None, None)
+
 
 def evaluate_references(project_root):
     """ This method handles the evaluation of the current blend file to determine which files or targets affect the
@@ -103,31 +228,17 @@ def evaluate_references(project_root):
                 external_files.add(entity.filepath)
 
     for scene in bpy.data.scenes:
-        if scene.sequence_editor and scene.sequence_editor.sequences_all:
-            for seq in scene.sequence_editor.sequences_all:
-                if seq.type == 'IMAGE' and hasattr(seq, 'directory'):
-                    directory = seq.directory
-                    for element in seq.elements:
-                        external_files.add(join(directory, element.filename))
-                elif seq.type == 'MOVIE':
-                    external_files.add(seq.filepath)
+        external_files.update(reference_cache.get_sequencer_files(scene))
 
     assets = set()
     dependencies = set()
 
     for file in sorted(external_files):
-        absolute_file = os.path.abspath(bpy.path.abspath(file))
-        absolute_file_directory = dirname(absolute_file)
-        if basename(absolute_file_directory) == 'latest':
-            target = path_utils.get_target_for_latest_image_sequence_directory(project_root, absolute_file_directory)
-            if target and target not in dependencies:
-                print('We got the target %s from the absolute file %s' % (target, absolute_file))
-                dependencies.add(target)
-        else:
-            try:
-                assets.add(path_utils.replace_absolute_project_prefix(project_root, absolute_file))
-            except ValueError:
-                print('DepRender used relativize on %s ...but it failed!' % absolute_file)
+        (kind, reference) = reference_cache.resolve(project_root, file)
+        if kind == 'dependency':
+            dependencies.add(reference)
+        elif kind == 'asset':
+            assets.add(reference)
 
     return (assets, dependencies)
 
@@ -161,16 +272,18 @@ def generate_render_file(context):
             for target in render_file_dict['targets']:
                 if 'src' in target and target['src'] == source_file:
                     this_target = target
-            if this_target is not None:
-                render_file_dict['targets'].remove(this_target)
 
         # If we haven't found the target we setup a new one.
+        previous_references = None
         if this_target is None:
             (new_target_name, _) = os.path.splitext(basename(source_file))
             this_target = {
                 'src': source_file,
                 'name': new_target_name
             }
+            render_file_dict.setdefault('targets', []).append(this_target)
+        else:
+            previous_references = (set(this_target.get('deps', [])), set(this_target.get('assets', [])))
 
         # We start with a clean slate in terms of determining dependencies.
         (assets, dependencies) = evaluate_references(absolute_project_root)
@@ -184,14 +297,17 @@ def generate_render_file(context):
             for dependency in dependencies:
                 print('  %s' % dependency)
 
-        this_target['deps'] = list(dependencies)
-        this_target['assets'] = list(assets)
+        this_target['deps'] = sorted(dependencies)
+        this_target['assets'] = sorted(assets)
 
-        render_file_dict['targets'].append(this_target)
-        with open(render_file, 'w') as f:
-            # indent=2 pretty prints the json, otherwise it's all on one line.
-            print('Writing new RENDER.json file')
-            json.dump(render_file_dict, f, indent=2)
+        # Rewriting an unchanged file would only bump its modification time (and make sync clients upload it again).
+        if previous_references == (dependencies, assets):
+            print('RENDER.json is up to date')
+        else:
+            with open(render_file, 'w') as f:
+                # indent=2 pretty prints the json, otherwise it's all on one line.
+                print('Writing new RENDER.json file')
+                json.dump(render_file_dict, f, indent=2)
 
         if this_target['name'].startswith('//'):
             full_target = this_target['name']
@@ -207,7 +323,7 @@ def generate_render_file(context):
 class AbstractRenderOperator(bpy.types.Operator):
     _timer = None
 
-    rm = None
+    worker = None
 
     full_target = None
 
@@ -217,14 +333,17 @@ class AbstractRenderOperator(bpy.types.Operator):
             return {'CANCELLED'}
 
         if event.type == 'TIMER':
-            if not self.rm.is_done():
-                self.rm.launch_next_tasks()
-                context.window_manager.progress_update(50)
-            else:
+            # Planning and rendering happen on the worker thread, we only look at how far it's got.
+            status = self.worker.status()
+            if status['state'] in render_worker.FINAL_STATES:
                 wm = context.window_manager
                 wm.event_timer_remove(self._timer)
                 wm.progress_end()
+                if status['state'] == render_worker.FAILED:
+                    self.report({'ERROR'}, 'Render failed: %s' % status['error'])
+                    return {'CANCELLED'}
                 return {'FINISHED'}
+            context.window_manager.progress_update(int(status['progress'] * 100))
 
         return {'PASS_THROUGH'}
 
@@ -237,21 +356,20 @@ class AbstractRenderOperator(bpy.types.Operator):
         task_spec = self.get_task_spec(full_target)
 
         if context.scene.dep_render_settings.render_strategy == 'distributed':
+            # The farm plans the job itself.
+            if self.worker is not None:
+                self.worker.cancel()
             new_render_task_file = join(project_root, RELATIVE_RENDER_TASKS_DIRECTORY,
                                         basename(bpy.data.filepath)) + '.json'
             with open(new_render_task_file, 'w') as f:
                 json.dump(task_spec, f)
             return {'FINISHED'}
 
-        workers = []
-        for i in range(context.scene.dep_render_settings.local_parallelism):
-            workers.append(local_processor.LocalProcessor(project_root))
-
-        self.rm = render_manager.RenderManager(
-            project_root,
-            task_spec,
-            workers
-        )
+        if self.worker is None:
+            # e.g. run from a script rather than through the dialog.
+            self.start_planning(context)
+        # The worker plans the job (usually while the dialog was open) and only renders it once confirmed.
+        self.worker.confirm()
         wm = context.window_manager
         wm.progress_begin(0, 100)
         self._timer = wm.event_timer_add(0.1, context.window)
@@ -259,7 +377,7 @@ class AbstractRenderOperator(bpy.types.Operator):
         return {'RUNNING_MODAL'}
 
     def get_task_spec(self, target):
-        return {
+        task_spec = {
             'target': target,
             'resolution_x': bpy.context.scene.render.resolution_x,
             'resolution_y': bpy.context.scene.render.resolution_y,
@@ -268,17 +386,29 @@ class AbstractRenderOperator(bpy.types.Operator):
             'end_frame': bpy.context.scene.frame_end,
         }
 
+        settings = bpy.context.scene.dep_render_settings
+        if settings.preview_stride > 1:
+            task_spec['preview'] = {'stride': settings.preview_stride}
+            if settings.preview_resolution_percentage < 100:
+                task_spec['preview']['resolution_percentage'] = settings.preview_resolution_percentage
+        return task_spec
+
     def draw(self, context):
-        project_root = os.path.abspath(bpy.path.abspath(context.scene.dep_render_settings.project_root))
-        task_spec = self.get_task_spec(self.get_target(context))
-        blend_file_tasks = render_manager.get_blend_file_task_linearized_dag_from_target_task(project_root, task_spec)
+        # Blender redraws the dialog whenever the mouse moves over it so we only look at what the worker planned.
+        blend_file_tasks = self.worker.get_planned_tasks()
         layout = self.layout
 
         row = layout.row()
-        if blend_file_tasks:
+        if blend_file_tasks is None:
+            status = self.worker.status()
+            if status['state'] == render_worker.FAILED:
+                row.label(text='Planning failed: %s' % status['error'])
+            else:
+                row.label(text="Planning...")
+        elif blend_file_tasks:
             for task in blend_file_tasks:
-                if 'blend_file' in task:
-                    row.label(text=basename(task['blend_file']))
+                if task.blend_file:
+                    row.label(text=basename(task.blend_file))
                 else:
                     # Definitely a bug.
                     row.label("Super special secret task.")
@@ -292,15 +422,34 @@ class AbstractRenderOperator(bpy.types.Operator):
             self.full_target = generate_render_file(context)
         return self.full_target
 
+    def start_planning(self, context):
+        """ Starts a worker that plans the job in the background and renders it once execute confirms it."""
+        project_root = os.path.abspath(bpy.path.abspath(context.scene.dep_render_settings.project_root))
+        workers = []
+        for i in range(context.scene.dep_render_settings.local_parallelism):
+            workers.append(local_processor.LocalProcessor(project_root))
+
+        self.worker = render_worker.RenderWorker(
+            project_root,
+            self.get_task_spec(self.get_target(context)),
+            workers,
+            wait_for_confirmation=True,
+        )
+        self.worker.start()
+
     def invoke(self, context, event):
         if not self.get_target(context):
             self.report({'ERROR'}, 'We were unable to determine / create the target to render. Is your .blend file in a "blend_files" directory?')
             return {'CANCELLED'}
+        self.start_planning(context)
         wm = context.window_manager
         return wm.invoke_props_dialog(self, width=400)
 
     def cancel(self, context):
-        self.rm.cancel()
+        self.worker.cancel()
+        if self._timer is None:
+            # The dialog was dismissed before anything started rendering.
+            return
         wm = context.window_manager
         wm.progress_end()
         wm.event_timer_remove(self._timer)
@@ -314,7 +463,11 @@ class RENDER_PT_RenderAsTarget(AbstractRenderOperator):
     def get_task_spec(self, target):
         base_task_spec = super().get_task_spec(target)
         base_task_spec.update({
-            'dependency_invalidation_types': ['FILE_MODIFICATION_TIME', 'RESOLUTION_CHANGE'],
+            'dependency_invalidation_types': [
+                'FILE_MODIFICATION_TIME',
+                'RESOLUTION_CHANGE',
+                'RENDER_SETTINGS_CHANGE',
+            ],
         })
         return base_task_spec
 
@@ -354,6 +507,21 @@ class DepRenderSettings(PropertyGroup):
         description="The number of sub tasks to launch locally to render the scene.",
     )
 
+    preview_stride = IntProperty(
+        name="Preview Stride",
+        default=1,
+        min=1,
+        description="Render every Nth frame first and then fill in the gaps. 1 renders the frames in order.",
+    )
+
+    preview_resolution_percentage = IntProperty(
+        name="Preview Resolution %",
+        default=100,
+        min=1,
+        max=100,
+        description="Resolution of the first pass of a preview render. 100 skips the low resolution pass.",
+    )
+
 
 def register():
     # We explicitly register and unregister all the classes here and below (as opposed to using
@@ -366,9 +534,17 @@ def register():
     bpy.utils.register_class(RENDER_PT_RenderAsFile)
     bpy.utils.register_class(DepRenderSettings)
     bpy.types.Scene.dep_render_settings = PointerProperty(type=DepRenderSettings)
+    (handlers, handler) = get_scene_update_handler()
+    handlers.append(handler)
+    bpy.app.handlers.save_post.append(on_save_post)
+    bpy.app.handlers.load_post.append(on_load_post)
 
 
 def unregister():
+    (handlers, handler) = get_scene_update_handler()
+    handlers.remove(handler)
+    bpy.app.handlers.save_post.remove(on_save_post)
+    bpy.app.handlers.load_post.remove(on_load_post)
     del bpy.types.Scene.dep_render_settings
     bpy.utils.unregister_class(DepRenderPanel)
     bpy.utils.unregister_class(RENDER_PT_RenderAsTarget)
@@ -0,0 +1,163 @@
+""" Memory aware admission control for the Blender processes running on this machine.
+
+Launching two heavy scenes at once can push the machine into swap (or get something OOM killed) which is slower than
+rendering them one after the other. The controller estimates how much memory a blend file task will need and only
+lets it start if that fits in the memory that's currently available.
+"""
+import json
+import os
+from os.path import join
+
+from path_utils import replace_relative_project_prefix
+
+# cgroup v2 and v1 locations of the memory limit and current usage of the cgroup we're running in.
+CGROUP_MEMORY_FILES = [
+    ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+    ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes'),
+]
+
+BYTES_PER_MB = 1024 * 1024
+
+
+def _read_first_line(path):
+    try:
+        with open(path, 'r') as f:
+            return f.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def get_available_memory_mb():
+    """ Returns the memory available to new processes in MB or None if we can't tell (e.g. not on Linux)."""
+    available_mb = None
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available_mb = int(line.split()[1]) / 1024
+                    break
+    except (IOError, OSError):
+        pass
+
+    for (limit_file, usage_file) in CGROUP_MEMORY_FILES:
+        limit = _read_first_line(limit_file)
+        usage = _read_first_line(usage_file)
+        if limit is None or usage is None or not limit.isdigit() or not usage.isdigit():
+            continue
+        cgroup_available_mb = (int(limit) - int(usage)) / BYTES_PER_MB
+        if available_mb is None or cgroup_available_mb < available_mb:
+            available_mb = cgroup_available_mb
+        break
+
+    return available_mb
+
+
+def get_process_rss_mb(pid):
+    """ Returns the resident set size of the process in MB or None if it can't be determined."""
+    try:
+        with open('/proc/%d/status' % pid, 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def get_recorded_peak_memory_mb(done_dict):
+    """ Pulls the peak memory usage out of a DONE.json dict, if it was recorded."""
+    if 'render_telemetry' not in done_dict:
+        return None
+    summary = done_dict['render_telemetry'].get('summary', {})
+    peaks = [summary[key] for key in ['peak_memory_mb', 'peak_rss_mb'] if summary.get(key)]
+    if not peaks:
+        return None
+    return max(peaks)
+
+
+class MemoryAdmissionController:
+    """ Decides whether there's enough memory to start another blend file task.
+
+    The estimate for a task is the largest of the peak_memory_mb declared for its target in RENDER.json, what was
+    recorded in the DONE.json of its last render and what we've seen it use since this controller was created. A
+    single controller should be shared by everything that launches renders on this machine.
+    """
+
+    def __init__(self, project_root, headroom_mb=512, available_memory=get_available_memory_mb):
+        self.project_root = project_root
+        self.headroom_mb = headroom_mb
+        self.available_memory = available_memory
+
+        # blend file -> the largest peak memory usage in MB we've observed.
+        self.learned_peaks = {}
+        self.recorded_peaks = {}
+
+        # status -> the estimate it was admitted with.
+        self.running = {}
+
+    def _get_recorded_peak(self, task):
+        if task.blend_file not in self.recorded_peaks:
+            peak = None
+            if task.output_directory is not None:
+                done_file = join(replace_relative_project_prefix(self.project_root, task.output_directory), 'DONE.json')
+                if os.path.exists(done_file):
+                    try:
+                        with open(done_file, 'r') as f:
+                            peak = get_recorded_peak_memory_mb(json.load(f))
+                    except ValueError:
+                        print('Unable to read %s' % done_file)
+            self.recorded_peaks[task.blend_file] = peak
+        return self.recorded_peaks[task.blend_file]
+
+    def estimate_peak_mb(self, task):
+        """ Returns the estimated peak memory usage of the task in MB or None if we have nothing to go on."""
+        estimates = [estimate for estimate in [
+            task.peak_memory_mb,
+            self._get_recorded_peak(task),
+            self.learned_peaks.get(task.blend_file),
+        ] if estimate]
+        if not estimates:
+            return None
+        return max(estimates)
+
+    def _get_reserved_mb(self):
+        """ Memory that the running tasks haven't allocated yet but are expected to."""
+        reserved = 0
+        for (status, estimate) in self.running.items():
+            if estimate is None:
+                continue
+            current = getattr(status, 'current_rss_mb', None) or 0
+            reserved += max(0, estimate - current)
+        return reserved
+
+    def get_admissible_count(self, task, max_count):
+        """ Returns how many copies of task (e.g. chunks of the same blend file) can be started right now.
+
+        If nothing is running we always allow one so that a task that's larger than the machine still gets a chance.
+        """
+        estimate = self.estimate_peak_mb(task)
+        available = self.available_memory()
+        if estimate is None or available is None:
+            return max_count
+
+        budget = available - self._get_reserved_mb() - self.headroom_mb
+        count = min(max_count, max(0, int(budget // estimate)))
+        if count == 0 and not self.running:
+            return 1
+        return count
+
+    def admit(self, task):
+        return self.get_admissible_count(task, 1) == 1
+
+    def on_launch(self, status):
+        self.running[status] = self.estimate_peak_mb(status.task_spec)
+
+    def on_finish(self, status):
+        self.running.pop(status, None)
+        observed_peaks = [peak for peak in [
+            getattr(status, 'peak_rss_mb', None),
+            status.get_peak_memory_mb() if hasattr(status, 'get_peak_memory_mb') else None,
+        ] if peak]
+        if observed_peaks:
+            blend_file = status.task_spec.blend_file
+            self.learned_peaks[blend_file] = max([self.learned_peaks.get(blend_file, 0)] + observed_peaks)
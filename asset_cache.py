@@ -0,0 +1,237 @@
+""" Node local cache of the files renders read from the project drive.
+
+Every chunk of a shot reads the same textures and dependency image sequences over the network. The cache copies them
+to local storage once, in parallel, before Blender starts and the settings script points Blender at the copies.
+
+Files are cached per source directory (cache/<hash of the directory>/<file name>) so that a directory of frames maps
+to a single cached directory. A cached file is used as long as the size and modification time of the original
+haven't changed. The least recently used files are evicted once the cache grows past its size limit, except for the
+ones a running render is using.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename, dirname, isdir, isfile, join
+
+from path_utils import replace_relative_project_prefix
+
+INDEX_FILE_NAME = 'index.json'
+DEFAULT_MAX_CACHE_SIZE_MB = 20 * 1024
+BYTES_PER_MB = 1024 * 1024
+
+# How many tasks have their files staged at once across every processor in this process.
+MAX_CONCURRENT_STAGES = 4
+
+_staging_pool = None
+
+
+# Run inside Blender (as part of the settings script) to point everything that reads a cached file at the copy.
+# Linked datablocks can't be changed and libraries themselves aren't cached since the relative paths inside them would
+# stop resolving once they're moved.
+REMAP_SCRIPT = '''
+import os
+
+def _get_cached_path(path):
+    absolute_path = os.path.normpath(bpy.path.abspath(path))
+    cached_directory = _cached_directories.get(os.path.dirname(absolute_path))
+    if cached_directory is None:
+        return None
+    cached_path = os.path.join(cached_directory, os.path.basename(absolute_path))
+    return cached_path if os.path.exists(cached_path) else None
+
+for _datablock in list(bpy.data.images) + list(bpy.data.sounds):
+    if _datablock.library is not None or not _datablock.filepath:
+        continue
+    _source_directory = os.path.dirname(os.path.normpath(bpy.path.abspath(_datablock.filepath)))
+    # Only every frame of an image sequence will do.
+    if getattr(_datablock, 'source', None) == 'SEQUENCE' and _source_directory not in _complete_directories:
+        continue
+    _cached_path = _get_cached_path(_datablock.filepath)
+    if _cached_path is not None:
+        _datablock.filepath = _cached_path
+
+for _scene in bpy.data.scenes:
+    if not _scene.sequence_editor:
+        continue
+    for _strip in _scene.sequence_editor.sequences_all:
+        if _strip.type == 'IMAGE':
+            _source_directory = os.path.normpath(bpy.path.abspath(_strip.directory))
+            if _source_directory in _complete_directories:
+                _strip.directory = _cached_directories[_source_directory] + os.sep
+        elif _strip.type == 'MOVIE':
+            _cached_path = _get_cached_path(_strip.filepath)
+            if _cached_path is not None:
+                _strip.filepath = _cached_path
+'''
+
+
+def get_staging_pool():
+    """ Returns the thread pool that stages the files of every task in this process in the background."""
+    global _staging_pool
+    if _staging_pool is None:
+        _staging_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_STAGES)
+    return _staging_pool
+
+
+def get_cached_directory(cache_directory, source_directory):
+    return join(cache_directory, hashlib.sha1(source_directory.encode('utf-8')).hexdigest()[:16])
+
+
+def get_source_files(project_root, input_files):
+    """ Expands the project relative input files of a task into absolute file paths.
+
+    :return: a (files, directories) tuple, directories being the ones whose every file is in files.
+    """
+    files = []
+    directories = []
+    for input_file in input_files:
+        path = replace_relative_project_prefix(project_root, input_file)
+        if isdir(path):
+            directories.append(path)
+            files.extend(join(path, name) for name in sorted(os.listdir(path)) if isfile(join(path, name)))
+        elif isfile(path):
+            files.append(path)
+    return (files, directories)
+
+
+class AssetCache:
+    """ A size limited LRU cache of project files on local storage, shared by every processor on the machine."""
+
+    def __init__(self, cache_directory, max_size_mb=DEFAULT_MAX_CACHE_SIZE_MB, max_workers=8):
+        self.cache_directory = cache_directory
+        self.max_size_bytes = max_size_mb * BYTES_PER_MB
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+
+        # source path -> {'size', 'mtime', 'last_used'} of the cached copy.
+        self.index = {}
+        # source path -> how many running renders are using it.
+        self.pins = {}
+
+        os.makedirs(cache_directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        index_file = join(self.cache_directory, INDEX_FILE_NAME)
+        if not os.path.exists(index_file):
+            return
+        try:
+            with open(index_file, 'r') as f:
+                index = json.load(f)
+        except ValueError:
+            print('Unable to read %s, starting with an empty cache.' % index_file)
+            return
+        self.index = {source: entry for (source, entry) in index.items() if isfile(self.get_cached_path(source))}
+
+    def _save_index(self):
+        index_file = join(self.cache_directory, INDEX_FILE_NAME)
+        temporary_file = index_file + '.tmp'
+        with open(temporary_file, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(temporary_file, index_file)
+
+    def get_cached_path(self, source):
+        return join(get_cached_directory(self.cache_directory, dirname(source)), basename(source))
+
+    def _fetch(self, source):
+        """ Makes sure the cached copy of source is up to date. Runs on the worker threads with source pinned."""
+        stat = os.stat(source)
+        with self.lock:
+            entry = self.index.get(source)
+        cached_path = self.get_cached_path(source)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime and \
+                isfile(cached_path):
+            return (source, entry, False)
+
+        os.makedirs(dirname(cached_path), exist_ok=True)
+        temporary_file = cached_path + '.%d.tmp' % threading.get_ident()
+        shutil.copyfile(source, temporary_file)
+        os.replace(temporary_file, cached_path)
+        return (source, {'size': stat.st_size, 'mtime': stat.st_mtime}, True)
+
+    def stage(self, sources):
+        """ Copies whatever isn't cached yet and pins the files until release() is called with them.
+
+        :return: the sources that are now available in the cache.
+        """
+        staged = []
+        copied_bytes = 0
+        with self.lock:
+            # Otherwise another stage() could evict a cached copy between us checking it and pinning it.
+            for source in sources:
+                self.pins[source] = self.pins.get(source, 0) + 1
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._fetch, source) for source in sources]
+        now = time.time()
+        with self.lock:
+            for (source, future) in zip(sources, futures):
+                if future.exception() is not None:
+                    # Blender will just read the original.
+                    print('Unable to cache %s: %s' % (source, future.exception()))
+                    self._unpin(source)
+                    continue
+                (_, entry, copied) = future.result()
+                if copied:
+                    copied_bytes += entry['size']
+                self.index[source] = dict(entry, last_used=now)
+                staged.append(source)
+            self._evict()
+            self._save_index()
+        print('Staged %d files (%.1f MB copied)' % (len(staged), copied_bytes / BYTES_PER_MB))
+        return staged
+
+    def release(self, sources):
+        with self.lock:
+            for source in sources:
+                self._unpin(source)
+
+    def _unpin(self, source):
+        if source not in self.pins:
+            return
+        self.pins[source] -= 1
+        if not self.pins[source]:
+            del self.pins[source]
+
+    def get_settings_script(self, staged_sources, directories):
+        """ Returns the lines of python that make Blender read the staged files from the cache.
+
+        :param directories: the directories that were staged as a whole, image sequences are only remapped to a
+            cached directory that has all of their frames.
+        """
+        staged_sources = set(staged_sources)
+        cached_directories = {}
+        for source in staged_sources:
+            cached_directories[os.path.normpath(dirname(source))] = get_cached_directory(self.cache_directory,
+                                                                                        dirname(source))
+        complete_directories = []
+        for directory in directories:
+            files = [join(directory, name) for name in os.listdir(directory) if isfile(join(directory, name))]
+            if all(file in staged_sources for file in files):
+                complete_directories.append(os.path.normpath(directory))
+        return [
+            '_cached_directories = %r\n' % cached_directories,
+            '_complete_directories = %r\n' % sorted(complete_directories),
+            REMAP_SCRIPT,
+        ]
+
+    def get_size(self):
+        return sum(entry['size'] for entry in self.index.values())
+
+    def _evict(self):
+        size = self.get_size()
+        if size <= self.max_size_bytes:
+            return
+        for source in sorted(self.index, key=lambda source: self.index[source]['last_used']):
+            if size <= self.max_size_bytes:
+                break
+            if source in self.pins:
+                continue
+            size -= self.index.pop(source)['size']
+            try:
+                os.remove(self.get_cached_path(source))
+            except OSError:
+                pass
@@ -1,9 +1,15 @@
 import glob
 import json
 import os
+import time
+import traceback
 from os.path import join
 
 # keeping local import separate
+import admission
+import asset_cache
+import job_registry
+import journal
 import local_processor
 import render_manager
 
@@ -12,27 +18,92 @@ def check_for_new_tasks():
     animation_project_root_directory = os.environ['ANIMATION_PROJECT_ROOT']
     render_tasks_directory = join(animation_project_root_directory, 'Render Tasks')
     new_tasks_directory = join(render_tasks_directory, 'new')
+    # Task files we couldn't plan are moved here so that they can be looked at (and resubmitted).
+    failed_tasks_directory = join(render_tasks_directory, 'failed')
 
     os.chdir(new_tasks_directory)
 
-    task_filenames = glob.glob('*.json')
+    # Frames are rendered to fast local storage first if the machine has some.
+    scratch_directory = os.environ.get('RENDER_SCRATCH_DIRECTORY')
 
-    if task_filenames:
-        task_filename = task_filenames[0]
+    # And the textures and image sequences they read are copied to a local cache before they're rendered.
+    cache = None
+    if os.environ.get('RENDER_ASSET_CACHE_DIRECTORY'):
+        cache = asset_cache.AssetCache(
+            os.environ['RENDER_ASSET_CACHE_DIRECTORY'],
+            int(os.environ.get('RENDER_ASSET_CACHE_MB', asset_cache.DEFAULT_MAX_CACHE_SIZE_MB)))
+    processors = [local_processor.LocalProcessor(animation_project_root_directory, scratch_directory, cache),
+                  local_processor.LocalProcessor(animation_project_root_directory, scratch_directory, cache),
+                  local_processor.LocalProcessor(animation_project_root_directory, scratch_directory, cache)]
 
-        with open(task_filename, 'r') as f:
-            task_spec = json.load(f)
-        os.remove(join(new_tasks_directory, task_filename))
+    # All of the jobs share the processors and a registry so that a dependency that several of them need is only
+    # rendered once.
+    registry = job_registry.JobRegistry()
 
-        rm = render_manager.RenderManager(
+    # Likewise they share the memory on this machine.
+    admission_controller = admission.MemoryAdmissionController(animation_project_root_directory)
+    render_managers = []
+
+    # Small tasks are batched up to this many seconds of predicted rendering per Blender process if it's set.
+    batch_duration_budget = None
+    if os.environ.get('RENDER_BATCH_SECONDS'):
+        batch_duration_budget = float(os.environ['RENDER_BATCH_SECONDS'])
+
+    # Pick up whatever the last run of autorender didn't get to finish.
+    for recovered_job in journal.recover_jobs(animation_project_root_directory):
+        print('Resuming job from %s' % recovered_job.path)
+        render_managers.append(render_manager.RenderManager(
             animation_project_root_directory,
-            task_spec,
-            [local_processor.LocalProcessor(animation_project_root_directory),
-             local_processor.LocalProcessor(animation_project_root_directory),
-             local_processor.LocalProcessor(animation_project_root_directory)]
-        )
+            recovered_job.task_spec,
+            processors,
+            registry,
+            admission_controller,
+            journal=journal.SchedulerJournal.create(animation_project_root_directory),
+            tasks=recovered_job.get_unfinished_tasks(),
+            resumed_outputs=recovered_job.get_resumed_outputs(),
+            batch_duration_budget=batch_duration_budget,
+            job=recovered_job.job,
+        ))
+        # The new journal has everything that's left so the old one can go.
+        os.remove(recovered_job.path)
+
+    while True:
+        for task_filename in sorted(glob.glob('*.json')):
+            scheduler_journal = journal.SchedulerJournal.create(animation_project_root_directory)
+            try:
+                with open(task_filename, 'r') as f:
+                    task_spec = json.load(f)
+
+                render_managers.append(render_manager.RenderManager(
+                    animation_project_root_directory,
+                    task_spec,
+                    processors,
+                    registry,
+                    admission_controller,
+                    journal=scheduler_journal,
+                    batch_duration_budget=batch_duration_budget,
+                ))
+            except Exception:
+                # One bad task file (broken JSON, a target that doesn't exist, ...) shouldn't stop every other job.
+                traceback.print_exc()
+                print('Unable to plan %s, moving it to %s' % (task_filename, failed_tasks_directory))
+                scheduler_journal.close(delete=True)
+                os.makedirs(failed_tasks_directory, exist_ok=True)
+                os.replace(join(new_tasks_directory, task_filename), join(failed_tasks_directory, task_filename))
+                continue
+
+            # The job is in the journal now so we can let go of the task file.
+            os.remove(join(new_tasks_directory, task_filename))
+
+        for rm in render_managers:
+            rm.launch_next_tasks()
+        render_managers = [rm for rm in render_managers if not rm.is_done()]
+
+        if not render_managers:
+            break
 
-        rm.blocking_render()
+        # Jobs submitted while we're rendering are picked up on the next pass.
+        time.sleep(5)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+""" Renders several blend files one after the other in a single Blender process. Runs inside Blender:
+
+    blender -b -P batch_render.py -- path/to/batch.json
+
+batch.json (written by the local processor) lists the blend file, settings script, output format and frame range of
+every task. A task that fails is reported and the batch moves on to the next one.
+"""
+import json
+import sys
+import traceback
+
+import bpy
+
+
+def render_task(task):
+    bpy.ops.wm.open_mainfile(filepath=task['blend_file'], load_ui=False)
+
+    # Same as passing the settings script with -P after the blend file.
+    with open(task['settings_script'], 'r') as f:
+        exec(compile(f.read(), task['settings_script'], 'exec'), {'__name__': '__main__'})
+
+    scene = bpy.context.scene
+    scene.render.filepath = task['output_format']
+    if task['start_frame'] is not None and task['end_frame'] is not None:
+        scene.frame_start = task['start_frame']
+        scene.frame_end = task['end_frame']
+        if task['frame_step']:
+            scene.frame_step = task['frame_step']
+
+    if 'FINISHED' not in bpy.ops.render.render(animation=True):
+        raise RuntimeError('Rendering %s was cancelled.' % task['blend_file'])
+
+
+def main():
+    with open(sys.argv[sys.argv.index('--') + 1], 'r') as f:
+        batch_spec = json.load(f)
+    for (index, task) in enumerate(batch_spec['tasks']):
+        # The local processor splits Blender's output between the tasks by these lines.
+        print('Batch task %d started' % index, flush=True)
+        returncode = 0
+        try:
+            render_task(task)
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        print('Batch task %d finished: %d' % (index, returncode), flush=True)
+
+
+main()
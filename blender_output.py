@@ -0,0 +1,132 @@
+""" Parsing of Blender's console output into per frame render telemetry."""
+import queue
+import re
+import threading
+
+# Blender 2.7x prints "Fra:12 Mem:120.53M (0.00M, Peak 245.10M) | Time:00:01.23 | ..." whereas 2.80 and later drop the
+# mmap memory: "Fra:12 Mem:120.53M (Peak 245.10M) | Time:00:01.23 | ...".
+FRAME_PROGRESS_PATTERN = re.compile(r'^Fra:(\d+) Mem:[\d.]+M \((?:[\d.]+M, )?Peak ([\d.]+)M\)')
+
+# Blender 2.7x prints "Saved: /path/frame_00012.png Time: 00:01.52 (Saving: 00:00.03)" whereas newer versions print
+# "Saved: '/path/frame_00012.png'" followed by " Time: 00:01.52 (Saving: 00:00.03)" on the next line.
+SAVED_PATTERN = re.compile(r"^Saved: '?(.+?)'?(?: Time: ([\d:.]+) \(Saving: [\d:.]+\))?$")
+TIME_PATTERN = re.compile(r'^\s*Time: ([\d:.]+) \(Saving: [\d:.]+\)')
+
+
+def parse_duration(duration):
+    """ Converts Blender's [[hh:]mm:]ss.ss durations to seconds."""
+    seconds = 0.0
+    for part in duration.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class FrameTelemetry:
+    __slots__ = ('frame', 'render_time', 'peak_memory_mb', 'output_file')
+
+    def __init__(self, frame, peak_memory_mb, output_file):
+        self.frame = frame
+        self.render_time = None
+        self.peak_memory_mb = peak_memory_mb
+        self.output_file = output_file
+
+    def to_list(self):
+        return [self.frame, self.render_time, self.peak_memory_mb]
+
+
+class BlenderOutputParser:
+    """ Accumulates per frame timing and memory usage from the lines Blender prints while rendering."""
+
+    def __init__(self):
+        self.frames = []
+        self.current_frame = None
+        self.current_frame_peak_memory_mb = 0.0
+        self.peak_memory_mb = 0.0
+
+    def feed(self, line):
+        line = line.rstrip('\r\n')
+
+        match = FRAME_PROGRESS_PATTERN.match(line)
+        if match:
+            frame = int(match.group(1))
+            peak_memory_mb = float(match.group(2))
+            if frame != self.current_frame:
+                self.current_frame = frame
+                self.current_frame_peak_memory_mb = 0.0
+            self.current_frame_peak_memory_mb = max(self.current_frame_peak_memory_mb, peak_memory_mb)
+            self.peak_memory_mb = max(self.peak_memory_mb, peak_memory_mb)
+            return
+
+        match = SAVED_PATTERN.match(line)
+        if match:
+            frame_telemetry = FrameTelemetry(self.current_frame, self.current_frame_peak_memory_mb, match.group(1))
+            if match.group(2):
+                frame_telemetry.render_time = parse_duration(match.group(2))
+            self.frames.append(frame_telemetry)
+            return
+
+        match = TIME_PATTERN.match(line)
+        if match and self.frames and self.frames[-1].render_time is None:
+            self.frames[-1].render_time = parse_duration(match.group(1))
+
+    @classmethod
+    def merge(cls, parsers):
+        """ Combines the telemetry of several renders into the same output directory, e.g. the chunks of a task."""
+        merged = cls()
+        for parser in parsers:
+            merged.frames.extend(parser.frames)
+            merged.peak_memory_mb = max(merged.peak_memory_mb, parser.peak_memory_mb)
+        merged.frames.sort(key=lambda frame_telemetry: frame_telemetry.frame or 0)
+        return merged
+
+    def get_completed_frames(self):
+        return [frame_telemetry.frame for frame_telemetry in self.frames]
+
+    def get_summary(self):
+        render_times = [frame.render_time for frame in self.frames if frame.render_time is not None]
+        summary = {
+            'frames_rendered': len(self.frames),
+            'peak_memory_mb': self.peak_memory_mb,
+        }
+        if render_times:
+            summary.update({
+                'total_render_time': sum(render_times),
+                'mean_frame_time': sum(render_times) / len(render_times),
+                'max_frame_time': max(render_times),
+            })
+        return summary
+
+    def to_dict(self):
+        """ A compact representation for the status files: the summary plus one [frame, seconds, peak MB] triple per
+        rendered frame.
+        """
+        return {
+            'summary': self.get_summary(),
+            'frames': [frame.to_list() for frame in self.frames],
+        }
+
+
+class NonBlockingLineReader:
+    """ Reads lines from a stream on a background thread so that they can be collected without blocking."""
+
+    def __init__(self, stream):
+        self.lines = queue.Queue()
+        self.thread = threading.Thread(target=self._read, args=(stream,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read(self, stream):
+        for line in iter(stream.readline, ''):
+            self.lines.put(line)
+        stream.close()
+
+    def read_available_lines(self, wait_for_eof=False):
+        """ Returns the lines read so far. If wait_for_eof is set this waits for the stream to be closed first."""
+        if wait_for_eof:
+            self.thread.join()
+        lines = []
+        while True:
+            try:
+                lines.append(self.lines.get_nowait())
+            except queue.Empty:
+                return lines
@@ -0,0 +1,119 @@
+""" Replaces byte-identical rendered frames with hardlinks.
+
+Held and static frames are written out as separate full size files, both within a sequence and again in every
+archived render next to latest. This finds the duplicates and hardlinks them together.
+
+    python dedup.py path/to/image_sequences/latest [--report report.json]
+
+deduplicates latest and all of the archived renders next to it.
+"""
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname, isdir, join
+
+from post_render import FRAME_PREFIX
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def list_frame_files(directories):
+    frame_files = []
+    for directory in directories:
+        if not isdir(directory):
+            continue
+        for file in sorted(os.listdir(directory)):
+            if file.startswith(FRAME_PREFIX):
+                frame_files.append(join(directory, file))
+    return frame_files
+
+
+def get_sibling_render_directories(latest_directory):
+    """ Returns latest followed by the archived render directories next to it."""
+    latest_directory = latest_directory.rstrip('/\\')
+    image_sequence_directory = dirname(latest_directory)
+    siblings = [join(image_sequence_directory, name) for name in sorted(os.listdir(image_sequence_directory))]
+    return [latest_directory] + [sibling for sibling in siblings if isdir(sibling) and sibling != latest_directory]
+
+
+def link_duplicate(original, duplicate):
+    # We link to a temporary name first so that the duplicate is replaced atomically and never goes missing.
+    temporary_file = duplicate + '.dedup'
+    os.link(original, temporary_file)
+    os.replace(temporary_file, duplicate)
+
+
+def deduplicate(directories, max_workers=None):
+    """ Hardlinks byte-identical frames in the given directories together.
+
+    Only files whose size matches another file's are hashed, on a pool of worker threads (hashing releases the GIL).
+    The first file of each set of duplicates (in the order of directories) is kept.
+
+    :return: a dict with the number of bytes saved and files linked.
+    """
+    files_by_size = {}
+    for path in list_frame_files(directories):
+        stat = os.stat(path)
+        # Hardlinks can't cross devices so files on different devices are never duplicates of each other.
+        files_by_size.setdefault((stat.st_dev, stat.st_size), []).append((path, stat.st_ino, stat.st_nlink))
+
+    candidates = [files for files in files_by_size.values() if len({inode for (_, inode, _) in files}) > 1]
+    candidate_paths = [path for files in candidates for (path, _, _) in files]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        digests = dict(zip(candidate_paths, pool.map(hash_file, candidate_paths)))
+
+    bytes_saved = 0
+    files_linked = 0
+    for ((_, size), files) in files_by_size.items():
+        originals = {}
+        for (path, inode, link_count) in files:
+            if path not in digests:
+                continue
+            (original, original_inode) = originals.setdefault(digests[path], (path, inode))
+            if inode == original_inode:
+                continue
+            link_duplicate(original, path)
+            files_linked += 1
+            # If something else still links to the duplicate's data we haven't actually freed anything.
+            if link_count == 1:
+                bytes_saved += size
+
+    return {
+        'bytes_saved': bytes_saved,
+        'files_linked': files_linked,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hardlink identical frames in a render and its archived renders.')
+    parser.add_argument('latest_directory', help='The latest image sequence directory of a target.')
+    parser.add_argument('--report', help='Write the result to this JSON file.')
+    parser.add_argument('--no-archived', action='store_true', help="Don't link against the archived renders.")
+    args = parser.parse_args()
+
+    if args.no_archived:
+        directories = [args.latest_directory]
+    else:
+        directories = get_sibling_render_directories(args.latest_directory)
+
+    result = deduplicate(directories)
+    print('Linked %d duplicate frames, saving %.1f MB' % (result['files_linked'], result['bytes_saved'] / 1e6))
+
+    if args.report:
+        os.makedirs(dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
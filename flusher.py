@@ -0,0 +1,113 @@
+""" Moves frames rendered to local scratch storage onto the project drive in the background.
+
+Rendering straight into the project drive means a network write per frame while Blender waits, and other artists
+see half written frames in latest. Staged renders write to fast local storage instead and a FrameFlusher copies the
+finished frames over in batches on a small shared thread pool, each one showing up in latest with a single rename.
+"""
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename, join
+
+from post_render import list_frames
+
+# How many batches are copied to the project drive at once across every task in this process.
+MAX_CONCURRENT_FLUSHES = 4
+FLUSH_BATCH_SIZE = 8
+
+_flush_pool = None
+
+
+def get_flush_pool():
+    """ Returns the thread pool shared by the flushers of every task in this process."""
+    global _flush_pool
+    if _flush_pool is None:
+        _flush_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FLUSHES)
+    return _flush_pool
+
+
+def flush_frames(frames, output_directory):
+    """ Copies the frames into output_directory and removes them from scratch once they're safely there."""
+    for frame in frames:
+        destination = join(output_directory, basename(frame))
+        temporary_file = destination + '.flushing'
+        # A plain copy rather than copy2 so that the frame is newer than anything derived from an older render.
+        shutil.copyfile(frame, temporary_file)
+        os.replace(temporary_file, destination)
+        os.remove(frame)
+    return len(frames)
+
+
+class FrameFlusher:
+    """ Flushes frames from a scratch directory into the output directory as they're reported finished.
+
+    Frames Blender doesn't tell us about are picked up from the scratch directory once the render has finished.
+    """
+
+    def __init__(self, scratch_directory, output_directory, pool=None, batch_size=FLUSH_BATCH_SIZE):
+        self.scratch_directory = scratch_directory
+        self.output_directory = output_directory
+        self.pool = pool
+        self.batch_size = batch_size
+
+        self.known_frames = set()
+        self.pending_frames = []
+        # (future, number of frames) for the batches that have been submitted.
+        self.batches = []
+        self.flushed_frames = 0
+        self.errors = []
+        self.cancelled = False
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = get_flush_pool()
+        return self.pool
+
+    def add(self, frame):
+        if frame not in self.known_frames:
+            self.known_frames.add(frame)
+            self.pending_frames.append(frame)
+
+    def poll(self, render_finished=False):
+        if self.cancelled:
+            return
+        if render_finished:
+            for frame_name in list_frames(self.scratch_directory):
+                self.add(join(self.scratch_directory, frame_name))
+
+        # Whatever landed since the last poll goes out in batches of up to batch_size frames.
+        while self.pending_frames:
+            batch = self.pending_frames[:self.batch_size]
+            del self.pending_frames[:self.batch_size]
+            self.batches.append((self._get_pool().submit(flush_frames, batch, self.output_directory), len(batch)))
+
+        still_running = []
+        for (future, num_frames) in self.batches:
+            if not future.done():
+                still_running.append((future, num_frames))
+            elif future.cancelled():
+                continue
+            elif future.exception() is not None:
+                print('Unable to flush frames to %s: %s' % (self.output_directory, future.exception()))
+                self.errors.append(str(future.exception()))
+            else:
+                self.flushed_frames += future.result()
+        self.batches = still_running
+
+    def get_backlog(self):
+        """ Returns how many frames are still waiting to be flushed or being flushed."""
+        return len(self.pending_frames) + sum(num_frames for (_, num_frames) in self.batches)
+
+    def is_done(self):
+        return not self.pending_frames and not self.batches
+
+    def cleanup(self):
+        shutil.rmtree(self.scratch_directory, ignore_errors=True)
+
+    def cancel(self):
+        self.cancelled = True
+        self.pending_frames = []
+        for (future, _) in self.batches:
+            future.cancel()
+        self.batches = []
+        self.cleanup()
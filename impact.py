@@ -0,0 +1,97 @@
+""" Answers "which targets rerender if I change this?" along with a rough estimate of what that will cost.
+
+    python impact.py //textures/brick.png //episode_1/shot_010:shot_010 ...
+
+Files can also be given as regular (absolute or working directory relative) paths.
+"""
+import argparse
+import json
+import os
+from os.path import join
+
+import render_graph
+from path_utils import replace_absolute_project_prefix
+from render_task import Target
+
+
+def get_estimated_render_time(project_root, target_name):
+    """ Returns how long the latest render of the target took in seconds or None if we don't know."""
+    done_file = join(Target(project_root, target_name).latest_directory, 'DONE.json')
+    if not os.path.exists(done_file):
+        return None
+    with open(done_file, 'r') as f:
+        done_dict = json.load(f)
+
+    summary = done_dict.get('render_telemetry', {}).get('summary', {})
+    if 'total_render_time' in summary:
+        return summary['total_render_time']
+    if 'start_time' in done_dict and 'completion_time' in done_dict:
+        return done_dict['completion_time'] - done_dict['start_time']
+    return None
+
+
+def normalize_change(project_root, change):
+    """ Targets and '//' paths are used as is, anything else is treated as a path on disk."""
+    if change.startswith('//'):
+        return change
+    return replace_absolute_project_prefix(project_root, os.path.abspath(change))
+
+
+def get_impacted_targets(project_root, changes, rg=None):
+    """ Returns the targets that would be rerendered if all of the given targets or assets changed.
+
+    :param changes: targets (e.g. "//some/path:target") and/or asset paths relative to the project root.
+    :return: a list of (target, estimated render time in seconds or None) tuples, nearest dependents first.
+    """
+    if rg is None:
+        rg = render_graph.RenderGraph()
+        rg.add_project(project_root)
+
+    impacted_targets = []
+    seen = set()
+    for change in changes:
+        # A changed target has to be rerendered itself.
+        candidates = [change] if change in rg.targets else []
+        candidates.extend(rg.get_transitive_dependents(change))
+        for target_name in candidates:
+            if target_name not in seen:
+                seen.add(target_name)
+                impacted_targets.append(target_name)
+
+    return [(target_name, get_estimated_render_time(project_root, target_name)) for target_name in impacted_targets]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List the targets that rerender when the given inputs change.')
+    parser.add_argument('changes', nargs='+', help='Targets, or asset or blend file paths.')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON.')
+    args = parser.parse_args()
+
+    project_root = os.environ['ANIMATION_PROJECT_ROOT']
+    changes = [normalize_change(project_root, change) for change in args.changes]
+    impacted_targets = get_impacted_targets(project_root, changes)
+
+    if args.json:
+        print(json.dumps([{'target': target_name, 'estimated_render_time': estimate}
+                          for (target_name, estimate) in impacted_targets], indent=2))
+        return
+
+    if not impacted_targets:
+        print('Nothing depends on %s' % ', '.join(changes))
+        return
+
+    total = 0
+    unknown = 0
+    for (target_name, estimate) in impacted_targets:
+        if estimate is None:
+            unknown += 1
+            print('  %s (never rendered)' % target_name)
+        else:
+            total += estimate
+            print('  %s (~%.0fs)' % (target_name, estimate))
+    print('%d targets, estimated render time %.1f hours' % (len(impacted_targets), total / 3600) +
+          (' plus %d never rendered' % unknown if unknown else ''))
+
+
+if __name__ == "__main__":
+    main()
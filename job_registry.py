@@ -0,0 +1,122 @@
+""" Bookkeeping for blend file tasks that are shared between concurrently running render jobs."""
+import threading
+
+# The blend file task fields that change the pixels that end up in the output directory. Two blend file tasks that
+# agree on all of these will produce the same render so only one of them needs to run.
+RENDER_RELEVANT_KEYS = [
+    'blend_file',
+    'output_directory',
+    'resolution_x',
+    'resolution_y',
+    'resolution_percentage',
+    'start_frame',
+    'end_frame',
+    'frame_step',
+    'render_profile',
+    'border',
+]
+
+
+def get_task_key(task_spec):
+    return tuple(getattr(task_spec, key) for key in RENDER_RELEVANT_KEYS)
+
+
+class SharedTask:
+    def __init__(self, task_spec, owner):
+        self.task_spec = task_spec
+        self.owner = owner
+        self.attached_jobs = []
+
+    def jobs(self):
+        return [self.owner] + self.attached_jobs
+
+
+class JobRegistry:
+    """ Keeps track of which blend file tasks are queued or running and which job is responsible for them.
+
+    A job (e.g. a RenderManager) claims each of the blend file tasks it plans. If another job has already claimed an
+    identical task the new job is attached to it instead and is notified through on_shared_task_complete once the
+    owner has finished rendering it.
+
+    Tasks that only differ in e.g. resolution or frame range aren't shared but still render into the same output
+    directory, so a job also has to acquire the output directory of a task before rendering it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shared_tasks = {}
+        # Output directory -> the job that's rendering into it.
+        self._output_directory_jobs = {}
+
+    def claim(self, task_spec, job):
+        """ Claims the task for the job.
+
+        :return: True if the job is now responsible for rendering the task, False if it was attached to a task that
+                 another job has already queued or started.
+        """
+        key = get_task_key(task_spec)
+        with self._lock:
+            shared_task = self._shared_tasks.get(key)
+            if shared_task is None:
+                self._shared_tasks[key] = SharedTask(task_spec, job)
+                return True
+            if shared_task.owner is not job and job not in shared_task.attached_jobs:
+                shared_task.attached_jobs.append(job)
+            return shared_task.owner is job
+
+    def complete(self, task_spec, returncode):
+        """ Marks the task as finished and notifies the owner and every attached job."""
+        with self._lock:
+            shared_task = self._shared_tasks.pop(get_task_key(task_spec), None)
+        if shared_task is None:
+            return
+        for job in shared_task.jobs():
+            job.on_shared_task_complete(task_spec, returncode)
+
+    def acquire_output_directory(self, task_spec, job):
+        """ Reserves the output directory of the task for the job until release_output_directory is called.
+
+        :return: False if another job is rendering into it.
+        """
+        with self._lock:
+            owner = self._output_directory_jobs.setdefault(task_spec.output_directory, job)
+            return owner is job
+
+    def release_output_directory(self, output_directory, job):
+        with self._lock:
+            if self._output_directory_jobs.get(output_directory) is job:
+                del self._output_directory_jobs[output_directory]
+
+    def release(self, job):
+        """ Gives up everything the job is involved in, e.g. because it was cancelled.
+
+        Tasks that the job owns are handed over to the first attached job (which will have to queue them itself) or
+        forgotten if nobody else is waiting for them.
+        """
+        adopted = []
+        with self._lock:
+            for (output_directory, owner) in list(self._output_directory_jobs.items()):
+                if owner is job:
+                    del self._output_directory_jobs[output_directory]
+            for key, shared_task in list(self._shared_tasks.items()):
+                if job in shared_task.attached_jobs:
+                    shared_task.attached_jobs.remove(job)
+                if shared_task.owner is not job:
+                    continue
+                if shared_task.attached_jobs:
+                    shared_task.owner = shared_task.attached_jobs.pop(0)
+                    adopted.append(shared_task)
+                else:
+                    del self._shared_tasks[key]
+
+        for shared_task in adopted:
+            shared_task.owner.adopt_shared_task(shared_task.task_spec)
+
+    def get_active_jobs(self):
+        """ Returns the jobs that own a task that hasn't completed yet, which includes every job with queued tasks."""
+        with self._lock:
+            return set(shared_task.owner for shared_task in self._shared_tasks.values())
+
+    def is_in_flight(self, task_spec):
+        with self._lock:
+            return get_task_key(task_spec) in self._shared_tasks
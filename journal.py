@@ -0,0 +1,241 @@
+""" Write-ahead journal of scheduler state transitions so that jobs survive the scheduler dying.
+
+Every job appends one JSON object per line to its own journal file:
+
+    {"event": "job", "task_spec": {...}, "job_id": "...", "start_time": 1.0}   the task spec the job was started with.
+    {"event": "planned", "task_id": 0, "task": {...}}          a blend file task was added to the queue.
+    {"event": "tiled", "task_id": 0, "task": {...}}            the task was split into tiles that this task stitches.
+    {"event": "dispatched", "task_id": 0, "chunk_id": 3, "task": {...}}
+    {"event": "pid", "chunk_id": 3, "pid": 1234}
+    {"event": "finished", "chunk_id": 3, "returncode": 0}
+    {"event": "failed", "chunk_id": 3, "returncode": 1}
+    {"event": "shared_finished", "task_id": 1, "returncode": 0}   another job rendered the task for us.
+    {"event": "resumed_output", "task": {...}, "returncode": 0}   a task the job was resumed with partly rendered.
+    {"event": "output_finalized", "output_directory": "//..."}    the status files of the directory were written.
+    {"event": "job_done"}
+
+Writes are fsynced in batches (and immediately for events we can't afford to lose) so that journaling doesn't slow
+down the scheduler loop. The journal of a job is deleted once the job is done so anything left in the journal
+directory on startup belongs to a job that has to be recovered.
+"""
+import glob
+import json
+import os
+import signal
+import time
+import uuid
+from os.path import join
+
+from render_task import BlendFileTask
+
+# Losing one of these means rendering something twice or, worse, losing track of a Blender process.
+DURABLE_EVENTS = ['job', 'pid', 'job_done']
+
+
+def get_journal_directory(project_root):
+    return join(project_root, 'Render Tasks', 'journal')
+
+
+class SchedulerJournal:
+    def __init__(self, path, sync_interval=1.0, sync_batch_size=32):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.sync_batch_size = sync_batch_size
+        self.unsynced_records = 0
+        self.last_sync_time = time.time()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'a')
+
+    @classmethod
+    def create(cls, project_root):
+        """ Creates a journal for a new job in the project's journal directory."""
+        file_name = '%s_%s.jsonl' % (time.strftime('%Y-%m-%d_%H-%M-%S', time.gmtime()), uuid.uuid4().hex[:8])
+        return cls(join(get_journal_directory(project_root), file_name))
+
+    def record(self, event, **fields):
+        fields['event'] = event
+        fields['time'] = time.time()
+        self.file.write(json.dumps(fields) + '\n')
+        self.unsynced_records += 1
+        if event in DURABLE_EVENTS or self.unsynced_records >= self.sync_batch_size or \
+                time.time() - self.last_sync_time >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if not self.unsynced_records:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced_records = 0
+        self.last_sync_time = time.time()
+
+    def close(self, delete=False):
+        self.sync()
+        self.file.close()
+        if delete:
+            os.remove(self.path)
+
+
+class RecoveredJob:
+    """ What's left of a job according to its journal."""
+
+    def __init__(self, path):
+        self.path = path
+        self.task_spec = None
+        # The job the RenderManager was started as (see RenderManager.job), None for journals written before we
+        # recorded it.
+        self.job = None
+        self.done = False
+
+        # task_id -> BlendFileTask for the tasks that were planned.
+        self.planned_tasks = {}
+        # task_ids that had at least one chunk dispatched.
+        self.dispatched_task_ids = set()
+        # chunk_id -> BlendFileTask / pid for the chunks that were dispatched, finished chunks are removed.
+        self.running_chunks = {}
+        self.pids = {}
+        # chunk_id -> task_id of every chunk that was dispatched.
+        self.chunk_task_ids = {}
+        # task_id -> return code of the tasks that had a chunk fail.
+        self.failed_task_returncodes = {}
+        # task_id -> BlendFileTask that stitches the tiles of the tasks that were split into tiles.
+        self.stitch_tasks = {}
+        self.stitched_task_ids = set()
+        # (BlendFileTask, return code) of the tasks a journal of the job that died before this one had left unfinished.
+        self.resumed_outputs = []
+        self.finalized_output_directories = set()
+
+    def apply(self, record):
+        event = record['event']
+        if event == 'job':
+            self.task_spec = record['task_spec']
+            if 'job_id' in record:
+                self.job = {'id': record['job_id'], 'start_time': record['start_time'],
+                            'task_spec': record['task_spec']}
+        elif event == 'planned':
+            self.planned_tasks[record['task_id']] = BlendFileTask.from_dict(record['task'])
+        elif event == 'tiled':
+            self.stitch_tasks[record['task_id']] = BlendFileTask.from_dict(record['task'])
+        elif event == 'dispatched':
+            self.dispatched_task_ids.add(record['task_id'])
+            self.running_chunks[record['chunk_id']] = BlendFileTask.from_dict(record['task'])
+            self.chunk_task_ids[record['chunk_id']] = record['task_id']
+            if self.running_chunks[record['chunk_id']].tile_grid is not None:
+                self.stitched_task_ids.add(record['task_id'])
+        elif event == 'pid':
+            self.pids[record['chunk_id']] = record['pid']
+        elif event == 'shared_finished':
+            self.dispatched_task_ids.add(record['task_id'])
+        elif event in ['finished', 'failed']:
+            if event == 'failed' and record['chunk_id'] in self.chunk_task_ids:
+                self.failed_task_returncodes[self.chunk_task_ids[record['chunk_id']]] = record['returncode']
+            self.running_chunks.pop(record['chunk_id'], None)
+            self.pids.pop(record['chunk_id'], None)
+        elif event == 'resumed_output':
+            self.resumed_outputs.append((BlendFileTask.from_dict(record['task']), record['returncode']))
+        elif event == 'output_finalized':
+            self.finalized_output_directories.add(record['output_directory'])
+        elif event == 'job_done':
+            self.done = True
+
+    def get_orphaned_pids(self):
+        return list(self.pids.values())
+
+    def get_unfinished_tasks(self):
+        """ Returns the tasks that still have to run: the chunks that were running when the scheduler died (which
+        pick up where they left off in their output directory) followed by the tasks that were never dispatched.
+
+        A tiled task whose tiles were still running is planned again from scratch and one whose tiles all finished gets
+        its stitch task.
+        """
+        unfinished_tasks = []
+        retiled_task_ids = self._get_retiled_task_ids()
+        for (chunk_id, chunk) in self.running_chunks.items():
+            if self.chunk_task_ids[chunk_id] not in retiled_task_ids:
+                unfinished_tasks.append(chunk.replace(append_to_output=True))
+        for task_id in sorted(self.planned_tasks):
+            if task_id not in self.dispatched_task_ids or task_id in retiled_task_ids:
+                unfinished_tasks.append(self.planned_tasks[task_id])
+            elif task_id in self.stitch_tasks and task_id not in self.stitched_task_ids and \
+                    task_id not in self.failed_task_returncodes:
+                unfinished_tasks.append(self.stitch_tasks[task_id])
+        return unfinished_tasks
+
+    def get_resumed_outputs(self):
+        """ Returns (task, return code) for the tasks that rendered (some of) their frames before the scheduler died
+        but whose output directory was never finalized, e.g. because its last chunk finished just before we died.
+
+        The output directory is finalized with these once whatever get_unfinished_tasks returns for it is done so that
+        its DONE.json covers the whole task and not just the chunks that were resumed.
+        """
+        retiled_task_ids = self._get_retiled_task_ids()
+        resumed_outputs = list(self.resumed_outputs)
+        for task_id in sorted(set(self.chunk_task_ids.values()) - retiled_task_ids):
+            task = self.planned_tasks[task_id]
+            if task_id in self.stitched_task_ids:
+                # The stitch task knows which tile directories to clean up.
+                task = self.stitch_tasks[task_id]
+            resumed_outputs.append((task, self.failed_task_returncodes.get(task_id, 0)))
+        return [(task, returncode) for (task, returncode) in resumed_outputs
+                if task.output_directory not in self.finalized_output_directories]
+
+    def _get_retiled_task_ids(self):
+        """ Tiles only exist to be stitched so a tiled task whose tiles were still running is planned again from
+        scratch (tiled tasks are short by construction).
+        """
+        return set(self.chunk_task_ids[chunk_id] for (chunk_id, chunk) in self.running_chunks.items()
+                   if chunk.border is not None and self.chunk_task_ids[chunk_id] in self.stitch_tasks)
+
+
+def replay(path):
+    job = RecoveredJob(path)
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line can be cut off if we died halfway through writing it.
+                print('Ignoring corrupt journal entry in %s' % path)
+                continue
+            job.apply(record)
+    return job
+
+
+def is_blender_process(pid):
+    try:
+        with open('/proc/%d/cmdline' % pid, 'rb') as f:
+            return b'blender' in f.read()
+    except (IOError, OSError):
+        return False
+
+
+def kill_orphan(pid):
+    """ Terminates a Blender process left behind by a scheduler that died.
+
+    We can't get the output or return code of a process that isn't our child so rather than re-adopting it we kill it
+    and rerender its chunk; frames it already wrote are kept since renders don't overwrite existing frames.
+    """
+    if not is_blender_process(pid):
+        return False
+    print('Terminating orphaned Blender process %d' % pid)
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError:
+        return False
+    return True
+
+
+def recover_jobs(project_root):
+    """ Replays the journals left in the project's journal directory, kills orphaned Blender processes and returns
+    the jobs that still have work to do.
+    """
+    recovered_jobs = []
+    for path in sorted(glob.glob(join(get_journal_directory(project_root), '*.jsonl'))):
+        job = replay(path)
+        for pid in job.get_orphaned_pids():
+            kill_orphan(pid)
+        if job.done or job.task_spec is None:
+            os.remove(path)
+            continue
+        recovered_jobs.append(job)
+    return recovered_jobs
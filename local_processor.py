@@ -1,61 +1,554 @@
 import json
 import os
+import re
+import shutil
+import tempfile
 import time
-from os.path import join
-from subprocess import Popen
+from os.path import abspath, dirname, join
+from subprocess import PIPE, Popen, STDOUT
 
+from admission import get_process_rss_mb
+from asset_cache import get_source_files, get_staging_pool
+from blender_output import BlenderOutputParser, NonBlockingLineReader
+from flusher import FrameFlusher
 from path_utils import (
     replace_relative_project_prefix
 )
+from post_render import FRAME_PREFIX
+from render_manager import get_tile_borders, get_tile_output_directory
+from render_profiles import get_render_settings, get_settings_script
+from render_task import BlendFileTask
 
+STITCH_SCRIPT = join(dirname(abspath(__file__)), 'stitch_tiles.py')
+BATCH_RENDER_SCRIPT = join(dirname(abspath(__file__)), 'batch_render.py')
 
-class SubprocessStatus:
-    def __init__(self, project_root, task_spec, process):
-        self.process = process
+# What batch_render.py prints around each of its tasks, e.g. "Batch task 3 started" and "Batch task 3 finished: 0".
+BATCH_TASK_PATTERN = re.compile(r'^Batch task (\d+) (?:started|finished: (\d+))$')
+
+BORDER_SETTINGS = ['border_min_x', 'border_min_y', 'border_max_x', 'border_max_y']
+
+# How far (as a fraction of the frame) each tile is rendered past its border so that no pixel along the seams between
+# tiles is left out, whichever way Blender rounds the border.
+TILE_OVERLAP = 0.01
+
+# What a render whose frames couldn't all be flushed to the project drive finishes with.
+FLUSH_FAILED_RETURNCODE = 1
+
+
+def get_overlapping_border(border):
+    (min_x, min_y, max_x, max_y) = border
+    return (max(0.0, min_x - TILE_OVERLAP), max(0.0, min_y - TILE_OVERLAP),
+            min(1.0, max_x + TILE_OVERLAP), min(1.0, max_y + TILE_OVERLAP))
+
+
+class BlenderTaskStatus:
+    """ What the statuses of the tasks Blender renders have in common, whether a task has a Blender process of its own
+    (SubprocessStatus) or shares one with the other tasks of a batch (BatchTaskStatus).
+    """
+
+    def __init__(self, project_root, task_spec, scratch_directory=None, asset_cache=None, staged_files=()):
         self.returncode = None
         self.task_spec = task_spec
         self.project_root = project_root
 
+        # When Blender started and exited (not counting the post-render stages) so that the processor can tell how
+        # fast it's rendering.
+        self.start_time = time.time()
+        self.render_finish_time = None
+
+        # Blender's output is parsed as it comes in so that we know which frames are done, how long they took and
+        # how much memory they needed.
+        self.output_parser = BlenderOutputParser()
+
+        # Set when Blender renders to local scratch storage, the frames are moved to the output directory as they're
+        # saved.
+        self.flusher = None
+        self.flush_finished = False
+        self.queued_output_files = 0
+        if scratch_directory is not None:
+            output_directory = replace_relative_project_prefix(project_root, task_spec.output_directory)
+            self.flusher = FrameFlusher(scratch_directory, output_directory)
+
+        # The cached files this render reads, they're pinned in the asset cache until it's over.
+        self.asset_cache = asset_cache
+        self.staged_files = list(staged_files)
+
+    def _poll_flusher(self, render_finished):
+        """ Frames only count as rendered once they've made it to the output directory.
+
+        :return: whether the render is finished and its frames have all been flushed.
+        """
+        if self.flusher is None or self.flush_finished:
+            return render_finished
+        self._flush_saved_frames()
+        self.flusher.poll(render_finished)
+        render_finished = render_finished and self.flusher.is_done()
+        if render_finished:
+            self.flusher.cleanup()
+            if self.flusher.errors and not self.returncode:
+                self.returncode = FLUSH_FAILED_RETURNCODE
+            self.flush_finished = True
+        return render_finished
+
+    def _flush_saved_frames(self):
+        frames = self.output_parser.frames
+        for frame_telemetry in frames[self.queued_output_files:]:
+            if frame_telemetry.output_file and frame_telemetry.output_file.startswith(self.flusher.scratch_directory):
+                self.flusher.add(frame_telemetry.output_file)
+        self.queued_output_files = len(frames)
+
+    def get_flush_backlog(self):
+        """ Returns how many rendered frames haven't made it to the output directory yet."""
+        if self.flusher is None:
+            return 0
+        return self.flusher.get_backlog()
+
+    def get_completed_frames(self):
+        return self.output_parser.get_completed_frames()
+
+    def get_peak_memory_mb(self):
+        return self.output_parser.peak_memory_mb
+
+    # perform final clean-up work if necessary.
+    # this should only be called in the case that
+    # is_done returns true
+    #
+    # The status files are written by LocalProcessor.finalize_render once every chunk rendering into the output
+    # directory is done.
+    def finalize_task(self):
+        assert self.is_done()
+        self._release_staged_files()
+
+    def _release_staged_files(self):
+        if self.asset_cache is not None and self.staged_files:
+            self.asset_cache.release(self.staged_files)
+        self.staged_files = []
+
+    def cancel(self):
+        self._release_staged_files()
+        if self.flusher is not None:
+            self.flusher.cancel()
+
+
+class SubprocessStatus(BlenderTaskStatus):
+    def __init__(self, project_root, task_spec, process, scratch_directory=None, asset_cache=None, staged_files=(),
+                 starting=None):
+        super().__init__(project_root, task_spec, scratch_directory, asset_cache, staged_files)
+        self.process = None
+        self.output_reader = None
+
+        # Resident memory of the Blender process as of the last poll and the most we've seen it use.
+        self.current_rss_mb = None
+        self.peak_rss_mb = None
+
+        # Set while the files the render reads are being staged in the background: a future of the (Blender process,
+        # staged files) that is started once they're there.
+        self.starting = starting
+        if process is not None:
+            self._on_started(process)
+
+    def _on_started(self, process):
+        self.process = process
+        self.start_time = time.time()
+        if process.stdout is not None:
+            self.output_reader = NonBlockingLineReader(process.stdout)
+
+    def _start(self):
+        """ Picks up the Blender process once the files the render reads have been staged.
+
+        :return: False while they're still being staged.
+        """
+        if not self.starting.done():
+            return False
+        try:
+            (process, self.staged_files) = self.starting.result()
+        except Exception as e:
+            print('Unable to start rendering %s: %s' % (self.task_spec.blend_file, e))
+            self.returncode = 1
+            self.render_finish_time = time.time()
+            return True
+        self._on_started(process)
+        return True
+
     def is_done(self):
+        if self.returncode is None and self.process is None and not self._start():
+            return False
+
         # once we get a return code back, we hold onto it
         #
         # if we have non-None return code we assume that
         # we're done.
+        if self.returncode is None:
+            self._sample_rss()
+            self.returncode = self.process.poll()
+            self._read_output(wait_for_eof=self.returncode is not None)
+            if self.returncode is not None:
+                self.render_finish_time = time.time()
+
+        return self._poll_flusher(self.returncode is not None)
+
+    def _sample_rss(self):
+        self.current_rss_mb = get_process_rss_mb(self.process.pid)
+        if self.current_rss_mb is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb or 0, self.current_rss_mb)
+
+    def _read_output(self, wait_for_eof=False):
+        if self.output_reader is None:
+            return
+        for line in self.output_reader.read_available_lines(wait_for_eof):
+            # We still want to see what Blender is up to in the console.
+            print(line, end='')
+            self.output_parser.feed(line)
+
+    def cancel(self):
+        if self.process is None:
+            # Blender hasn't been started yet so it's stopped as soon as it is (if it still gets that far).
+            self.starting.cancel()
+            self.starting.add_done_callback(self._cancel_started)
+            if self.returncode is None:
+                self.returncode = 1
+        else:
+            self.process.terminate()
+        super().cancel()
+
+    def _cancel_started(self, starting):
+        if starting.cancelled() or starting.exception() is not None:
+            return
+        (process, staged_files) = starting.result()
+        process.terminate()
+        if self.asset_cache is not None and staged_files:
+            self.asset_cache.release(staged_files)
+
+    def commit_backup(self, original):
+        """ Called on the backup copy of a straggling chunk that finished first. Cancels the original and moves the
+        frames we rendered into its output directory, replacing anything it left half written.
+        """
+        original.cancel()
+        if original.process is not None:
+            original.process.wait()
+        backup_directory = replace_relative_project_prefix(self.project_root, self.task_spec.output_directory)
+        output_directory = replace_relative_project_prefix(self.project_root, original.task_spec.output_directory)
+        for file in sorted(os.listdir(backup_directory)):
+            if file.startswith(FRAME_PREFIX):
+                # A rename within the same file system so every frame shows up whole or not at all.
+                os.replace(join(backup_directory, file), join(output_directory, file))
+        shutil.rmtree(backup_directory, ignore_errors=True)
+        self._release_staged_files()
+
+    def discard_backup(self):
+        """ Called on the backup copy of a straggling chunk when the original finished first."""
+        self.cancel()
+        if self.process is not None:
+            self.process.wait()
+        shutil.rmtree(replace_relative_project_prefix(self.project_root, self.task_spec.output_directory),
+                      ignore_errors=True)
+
+
+class BlenderBatch:
+    """ A single Blender process rendering several tasks one after the other (see batch_render.py).
+
+    Blender's output is split up between the statuses of the tasks by the lines the driver script prints around each
+    of them.
+    """
+
+    def __init__(self, process, batch_file, starting=None):
+        self.process = None
+        self.batch_file = batch_file
+        self.returncode = None
+        self.statuses = []
+        self.current_status = None
+        self.output_reader = None
+
+        # Set while the files the tasks read are being staged in the background: a future of the (Blender process,
+        # batch file, staged files of each task) that is started once they're there.
+        self.starting = starting
+        if process is not None:
+            self._on_started(process)
+
+    def _on_started(self, process):
+        self.process = process
+        if process.stdout is not None:
+            self.output_reader = NonBlockingLineReader(process.stdout)
+
+    def _start(self):
+        """ Picks up the Blender process once the files the tasks read have been staged.
+
+        :return: whether it has been started.
+        """
+        if not self.starting.done():
+            return False
+        try:
+            (process, self.batch_file, staged_files_per_task) = self.starting.result()
+        except Exception as e:
+            print('Unable to start rendering a batch: %s' % e)
+            self._on_exit(1)
+            return False
+        for (status, staged_files) in zip(self.statuses, staged_files_per_task):
+            status.staged_files = staged_files
+        self._on_started(process)
+        return True
+
+    def poll(self):
         if self.returncode is not None:
-            return True
+            return
+        if self.process is None and not self._start():
+            return
+        returncode = self.process.poll()
+        self._read_output(wait_for_eof=returncode is not None)
+        if returncode is not None:
+            self._on_exit(returncode)
+
+    def _on_exit(self, returncode):
+        self.returncode = returncode
+        if self.batch_file is not None and os.path.exists(self.batch_file):
+            os.remove(self.batch_file)
+        # Whatever the driver didn't get to (e.g. because Blender crashed) failed.
+        for status in self.statuses:
+            if status.returncode is None:
+                status.on_render_finished(returncode or 1)
+
+    def _read_output(self, wait_for_eof=False):
+        if self.output_reader is None:
+            return
+        for line in self.output_reader.read_available_lines(wait_for_eof):
+            print(line, end='')
+            match = BATCH_TASK_PATTERN.match(line.rstrip('\r\n'))
+            if match is None:
+                if self.current_status is not None:
+                    self.current_status.output_parser.feed(line)
+                continue
+            status = self.statuses[int(match.group(1))]
+            if match.group(2) is None:
+                self.current_status = status
+                status.start_time = time.time()
+            else:
+                self.current_status = None
+                status.on_render_finished(int(match.group(2)))
 
-        self.returncode = self.process.poll()
+    def is_done(self):
+        self.poll()
+        # Polling the statuses flushes the frames the tasks rendered to scratch.
+        return all([status.is_done() for status in self.statuses])
 
-        return self.returncode is not None
+    def get_flush_backlog(self):
+        return sum(status.get_flush_backlog() for status in self.statuses)
 
-    # perform final clean-up work if necessary.
-    # this should only be called in the case that
-    # is_done returns true
-    def finalize_task(self):
-        assert self.is_done()
-        finalize_blend_file_render(self.project_root, self.task_spec, self.returncode)
+    def cancel(self):
+        if self.process is not None:
+            self.process.terminate()
+        elif self.returncode is None:
+            # Blender hasn't been started yet so it's stopped as soon as it is (if it still gets that far).
+            self.starting.cancel()
+            self.starting.add_done_callback(self._cancel_started)
+            self._on_exit(1)
+
+    def _cancel_started(self, starting):
+        if starting.cancelled() or starting.exception() is not None:
+            return
+        (process, _, staged_files_per_task) = starting.result()
+        process.terminate()
+        for (status, staged_files) in zip(self.statuses, staged_files_per_task):
+            if status.asset_cache is not None and staged_files:
+                status.asset_cache.release(staged_files)
+
+
+class BatchTaskStatus(BlenderTaskStatus):
+    """ The status of one of the tasks of a BlenderBatch."""
+
+    def __init__(self, project_root, task_spec, batch, scratch_directory=None, asset_cache=None, staged_files=()):
+        # The start time is reset once the driver gets to this task.
+        super().__init__(project_root, task_spec, scratch_directory, asset_cache, staged_files)
+        self.batch = batch
+
+    @property
+    def process(self):
+        # None until the batch has been started.
+        return self.batch.process
+
+    def on_render_finished(self, returncode):
+        self.returncode = returncode
+        self.render_finish_time = time.time()
+
+    def is_done(self):
+        self.batch.poll()
+        return self._poll_flusher(self.returncode is not None)
 
     def cancel(self):
-        self.process.terminate()
+        # There's no cancelling a single task of a batch, the whole batch goes.
+        self.batch.cancel()
+        super().cancel()
+
+
+# How much weight the latest chunk gets in a processor's throughput score.
+THROUGHPUT_SMOOTHING = 0.3
 
 
 class LocalProcessor:
-    def __init__(self, project_root):
+    def __init__(self, project_root, scratch_directory=None, asset_cache=None):
         self.current_task = None
         self.project_root = project_root
 
+        # Optional fast local directory (e.g. an SSD or tmpfs) that frames are rendered to before they're flushed to
+        # the output directory on the project drive.
+        self.scratch_directory = scratch_directory
+
+        # Optional AssetCache (usually shared by every processor on the machine) that the files a task reads are
+        # copied to before it's rendered.
+        self.asset_cache = asset_cache
+
+        # Exponentially weighted moving average of the frames per second this processor has rendered, None until its
+        # first chunk finishes.
+        self.throughput = None
+
     def process(self, task_spec):
 
-        if 'target' in task_spec:
-            raise ValueError('Execution of targets is not supported by this processor.')
+        # Task specs straight out of a task JSON file are still dicts.
+        if isinstance(task_spec, dict):
+            if 'target' in task_spec:
+                raise ValueError('Execution of targets is not supported by this processor.')
+            task_spec = BlendFileTask.from_dict(task_spec)
 
-        if 'blend_file' not in task_spec:
+        if task_spec.blend_file is None:
             raise ValueError('Please specify a blend_file to render.')
 
-        subprocess = self._process_blend_file(task_spec)
-        self.current_task = SubprocessStatus(self.project_root, task_spec, subprocess)
+        if task_spec.tile_grid is not None:
+            self.current_task = SubprocessStatus(self.project_root, task_spec, self._stitch_tiles(task_spec))
+            return self.current_task
+
+        scratch_directory = None
+        if self._should_render_to_scratch(task_spec):
+            os.makedirs(self.scratch_directory, exist_ok=True)
+            scratch_directory = tempfile.mkdtemp(prefix='render_', dir=self.scratch_directory)
+        # The output directory is prepared right away so that nothing watching it sees the last render's frames.
+        output_directory = self._prepare_output_directory(task_spec)
+        if self.asset_cache is not None and task_spec.input_files:
+            # Copying the files the task reads can take a while so it's done in the background and Blender is started
+            # once they're there.
+            starting = get_staging_pool().submit(
+                self._stage_and_process_blend_file, task_spec, output_directory, scratch_directory)
+            self.current_task = SubprocessStatus(self.project_root, task_spec, None, scratch_directory,
+                                                 self.asset_cache, starting=starting)
+        else:
+            self.current_task = SubprocessStatus(
+                self.project_root, task_spec, self._process_blend_file(task_spec, output_directory, scratch_directory),
+                scratch_directory)
         return self.current_task
 
+    def process_batch(self, task_specs):
+        """ Renders several small blend file tasks one after the other in a single Blender process so that they don't
+        each pay for starting Blender. Every task still gets its own status files.
+
+        :return: a status per task, in the same order as task_specs.
+        """
+        task_specs = [BlendFileTask.from_dict(task_spec) if isinstance(task_spec, dict) else task_spec
+                      for task_spec in task_specs]
+        if any(task_spec.blend_file is None for task_spec in task_specs):
+            raise ValueError('Please specify a blend_file to render.')
+
+        scratch_directories = []
+        output_directories = []
+        try:
+            for task_spec in task_specs:
+                scratch_directory = None
+                if self._should_render_to_scratch(task_spec):
+                    os.makedirs(self.scratch_directory, exist_ok=True)
+                    scratch_directory = tempfile.mkdtemp(prefix='render_', dir=self.scratch_directory)
+                scratch_directories.append(scratch_directory)
+                output_directories.append(self._prepare_output_directory(task_spec))
+
+            if self.asset_cache is not None and any(task_spec.input_files for task_spec in task_specs):
+                # Same as process(), Blender is started once the files the tasks read have been staged.
+                batch = BlenderBatch(None, None, starting=get_staging_pool().submit(
+                    self._stage_and_start_batch, task_specs, output_directories, scratch_directories))
+            else:
+                batch = BlenderBatch(*self._start_batch(task_specs, output_directories, scratch_directories))
+        except Exception:
+            for scratch_directory in scratch_directories:
+                if scratch_directory is not None:
+                    shutil.rmtree(scratch_directory, ignore_errors=True)
+            raise
+
+        batch.statuses = [BatchTaskStatus(self.project_root, task_spec, batch, scratch_directory, self.asset_cache)
+                          for (task_spec, scratch_directory) in zip(task_specs, scratch_directories)]
+        # The processor is busy until the whole batch is done.
+        self.current_task = batch
+        return list(batch.statuses)
+
+    def _stage_and_start_batch(self, task_specs, output_directories, scratch_directories):
+        """ Stages the files the tasks of a batch read and starts rendering them. Runs on the staging pool.
+
+        :return: a (Blender process, batch file, staged files of each task) tuple.
+        """
+        staged_files_per_task = []
+        asset_settings_per_task = []
+        try:
+            for task_spec in task_specs:
+                (staged_files, asset_settings) = self._stage_input_files(task_spec)
+                staged_files_per_task.append(staged_files)
+                asset_settings_per_task.append(asset_settings)
+            (process, batch_file) = self._start_batch(task_specs, output_directories, scratch_directories,
+                                                      asset_settings_per_task)
+        except Exception:
+            for staged_files in staged_files_per_task:
+                if staged_files:
+                    self.asset_cache.release(staged_files)
+            raise
+        return (process, batch_file, staged_files_per_task)
+
+    def _start_batch(self, task_specs, output_directories, scratch_directories, asset_settings_per_task=None):
+        """ :return: a (Blender process, batch file) tuple."""
+        start_time = time.time()
+        batch_tasks = []
+        for (index, task_spec) in enumerate(task_specs):
+            output_directory = output_directories[index]
+            render_settings = get_render_settings(task_spec.render_profile)
+            asset_settings = asset_settings_per_task[index] if asset_settings_per_task is not None else ()
+            batch_tasks.append({
+                'blend_file': replace_relative_project_prefix(self.project_root, task_spec.blend_file),
+                'settings_script': self._write_settings_script(task_spec, output_directory, render_settings,
+                                                               asset_settings),
+                'output_format': join(scratch_directories[index] or output_directory, 'frame_#####'),
+                'start_frame': task_spec.start_frame,
+                'end_frame': task_spec.end_frame,
+                'frame_step': task_spec.frame_step,
+            })
+            self._write_in_progress_file(task_spec, output_directory, start_time, render_settings)
+
+        (handle, batch_file) = tempfile.mkstemp(prefix='batch_', suffix='.json')
+        with os.fdopen(handle, 'w') as f:
+            json.dump({'tasks': batch_tasks}, f, indent=2)
+
+        cmd = [
+            'blender',
+            '-b',
+            '-P', BATCH_RENDER_SCRIPT,
+            '--', batch_file,
+        ]
+        print('Executing command: \n%s' % cmd)
+        return (Popen(cmd, stdout=PIPE, stderr=STDOUT, universal_newlines=True, errors='replace'), batch_file)
+
+    def finalize_render(self, task_spec, statuses, returncode, post_render_status=None, job=None, resumed=False):
+        """ Writes the status files of an output directory once every chunk rendering into it is done.
+
+        :param task_spec: the task covering every frame that was rendered into the output directory.
+        :param statuses: the statuses of the chunks (and backups) that rendered into it.
+        :param job: the job the task was rendered for (see RenderManager.job).
+        :param resumed: whether a scheduler that died started rendering into the directory.
+        """
+        telemetry = BlenderOutputParser.merge(
+            [status.output_parser for status in statuses if hasattr(status, 'output_parser')]).to_dict()
+        peak_rss_mb = [status.peak_rss_mb for status in statuses if getattr(status, 'peak_rss_mb', None)]
+        if peak_rss_mb:
+            telemetry['summary']['peak_rss_mb'] = max(peak_rss_mb)
+        start_times = [status.start_time for status in statuses if hasattr(status, 'start_time')]
+        finalize_blend_file_render(self.project_root, task_spec, returncode, post_render_status, telemetry,
+                                   start_time=min(start_times) if start_times else None, job=job, resumed=resumed)
+
+    def get_flush_backlog(self):
+        if self.current_task is None:
+            return 0
+        return self.current_task.get_flush_backlog()
+
     def is_available(self):
         if self.current_task is None:
             return True
@@ -63,17 +556,176 @@ class LocalProcessor:
             return True
         return False
 
-    def _process_blend_file(self, task_spec):
-        assert 'blend_file' in task_spec
-        blend_file = replace_relative_project_prefix(self.project_root, task_spec['blend_file'])
+    def record_completed_chunk(self, status):
+        """ Folds the frames per second of a finished chunk into this processor's throughput score."""
+        if status.returncode or status.render_finish_time is None:
+            return
+        if status.task_spec.border is not None or status.task_spec.tile_grid is not None:
+            # Rendering part of a frame or stitching frames says nothing about how fast whole frames render.
+            return
+        frames = len(status.get_completed_frames())
+        if not frames and status.task_spec.has_frame_range():
+            # Blender's output didn't tell us anything so assume the whole chunk was rendered.
+            frames = len(status.task_spec.get_frames())
+        duration = status.render_finish_time - status.start_time
+        if not frames or duration <= 0:
+            return
+        throughput = frames / duration
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput = THROUGHPUT_SMOOTHING * throughput + (1 - THROUGHPUT_SMOOTHING) * self.throughput
+
+    def _should_render_to_scratch(self, task_spec):
+        """ Blender only skips the frames that already exist in the directory it renders to so a task that appends to
+        an output directory that already has frames, e.g. a resumed chunk, renders straight into it instead.
+        """
+        if self.scratch_directory is None:
+            return False
+        if not task_spec.append_to_output or task_spec.output_directory is None:
+            return True
+        output_directory = replace_relative_project_prefix(self.project_root, task_spec.output_directory)
+        if not os.path.isdir(output_directory):
+            return True
+        return not any(file.startswith(FRAME_PREFIX) for file in os.listdir(output_directory))
+
+    def _stage_input_files(self, task_spec):
+        """ Copies the files the task reads to the asset cache, if there is one.
+
+        :return: a (staged files, settings script lines) tuple, the staged files have to be released once the task is
+            done.
+        """
+        if self.asset_cache is None or not task_spec.input_files:
+            return ([], [])
+        (files, directories) = get_source_files(self.project_root, task_spec.input_files)
+        staged_files = self.asset_cache.stage(files)
+        return (staged_files, self.asset_cache.get_settings_script(staged_files, directories))
+
+    def _stage_and_process_blend_file(self, task_spec, output_directory, scratch_directory=None):
+        """ Stages the files the task reads and starts rendering it. Runs on the staging pool.
+
+        :return: a (Blender process, staged files) tuple.
+        """
+        (staged_files, asset_settings) = self._stage_input_files(task_spec)
+        try:
+            return (self._process_blend_file(task_spec, output_directory, scratch_directory, asset_settings),
+                    staged_files)
+        except Exception:
+            if staged_files:
+                self.asset_cache.release(staged_files)
+            raise
+
+    def _process_blend_file(self, task_spec, output_directory, scratch_directory=None, asset_settings=()):
+        assert task_spec.blend_file is not None
+        blend_file = replace_relative_project_prefix(self.project_root, task_spec.blend_file)
+        start_time = time.time()
+
+        output_format = join(scratch_directory or output_directory, 'frame_#####')
+
+        render_settings = get_render_settings(task_spec.render_profile)
+        custom_settings_script = self._write_settings_script(task_spec, output_directory, render_settings,
+                                                             asset_settings)
+
+        self._write_in_progress_file(task_spec, output_directory, start_time, render_settings)
+
+        print(blend_file)
+        assert os.path.exists(blend_file)
+
+        cmd = [
+            'blender',
+            '-b',  # run in the background
+            blend_file,  # render this file
+            '-P', custom_settings_script,
+            '-o', output_format,  # output the results in this format
+        ]
+
+        if task_spec.has_frame_range():
+            cmd.extend(['-s', str(task_spec.start_frame)])
+            cmd.extend(['-e', str(task_spec.end_frame)])
+            if task_spec.frame_step:
+                cmd.extend(['-j', str(task_spec.frame_step)])
+
+        # Render whatever the saved file says.
+        cmd.append('-a')
+
+        # Actually execute the render.
+        print('Executing command: \n%s' % cmd)
+        return Popen(cmd, stdout=PIPE, stderr=STDOUT, universal_newlines=True, errors='replace')
+
+    def _write_settings_script(self, task_spec, output_directory, render_settings, asset_settings=()):
+        custom_settings_script = join(output_directory, 'settings.py')
+        with open(custom_settings_script, 'w') as f:
+            f.write("import bpy\n\n")
+            f.write('bpy.context.scene.render.use_overwrite = False\n')
+            if task_spec.resolution_x is not None:
+                f.write('bpy.context.scene.render.resolution_x = ' + str(task_spec.resolution_x) + '\n')
+            if task_spec.resolution_y is not None:
+                f.write('bpy.context.scene.render.resolution_y = ' + str(task_spec.resolution_y) + '\n')
+            if task_spec.resolution_percentage is not None:
+                f.write('bpy.context.scene.render.resolution_percentage = ' +
+                        str(task_spec.resolution_percentage) + '\n')
+            if task_spec.border is not None:
+                # Tiles are rendered at full frame size so that stitching them doesn't depend on how Blender rounds
+                # the border to pixels.
+                f.write('bpy.context.scene.render.use_border = True\n')
+                f.write('bpy.context.scene.render.use_crop_to_border = False\n')
+                for (name, value) in zip(BORDER_SETTINGS, get_overlapping_border(task_spec.border)):
+                    f.write('bpy.context.scene.render.%s = %r\n' % (name, value))
+                # Blender can't write the layers of a multilayer EXR back out once it has stitched them so the first
+                # tile renders whole frames, which stitch_tiles.py copies as they are, and the other tiles quit.
+                f.write("if bpy.context.scene.render.image_settings.file_format == 'OPEN_EXR_MULTILAYER':\n")
+                if task_spec.border[:2] == (0.0, 0.0):
+                    f.write('    bpy.context.scene.render.use_border = False\n')
+                else:
+                    f.write('    import sys\n')
+                    f.write('    sys.exit(0)\n')
+            f.writelines(get_settings_script(render_settings))
+            f.writelines(asset_settings)
+        return custom_settings_script
+
+    def _stitch_tiles(self, task_spec):
         start_time = time.time()
+        output_directory = self._prepare_output_directory(task_spec)
 
-        if 'output_directory' in task_spec:
-            output_directory = replace_relative_project_prefix(self.project_root, task_spec['output_directory'])
+        stitch_spec_file = join(output_directory, 'stitch.json')
+        with open(stitch_spec_file, 'w') as f:
+            json.dump({
+                'output_directory': output_directory,
+                'tiles': [{
+                    'directory': replace_relative_project_prefix(
+                        self.project_root, get_tile_output_directory(task_spec.output_directory, index)),
+                    'border': border,
+                } for (index, border) in enumerate(get_tile_borders(task_spec.tile_grid))],
+            }, f, indent=2)
+
+        render_settings = get_render_settings(task_spec.render_profile)
+        self._write_in_progress_file(task_spec, output_directory, start_time, render_settings)
+
+        cmd = [
+            'blender',
+            '-b',
+            '--factory-startup',  # we only need Blender to read and write images
+            '--python-exit-code', '1',
+            '-P', STITCH_SCRIPT,
+            '--', stitch_spec_file,
+        ]
+        print('Executing command: \n%s' % cmd)
+        return Popen(cmd, stdout=PIPE, stderr=STDOUT, universal_newlines=True, errors='replace')
+
+    def _prepare_output_directory(self, task_spec):
+        """ Archives whatever the last render left in the output directory (unless we're appending to it).
+
+        :return: the absolute output directory.
+        """
+        if task_spec.output_directory is not None:
+            output_directory = replace_relative_project_prefix(self.project_root, task_spec.output_directory)
         else:
             raise ValueError('output_directory not specified for blend_file task spec')
 
-        if os.path.exists(output_directory) and os.listdir(output_directory):
+        if task_spec.append_to_output:
+            # We're adding frames to a render that's already in the output directory so we leave its contents alone.
+            os.makedirs(output_directory, exist_ok=True)
+        elif os.path.exists(output_directory) and os.listdir(output_directory):
             completion_metadata_file = join(output_directory, 'DONE.json')
             in_progress_metadata_file = join(output_directory, 'IN_PROGRESS.json')
             if os.path.exists(completion_metadata_file):
@@ -84,8 +736,7 @@ class LocalProcessor:
             elif os.path.exists(in_progress_metadata_file):
                 with open(in_progress_metadata_file, 'r') as f:
                     in_progress_metadata = json.load(f)
-                    if 'dependency_invalidation_types' in task_spec and 'IN_PROGRESS_RENDER' in task_spec[
-                        'dependency_invalidation_types']:
+                    if 'IN_PROGRESS_RENDER' in task_spec.dependency_invalidation_types:
                         new_directory_name = time.strftime("%Y-%m-%d_%H-%M-%S_INCOMPLETE",
                                                            time.gmtime(in_progress_metadata['start_time']))
                     else:
@@ -106,57 +757,28 @@ class LocalProcessor:
         else:
             os.makedirs(output_directory)
 
-        output_format = join(output_directory, 'frame_#####')
-
-        custom_settings_script = join(output_directory, 'settings.py')
-
-        with open(custom_settings_script, 'w') as f:
-            f.write("import bpy\n\n")
-            f.write('bpy.context.scene.render.use_overwrite = False\n')
-            if 'resolution_x' in task_spec:
-                f.write('bpy.context.scene.render.resolution_x = ' + str(task_spec['resolution_x']) + '\n')
-            if 'resolution_y' in task_spec:
-                f.write('bpy.context.scene.render.resolution_y = ' + str(task_spec['resolution_y']) + '\n')
+        return output_directory
 
+    def _write_in_progress_file(self, task_spec, output_directory, start_time, render_settings):
         status_indicator = join(output_directory, 'IN_PROGRESS.json')
-        with open(status_indicator, 'w') as f:
-            json.dump({
-                'start_time': start_time,
-                'task_spec': task_spec,
-            }, f, indent=2)
-
-        print(blend_file)
-        assert os.path.exists(blend_file)
-
-        cmd = [
-            'blender',
-            '-b',  # run in the background
-            blend_file,  # render this file
-            '-P', custom_settings_script,
-            '-o', output_format,  # output the results in this format
-        ]
-
-        if 'start_frame' in task_spec and 'end_frame' in task_spec:
-            cmd.extend(['-s', str(task_spec['start_frame'])])
-            cmd.extend(['-e', str(task_spec['end_frame'])])
-        elif 'start_frame' in task_spec or 'end_frame' in task_spec:
-            raise AssertionError('Please specify either both start_frame and end_frame or neither.')
-
-        # Render whatever the saved file says.
-        cmd.append('-a')
-
-        # Actually execute the render.
-        print('Executing command: \n%s' % cmd)
-        return Popen(cmd)
+        completion_indicator = join(output_directory, 'DONE.json')
+        if not task_spec.append_to_output or not (os.path.exists(status_indicator) or
+                                                  os.path.exists(completion_indicator)):
+            with open(status_indicator, 'w') as f:
+                json.dump({
+                    'start_time': start_time,
+                    'task_spec': task_spec.to_dict(),
+                    'render_profile': task_spec.render_profile,
+                    'render_settings': render_settings,
+                }, f, indent=2)
 
 
 # this method should be called once the render to update the status files:
 # TODO(mattkeller): maybe this should be moved to the SubprocessStatus class?
-def finalize_blend_file_render(project_root, task_spec, returncode):
-    absolute_blend_file = replace_relative_project_prefix(project_root, task_spec['blend_file'])
-
-    if 'output_directory' in task_spec:
-        output_directory = replace_relative_project_prefix(project_root, task_spec['output_directory'])
+def finalize_blend_file_render(project_root, task_spec, returncode, post_render_status=None, telemetry=None,
+                               start_time=None, job=None, resumed=False):
+    if task_spec.output_directory is not None:
+        output_directory = replace_relative_project_prefix(project_root, task_spec.output_directory)
     else:
         raise ValueError('output_directory not specified for blend_file task spec')
 
@@ -165,6 +787,14 @@ def finalize_blend_file_render(project_root, task_spec, returncode):
     error_indicator_file = join(output_directory, 'ERROR.json')
 
     if os.path.exists(completion_indicator_file):
+        if task_spec.append_to_output and not returncode:
+            # e.g. resumed chunks adding frames to a directory that has already been finalized.
+            with open(completion_indicator_file, 'r') as f:
+                done_dict = json.load(f)
+            done_dict['completion_time'] = time.time()
+            with open(completion_indicator_file, 'w') as f:
+                json.dump(done_dict, f, indent=2)
+            return
         print("Trying to finalize a finalized directory. Aborting.")
         return
 
@@ -185,9 +815,30 @@ def finalize_blend_file_render(project_root, task_spec, returncode):
 
         os.remove(status_indicator_file)
 
+    # The in-progress file was written by whichever chunk started first.
+    done_dict['task_spec'] = task_spec.to_dict()
+    if start_time is not None and not (resumed and 'start_time' in done_dict):
+        # e.g. a task that waited for its turn in a batch. The render of a resumed job started when the chunk that
+        # wrote the in-progress file did, not when it was resumed.
+        done_dict['start_time'] = start_time
+
+    if post_render_status is not None:
+        done_dict['post_render_stages'] = post_render_status
+
+    if telemetry is not None:
+        done_dict['render_telemetry'] = telemetry
+
+    if job is not None:
+        done_dict['job'] = job
+
     if not returncode:
         with open(completion_indicator_file, 'w') as f:
             json.dump(done_dict, f, indent=2)
+        if task_spec.tile_grid is not None:
+            # The tiles have been stitched into the output directory so we don't need them anymore.
+            for index in range(len(get_tile_borders(task_spec.tile_grid))):
+                shutil.rmtree(replace_relative_project_prefix(
+                    project_root, get_tile_output_directory(task_spec.output_directory, index)), ignore_errors=True)
     else:
         done_dict['error_code'] = returncode
         with open(error_indicator_file, 'w') as f:
@@ -0,0 +1,255 @@
+""" Post-render stages (proxies, contact sheets, preview movies, etc.) that run while the render is still going.
+
+Stages are declared per target in RENDER.json:
+
+    "post_render_stages": [
+        {"name": "proxy"},
+        {"name": "preview_movie", "finalize": ["my_encoder", "{frame_pattern}", "{output}"]}
+    ]
+
+Built in stages (see BUILT_IN_STAGES) only need a name but any of their fields can be overridden. Command templates
+may contain the following placeholders:
+
+    {frame}          the absolute path to the frame being processed (per_frame only).
+    {frames}         expands to one argument per rendered frame (finalize only).
+    {frame_pattern}  a printf style pattern matching the rendered frames (finalize only).
+    {output}         where the stage should write its result.
+    {output_directory} the directory the stage writes its results into.
+    {render_directory} the directory the frames are rendered into.
+    {python}         the python interpreter running the scheduler.
+    {scripts}        the directory containing the scheduler's scripts.
+
+The output of each stage ends up in a directory named after the stage inside the render's output directory so it
+is archived along with the frames.
+"""
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from os.path import abspath, basename, dirname, exists, getmtime, join, splitext
+
+from render_task import PostRenderStage
+
+BUILT_IN_STAGES = {
+    'proxy': PostRenderStage(
+        'proxy',
+        per_frame=['oiiotool', '{frame}', '--resize', '50%', '-o', '{output}'],
+    ),
+    'contact_sheet': PostRenderStage(
+        'contact_sheet',
+        finalize=['montage', '{frames}', '-geometry', '256x+2+2', '{output}'],
+        output='contact_sheet.png',
+    ),
+    # TODO(mattkeller): this is a stand in until we settle on what encoder the farm should use.
+    'preview_movie': PostRenderStage(
+        'preview_movie',
+        finalize=['ffmpeg', '-y', '-i', '{frame_pattern}', '-pix_fmt', 'yuv420p', '{output}'],
+        output='preview.mp4',
+    ),
+    # Hardlinks identical frames within the render and against the archived renders, see dedup.py.
+    'deduplicate': PostRenderStage(
+        'deduplicate',
+        finalize=['{python}', join('{scripts}', 'dedup.py'), '{render_directory}', '--report', '{output}'],
+        output='report.json',
+    ),
+}
+
+SCRIPTS_DIRECTORY = dirname(abspath(__file__))
+
+FRAME_PREFIX = 'frame_'
+
+_stage_pool = None
+
+
+def get_stage_pool():
+    """ Returns the process pool shared by the post-render stages of every task in this process."""
+    global _stage_pool
+    if _stage_pool is None:
+        _stage_pool = ProcessPoolExecutor()
+    return _stage_pool
+
+
+def resolve_stage(stage):
+    """ Fills in the fields of a (possibly partially specified) stage from the built in stage with the same name."""
+    if stage.name not in BUILT_IN_STAGES:
+        return stage
+    built_in_stage = BUILT_IN_STAGES[stage.name]
+    return PostRenderStage(
+        stage.name,
+        per_frame=stage.per_frame if stage.per_frame is not None else built_in_stage.per_frame,
+        finalize=stage.finalize if stage.finalize is not None else built_in_stage.finalize,
+        output=stage.output if stage.output is not None else built_in_stage.output,
+    )
+
+
+def expand_command(template, substitutions, frames=()):
+    substitutions = dict(substitutions, python=sys.executable, scripts=SCRIPTS_DIRECTORY)
+    cmd = []
+    for argument in template:
+        if argument == '{frames}':
+            cmd.extend(frames)
+        else:
+            cmd.append(argument.format(**substitutions))
+    return cmd
+
+
+def run_per_frame_command(template, frame, output_directory):
+    """ Runs a per frame command in a pool worker. Frames whose output is newer than the frame are skipped so that
+    resumed renders don't redo work.
+    """
+    output = join(output_directory, basename(frame))
+    if exists(output) and getmtime(output) >= getmtime(frame):
+        return 0
+    os.makedirs(output_directory, exist_ok=True)
+    cmd = expand_command(template, {
+        'frame': frame,
+        'output': output,
+        'output_directory': output_directory,
+        'render_directory': dirname(frame),
+    })
+    return subprocess.call(cmd)
+
+
+def run_finalize_command(template, frames, frame_pattern, output, output_directory, render_directory):
+    os.makedirs(output_directory, exist_ok=True)
+    cmd = expand_command(template, {
+        'frame_pattern': frame_pattern,
+        'output': output,
+        'output_directory': output_directory,
+        'render_directory': render_directory,
+    }, frames)
+    return subprocess.call(cmd)
+
+
+def list_frames(output_directory):
+    if not os.path.isdir(output_directory):
+        return []
+    return sorted(file for file in os.listdir(output_directory) if file.startswith(FRAME_PREFIX))
+
+
+class StageProgress:
+    def __init__(self, stage):
+        self.stage = stage
+        self.frame_futures = []
+        self.finalize_future = None
+
+    def is_done(self, render_finished):
+        if not all(future.done() for future in self.frame_futures):
+            return False
+        if self.stage.finalize is None:
+            return render_finished
+        return self.finalize_future is not None and self.finalize_future.done()
+
+    def status(self):
+        frames_done = 0
+        frames_failed = 0
+        for future in self.frame_futures:
+            if future.done():
+                if future.cancelled() or future.exception() is not None or future.result():
+                    frames_failed += 1
+                else:
+                    frames_done += 1
+        status = {
+            'frames_done': frames_done,
+            'frames_failed': frames_failed,
+        }
+        if self.finalize_future is not None and self.finalize_future.done():
+            if self.finalize_future.cancelled() or self.finalize_future.exception() is not None:
+                status['finalize_returncode'] = -1
+            else:
+                status['finalize_returncode'] = self.finalize_future.result()
+        return status
+
+
+class PostRenderPipeline:
+    """ Watches a render's output directory and feeds newly finished frames to the post-render stages.
+
+    A frame is considered finished once its size hasn't changed between two polls (Blender writes frames in place) or
+    once the render process has exited.
+    """
+
+    def __init__(self, output_directory, stages, pool=None):
+        self.output_directory = output_directory
+        self.pool = pool
+        self.stages = [StageProgress(resolve_stage(stage)) for stage in stages]
+        self.submitted_frames = []
+        self.frame_sizes = {}
+        self.render_finished = False
+        self.cancelled = False
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = get_stage_pool()
+        return self.pool
+
+    def get_stage_directory(self, stage):
+        return join(self.output_directory, stage.name)
+
+    def poll(self, render_finished=False):
+        """ Submits any frames that have landed since the last poll and, once the render has finished and all of
+        the frames have been processed, the finalize commands.
+        """
+        if self.cancelled:
+            return
+        self.render_finished = self.render_finished or render_finished
+        submitted = set(self.submitted_frames)
+
+        for frame_name in list_frames(self.output_directory):
+            if frame_name in submitted:
+                continue
+            frame = join(self.output_directory, frame_name)
+            try:
+                size = os.path.getsize(frame)
+            except OSError:
+                continue
+            if not self.render_finished and (not size or self.frame_sizes.get(frame_name) != size):
+                self.frame_sizes[frame_name] = size
+                continue
+
+            self.frame_sizes.pop(frame_name, None)
+            self.submitted_frames.append(frame_name)
+            for progress in self.stages:
+                if progress.stage.per_frame is not None:
+                    progress.frame_futures.append(self._get_pool().submit(
+                        run_per_frame_command,
+                        progress.stage.per_frame,
+                        frame,
+                        self.get_stage_directory(progress.stage)))
+
+        if self.render_finished:
+            for progress in self.stages:
+                if progress.stage.finalize is None or progress.finalize_future is not None:
+                    continue
+                if not all(future.done() for future in progress.frame_futures):
+                    continue
+                progress.finalize_future = self._get_pool().submit(
+                    run_finalize_command,
+                    progress.stage.finalize,
+                    [join(self.output_directory, frame_name) for frame_name in self.submitted_frames],
+                    self.get_frame_pattern(),
+                    join(self.get_stage_directory(progress.stage), progress.stage.output or progress.stage.name),
+                    self.get_stage_directory(progress.stage),
+                    self.output_directory)
+
+    def get_frame_pattern(self):
+        if not self.submitted_frames:
+            return join(self.output_directory, FRAME_PREFIX + '%05d')
+        (_, extension) = splitext(self.submitted_frames[0])
+        return join(self.output_directory, FRAME_PREFIX + '%05d' + extension)
+
+    def is_done(self):
+        if self.cancelled:
+            return True
+        return all(progress.is_done(self.render_finished) for progress in self.stages)
+
+    def status(self):
+        return {progress.stage.name: dict(progress.status(), complete=progress.is_done(self.render_finished))
+                for progress in self.stages}
+
+    def cancel(self):
+        self.cancelled = True
+        for progress in self.stages:
+            for future in progress.frame_futures:
+                future.cancel()
+            if progress.finalize_future is not None:
+                progress.finalize_future.cancel()
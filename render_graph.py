@@ -1,14 +1,38 @@
+import collections
 import json
-from os.path import dirname
+import os
+from os.path import dirname, join, normpath
 
 import path_utils
 
+RENDER_FILE_NAME = 'RENDER.json'
+
+# Directories that only ever contain render output or task files so there's no point looking for targets in them.
+IGNORED_DIRECTORY_NAMES = ['renders', 'Render Tasks', '.git']
+
+
+def find_render_files(project_root):
+    render_files = []
+    for (directory, directory_names, file_names) in os.walk(project_root):
+        directory_names[:] = [name for name in directory_names if name not in IGNORED_DIRECTORY_NAMES]
+        if RENDER_FILE_NAME in file_names:
+            render_files.append(join(directory, RENDER_FILE_NAME))
+    return render_files
+
 
 # Class to represent the dependencies of rendering a target.
 class RenderGraph:
     def __init__(self):
         self.targets = {}
 
+        # The reverse index. Keeps track of which targets were loaded from which render file so that they can be
+        # replaced when it changes and, for each target and each asset (including blend files, expressed relative to
+        # the project root), the targets that directly depend on it.
+        self.render_file_targets = {}
+        self.target_blend_files = {}
+        self.dependents = {}
+        self.asset_dependents = {}
+
     def add_targets(self, project_root, render_file):
         """ Method to add the specified render_file to the render graph.
 
@@ -17,6 +41,8 @@ class RenderGraph:
         we can construct the full target name by which the target will be referred namely "//bar/baz:foo" without which
         file it came from we wouldn't have all the information to recover the full target name for this file.
 
+        If the render_file was added before, the targets it used to contain are replaced.
+
         :param project_root: You know the drill.
         :param render_file: This is the absolute path to the RENDER.json file.
         :return: YOU GET NOTHING. YOU LOSE. GOOD DAY SIR.
@@ -24,6 +50,9 @@ class RenderGraph:
         with open(render_file, 'r') as f:
             render_file_dict = json.load(f)
         target_dicts = render_file_dict['targets']
+
+        self.remove_render_file(render_file)
+        target_names = set()
         for target_dict in target_dicts:
             full_target_name = target_dict['name']
 
@@ -33,7 +62,84 @@ class RenderGraph:
                 relative_target_prefix = path_utils.replace_absolute_project_prefix(project_root, target_root)
                 full_target_name = ':'.join([relative_target_prefix, full_target_name])
 
+            if full_target_name in self.targets:
+                # A target that was declared by another render file is being redeclared here.
+                self._unindex_target(full_target_name)
+                for other_target_names in self.render_file_targets.values():
+                    other_target_names.discard(full_target_name)
+
             self.targets[full_target_name] = target_dict
+            target_names.add(full_target_name)
+            self._index_target(project_root, full_target_name)
+        self.render_file_targets[normpath(render_file)] = target_names
+
+    def add_project(self, project_root):
+        """ Adds every render file in the project."""
+        for render_file in find_render_files(project_root):
+            self.add_targets(project_root, render_file)
+
+    def remove_render_file(self, render_file):
+        """ Removes the targets that were loaded from render_file (e.g. because it was deleted)."""
+        for target_name in self.render_file_targets.pop(normpath(render_file), set()):
+            self._unindex_target(target_name)
+            del self.targets[target_name]
+
+    def get_targets_for_render_file(self, render_file):
+        return self.render_file_targets.get(normpath(render_file), set())
+
+    def _get_indexed_assets(self, target_name):
+        assets = set(self.get_assets_for_target(target_name))
+        assets.add(self.target_blend_files[target_name])
+        return assets
+
+    def _index_target(self, project_root, target_name):
+        target_dict = self.targets[target_name]
+        [relative_target_directory, _] = target_name.split(':')
+        blend_file = path_utils.replace_relative_project_prefix(
+            project_root, relative_target_directory + '/' + target_dict['src'])
+
+        self.target_blend_files[target_name] = path_utils.replace_absolute_project_prefix(project_root, blend_file)
+
+        for dep in self.get_deps_for_target(target_name):
+            self.dependents.setdefault(dep, set()).add(target_name)
+        for asset in self._get_indexed_assets(target_name):
+            self.asset_dependents.setdefault(asset, set()).add(target_name)
+
+    def _unindex_target(self, target_name):
+        for dep in self.get_deps_for_target(target_name):
+            self._discard(self.dependents, dep, target_name)
+        for asset in self._get_indexed_assets(target_name):
+            self._discard(self.asset_dependents, asset, target_name)
+        del self.target_blend_files[target_name]
+
+    @staticmethod
+    def _discard(index, key, target_name):
+        if key in index:
+            index[key].discard(target_name)
+            if not index[key]:
+                del index[key]
+
+    def get_direct_dependents(self, target_or_asset):
+        """ Returns the targets that list target_or_asset (a target or a path relative to the project root) as one
+        of their deps, assets or blend file.
+        """
+        if target_or_asset in self.targets or target_or_asset in self.dependents:
+            return set(self.dependents.get(target_or_asset, set()))
+        return set(self.asset_dependents.get(target_or_asset, set()))
+
+    def get_transitive_dependents(self, target_or_asset):
+        """ Returns every target that needs to be rerendered if target_or_asset changes, nearest first."""
+        dependents = []
+        seen = set()
+        pending = collections.deque(sorted(self.get_direct_dependents(target_or_asset)))
+        while pending:
+            target_name = pending.popleft()
+            if target_name in seen:
+                continue
+            seen.add(target_name)
+            dependents.append(target_name)
+            pending.extend(sorted(self.dependents.get(target_name, set())))
+        return dependents
 
     def get_deps_for_target(self, target_name):
         if 'deps' in self.targets[target_name]:
@@ -47,3 +153,14 @@ class RenderGraph:
         if 'assets' in self.targets[target_name]:
             return self.targets[target_name]['assets']
         return []
+
+    def get_post_render_stages_for_target(self, target_name):
+        if 'post_render_stages' in self.targets[target_name]:
+            return self.targets[target_name]['post_render_stages']
+        return []
+
+    def get_render_profile_for_target(self, target_name):
+        return self.targets[target_name].get('render_profile')
+
+    def get_peak_memory_mb_for_target(self, target_name):
+        return self.targets[target_name].get('peak_memory_mb')
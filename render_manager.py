@@ -1,45 +1,463 @@
-import copy
+import collections
 import json
 import math
 import os
-import queue
+import posixpath
 import time
+import uuid
 from os.path import join
 
 import render_graph
+from job_registry import get_task_key
 from path_utils import (
-    get_directory_for_target,
-    get_latest_image_sequence_directory_for_target,
     replace_absolute_project_prefix,
-    get_absolute_blend_file,
     replace_relative_project_prefix)
+from post_render import PostRenderPipeline
+from render_profiles import get_quality_settings, get_render_settings
+from render_task import BlendFileTask, Target
+
+# How many times longer than predicted a chunk has to have been running before a backup copy of it is started.
+SPECULATION_THRESHOLD = 2.0
+
+
+class RenderOutput:
+    """ The tasks rendering into one output directory, e.g. the passes of a progressive render.
+
+    Their post-render stages run once over every frame that lands in the directory and the status files are written
+    once the last of them is done, not by each chunk.
+    """
+
+    def __init__(self):
+        self.tasks = []
+        # How many of the tasks are queued or running.
+        self.pending_tasks = 0
+        self.statuses = []
+        self.processor = None
+        self.returncode = 0
+        self.pipeline = None
+        # The tasks of a resumed job that had already rendered into the directory before the scheduler died.
+        self.resumed_tasks = []
 
 
 class RenderManager:
-    def __init__(self, project_root, task_spec, processors):
+    def __init__(self, project_root, task_spec, processors, registry=None, admission=None, graph=None, journal=None,
+                 tasks=None, clock=time.time, batch_duration_budget=None, run_post_render_stages=True, job=None,
+                 resumed_outputs=()):
+        self.project_root = project_root
         self.task_spec = task_spec
+
+        # The status files of every task record the job it was rendered for so that the simulator can replay the
+        # history job by job. A resumed job passes in the one it was started as.
+        self.job = job
+        if self.job is None:
+            self.job = {'id': uuid.uuid4().hex, 'start_time': time.time(), 'task_spec': task_spec}
         self.processors = processors
         self.current_task_statuses = []
 
+        # Optional job_registry.JobRegistry shared with the other jobs running against the same project. When it's
+        # set, blend file tasks that another job has already queued are not rendered a second time.
+        self.registry = registry
+
+        # Optional admission.MemoryAdmissionController that holds tasks back until there's enough memory to run them.
+        self.admission = admission
+
+        # Optional journal.SchedulerJournal that every state transition is written to so that the job can be
+        # resumed if we die.
+        self.journal = journal
+        self.task_ids = {}
+        self.status_chunk_ids = {}
+        # Statuses whose Blender process hasn't been started yet (e.g. while their input files are staged) so their
+        # pid still has to be journaled.
+        self.unjournaled_pid_statuses = []
+        self.next_chunk_id = 0
+
+        # Blend file tasks owned by another job that we're waiting on.
+        self.attached_tasks = []
+
+        # Maps each running status to the (unsplit) blend file task it's rendering a chunk of and counts how many
+        # chunks of that task are still outstanding so that we know when the whole task is done.
+        self.status_parent_tasks = {}
+        self.status_processors = {}
+        self.outstanding_chunks = {}
+        self.chunk_returncodes = {}
+
+        # Task key -> the task that stitches the tiles back together for the tasks that were split into tiles.
+        self.stitch_tasks = {}
+
+        # Straggling chunk status -> the status of the backup copy of its remaining frames and the other way around.
+        # Whichever of the two finishes first wins and the other one is cancelled.
+        self.backups = {}
+        self.backup_originals = {}
+
+        # Used to tell how long chunks have been running, the simulator swaps in its own.
+        self.clock = clock
+
+        # Optional number of seconds of predicted rendering that small tasks are batched up to and run in a single
+        # Blender process by processors that support it. None runs every task in its own process.
+        self.batch_duration_budget = batch_duration_budget
+        # Task key -> how long its last recorded render took (or None).
+        self.recorded_durations = {}
+        # Task key -> the seconds per frame of the chunks of the task that finished, what the chunks still running are
+        # expected to take.
+        self.chunk_seconds_per_frame = {}
+
+        # Output directory -> the RenderOutput of the tasks we're rendering into it.
+        self.outputs = {}
+        # The simulator doesn't want stages running over the real project.
+        self.run_post_render_stages = run_post_render_stages
+
+        # The preview settings only apply to the task that was asked for, not its dependencies.
+        preview = task_spec.get('preview')
+        task_spec = {key: value for key, value in task_spec.items() if key != 'preview'}
+
         # TODO(mattkeller): this seems pretty heavy to do in the constructor.
-        if 'target' in task_spec:
-            task_list = get_blend_file_task_linearized_dag_from_target_task(project_root, task_spec)
+        if tasks is not None:
+            # The tasks have already been planned, e.g. we're resuming a job from its journal.
+            task_list = list(tasks)
+            preview = None
+        elif 'target' in task_spec:
+            task_list = get_blend_file_task_linearized_dag_from_target_task(project_root, task_spec, graph)
         elif 'blend_file' in task_spec:
-            task_list = [task_spec]
+            task_list = [BlendFileTask.from_dict(task_spec)]
         else:
             raise AssertionError('You dun goofed.')
 
-        self.task_queue = queue.Queue()
+        if preview and task_list:
+            task_list[-1:] = get_progressive_passes(
+                task_list[-1], preview['stride'], preview.get('resolution_percentage'))
+
+        # A deque rather than a queue.Queue so that a task that can't be launched yet (e.g. because there isn't
+        # enough memory) can be put back at the front.
+        self.task_queue = collections.deque()
+
+        if self.journal is not None:
+            self.journal.record('job', task_spec=self.task_spec, job_id=self.job['id'],
+                                start_time=self.job['start_time'])
 
-        # The Queue class doesn't have a putall method, I swear.
         for task in task_list:
-            self.task_queue.put(task)
+            self.task_ids[task] = len(self.task_ids)
+            if self.journal is not None:
+                self.journal.record('planned', task_id=self.task_ids[task], task=task.to_dict())
+            if self.registry is None or self.registry.claim(task, self):
+                self._queue_task(task)
+            else:
+                print('Waiting on %s which is already being rendered by another job.' % task.blend_file)
+                self.attached_tasks.append(task)
+
+        # (task, return code) of the output directories a resumed job had rendered into (see
+        # journal.RecoveredJob.get_resumed_outputs), they're finalized once whatever is left of them is done.
+        for (task, returncode) in resumed_outputs:
+            if self.journal is not None:
+                self.journal.record('resumed_output', task=task.to_dict(), returncode=returncode)
+            output = self.outputs.get(task.output_directory)
+            if output is None:
+                output = self.outputs[task.output_directory] = RenderOutput()
+            output.resumed_tasks.append(task)
+            output.returncode = output.returncode or returncode
+            if self.registry is not None:
+                self.registry.acquire_output_directory(task, self)
+
+        if self.journal is not None:
+            self.journal.sync()
 
     def is_done(self):
-        if not self.current_task_statuses and self.task_queue.empty():
+        if not self.current_task_statuses and not self.task_queue and not self.attached_tasks and not self.outputs:
+            self._close_journal()
             return True
         return False
 
+    def _close_journal(self):
+        # Once the job is done there's nothing left to recover.
+        if self.journal is not None:
+            self.journal.record('job_done')
+            self.journal.close(delete=True)
+            self.journal = None
+
+    def on_shared_task_complete(self, task_spec, returncode):
+        """ Called by the registry once a blend file task that this job is involved in has finished."""
+        if task_spec in self.attached_tasks:
+            print('Shared task %s finished with return code %s' % (task_spec.blend_file, returncode))
+            self.attached_tasks.remove(task_spec)
+            if self.journal is not None:
+                self.journal.record('shared_finished', task_id=self.task_ids[task_spec], returncode=returncode)
+
+    def adopt_shared_task(self, task_spec):
+        """ Called by the registry when the job that owned a task we were waiting on gave up on it."""
+        if task_spec in self.attached_tasks:
+            self.attached_tasks.remove(task_spec)
+        self._queue_task(task_spec)
+
+    def _queue_task(self, task_spec):
+        output = self.outputs.get(task_spec.output_directory)
+        if output is None:
+            output = self.outputs[task_spec.output_directory] = RenderOutput()
+        output.tasks.append(task_spec)
+        output.pending_tasks += 1
+        self.task_queue.append(task_spec)
+
+    def _dispatch(self, processor, task_spec, parent_task):
+        status = processor.process(task_spec)
+        self._track(processor, status, task_spec, parent_task)
+        return status
+
+    def _dispatch_batch(self, processor, tasks):
+        print('Rendering %d small tasks in one batch.' % len(tasks))
+        for (task_spec, status) in zip(tasks, processor.process_batch(tasks)):
+            self.outstanding_chunks[get_task_key(task_spec)] = 1
+            self._track(processor, status, task_spec, task_spec)
+
+    def _track(self, processor, status, task_spec, parent_task):
+        output = self.outputs[parent_task.output_directory]
+        if output.pipeline is None and parent_task.post_render_stages and self.run_post_render_stages:
+            # Every chunk renders into the same directory so the stages run once for all of them.
+            output.pipeline = PostRenderPipeline(
+                replace_relative_project_prefix(self.project_root, parent_task.output_directory),
+                parent_task.post_render_stages)
+        self.current_task_statuses.append(status)
+        self.status_parent_tasks[status] = parent_task
+        self.status_processors[status] = processor
+        if self.admission is not None:
+            self.admission.on_launch(status)
+        if self.journal is not None:
+            chunk_id = self.next_chunk_id
+            self.next_chunk_id += 1
+            self.status_chunk_ids[status] = chunk_id
+            self.journal.record('dispatched', task_id=self.task_ids[parent_task], chunk_id=chunk_id,
+                                task=task_spec.to_dict())
+            if hasattr(status, 'process'):
+                self.unjournaled_pid_statuses.append(status)
+                self._journal_pids()
+
+    def _journal_pids(self):
+        """ Journals the pids of the Blender processes that were started since we last looked."""
+        for status in [status for status in self.unjournaled_pid_statuses if status.process is not None]:
+            self.unjournaled_pid_statuses.remove(status)
+            self.journal.record('pid', chunk_id=self.status_chunk_ids[status], pid=status.process.pid)
+
+    def _on_chunk_done(self, status, returncode):
+        if self.admission is not None:
+            self.admission.on_finish(status)
+        parent_task = self.status_parent_tasks.pop(status)
+        processor = self.status_processors.pop(status)
+        if hasattr(processor, 'record_completed_chunk'):
+            processor.record_completed_chunk(status)
+        if self.journal is not None:
+            self.journal.record('failed' if returncode else 'finished',
+                                chunk_id=self.status_chunk_ids.pop(status), returncode=returncode)
+            if status in self.unjournaled_pid_statuses:
+                self.unjournaled_pid_statuses.remove(status)
+        output = self.outputs[parent_task.output_directory]
+        output.statuses.append(status)
+        output.processor = processor
+        key = get_task_key(parent_task)
+        self.outstanding_chunks[key] -= 1
+        if returncode:
+            self.chunk_returncodes[key] = returncode
+        if self.outstanding_chunks[key] == 0:
+            del self.outstanding_chunks[key]
+            returncode = self.chunk_returncodes.pop(key, 0)
+            stitch_task = self.stitch_tasks.pop(key, None)
+            if stitch_task is not None and not returncode:
+                # The task isn't done until its tiles have been stitched back together.
+                self.task_ids[stitch_task] = self.task_ids[parent_task]
+                output.tasks.append(stitch_task)
+                self.task_queue.appendleft(stitch_task)
+                return
+            output.pending_tasks -= 1
+            if returncode:
+                output.returncode = returncode
+
+    def _poll_outputs(self):
+        """ Feeds the frames that landed to the post-render stages and finalizes the output directories whose tasks
+        are all done.
+        """
+        for (output_directory, output) in list(self.outputs.items()):
+            if output.pipeline is not None:
+                output.pipeline.poll(render_finished=not output.pending_tasks)
+            if output.pending_tasks or (output.pipeline is not None and not output.pipeline.is_done()):
+                continue
+            del self.outputs[output_directory]
+            self._finalize_output(output)
+
+    def _finalize_output(self, output):
+        post_render_status = None
+        if output.pipeline is not None:
+            post_render_status = output.pipeline.status()
+        tasks = output.resumed_tasks + output.tasks
+        processor = output.processor
+        if processor is None and output.resumed_tasks:
+            # Nothing was left to render into the directory when the job was resumed.
+            processor = self.processors[0]
+        if hasattr(processor, 'finalize_render'):
+            processor.finalize_render(merge_output_tasks(tasks), output.statuses, output.returncode,
+                                      post_render_status, job=self.job, resumed=bool(output.resumed_tasks))
+        if self.journal is not None:
+            self.journal.record('output_finalized', output_directory=tasks[0].output_directory)
+        if self.registry is not None:
+            for task_spec in output.tasks:
+                self.registry.complete(task_spec, output.returncode)
+            self.registry.release_output_directory(tasks[0].output_directory, self)
+
+    def _acquire_output_directory(self, task_spec):
+        """ Makes sure no other job is rendering into the output directory of the task, e.g. the same target at a
+        different resolution, since the last one to start would archive or overwrite the other one's frames.
+        """
+        if self.registry is None or self.registry.acquire_output_directory(task_spec, self):
+            return True
+        print('Waiting for another job to finish rendering into %s.' % task_spec.output_directory)
+        return False
+
+    def _get_recorded_duration(self, task_spec):
+        key = get_task_key(task_spec)
+        if key not in self.recorded_durations:
+            self.recorded_durations[key] = get_recorded_duration(self.project_root, task_spec)
+        return self.recorded_durations[key]
+
+    def _predict_duration(self, task_spec, processor):
+        """ Predicts how long the task takes from its last recorded render or, if it hasn't been rendered before, from
+        how many frames per second the processor has been rendering (whatever the scene).
+        """
+        recorded_duration = self._get_recorded_duration(task_spec)
+        if recorded_duration is not None:
+            return recorded_duration
+        throughput = getattr(processor, 'throughput', None)
+        if throughput and task_spec.has_frame_range():
+            return len(task_spec.get_frames()) / throughput
+        return None
+
+    def _record_seconds_per_frame(self, status, parent_task):
+        if not hasattr(status, 'start_time') or not status.task_spec.has_frame_range() or \
+                status.task_spec.border is not None:
+            return
+        seconds_per_frame = (self.clock() - status.start_time) / len(status.task_spec.get_frames())
+        self.chunk_seconds_per_frame.setdefault(get_task_key(parent_task), []).append(seconds_per_frame)
+
+    def _predict_chunk_duration(self, status):
+        """ Predicts how long a running chunk should take from how long the chunks of the same task that finished
+        took per frame or, if none have, from the last recorded render of the chunk's frames.
+
+        Processor throughputs are averaged over every scene they rendered so they say little about a single chunk.
+        """
+        seconds_per_frame = self.chunk_seconds_per_frame.get(get_task_key(self.status_parent_tasks[status]))
+        if seconds_per_frame:
+            return len(status.task_spec.get_frames()) * sum(seconds_per_frame) / len(seconds_per_frame)
+        return self._get_recorded_duration(status.task_spec)
+
+    def _has_queued_work(self):
+        """ Whether this job or any other job sharing the processors (through the registry) still has tasks to
+        launch.
+        """
+        if self.task_queue:
+            return True
+        if self.registry is None:
+            return False
+        return any(getattr(job, 'task_queue', None) for job in self.registry.get_active_jobs() if job is not self)
+
+    def _get_next_batch(self, processor):
+        """ Returns the tasks at the front of the queue that can be rendered one after the other in a single Blender
+        process on processor without going over the batch duration budget.
+
+        Tasks we can't predict a duration for, tiled tasks and tasks that read the output of another task in the batch
+        end the batch so that a failure in one task doesn't affect the others.
+        """
+        batch = []
+        batch_duration = 0
+        batch_outputs = set()
+        for task_spec in self.task_queue:
+            if task_spec.border is not None or task_spec.tile_grid is not None:
+                break
+            duration = self._predict_duration(task_spec, processor)
+            if duration is None or batch_duration + duration > self.batch_duration_budget:
+                break
+            if any(input_file in batch_outputs for input_file in task_spec.input_files):
+                break
+            if batch and self.admission is not None and not self.admission.admit(task_spec):
+                break
+            if batch and not self._acquire_output_directory(task_spec):
+                break
+            batch.append(task_spec)
+            batch_duration += duration
+            batch_outputs.add(task_spec.output_directory)
+        return batch
+
+    def _launch_backup(self, processor, status, remaining_frames):
+        backup_task = status.task_spec.replace(
+            start_frame=remaining_frames[0],
+            output_directory=get_backup_output_directory(status.task_spec.output_directory, remaining_frames[0]),
+            append_to_output=None,
+        )
+        # The frames a backup commits land in the original's output directory where its post-render pipeline picks
+        # them up like any other frame.
+        print('%s frames %d-%d are taking much longer than expected, starting a backup.' % (
+            status.task_spec.blend_file, remaining_frames[0], remaining_frames[-1]))
+        # Backups aren't journaled, if we die the original chunk is resumed on its own.
+        backup = processor.process(backup_task)
+        self.current_task_statuses.append(backup)
+        self.status_processors[backup] = processor
+        if self.admission is not None:
+            self.admission.on_launch(backup)
+        self.backups[status] = backup
+        self.backup_originals[backup] = status
+
+    def _launch_backups(self, processors):
+        """ Starts backup copies of the chunks that are running far behind their predicted finish time on whatever
+        processors are idle once no job has anything left in its queue.
+        """
+        idle_processors = [processor for processor in processors if processor.is_available()]
+        if not idle_processors or self._has_queued_work():
+            return
+
+        stragglers = []
+        for status in self.current_task_statuses:
+            if status in self.backups or status in self.backup_originals or not hasattr(status, 'commit_backup'):
+                continue
+            task = status.task_spec
+            if not task.has_frame_range() or task.tile_grid is not None:
+                continue
+            completed_frames = set(status.get_completed_frames())
+            remaining_frames = [frame for frame in task.get_frames() if frame not in completed_frames]
+            predicted_duration = self._predict_chunk_duration(status)
+            if not predicted_duration:
+                continue
+            slowdown = (self.clock() - status.start_time) / predicted_duration
+            if remaining_frames and slowdown > SPECULATION_THRESHOLD:
+                stragglers.append((slowdown, status, remaining_frames))
+
+        # The furthest behind get the fastest idle processors.
+        stragglers.sort(key=lambda straggler: straggler[0], reverse=True)
+        for ((_, status, remaining_frames), processor) in zip(stragglers, idle_processors):
+            if self.admission is not None and not self.admission.admit(status.task_spec):
+                break
+            self._launch_backup(processor, status, remaining_frames)
+
+    def _on_backup_done(self, backup):
+        status = self.backup_originals.pop(backup)
+        del self.backups[status]
+        processor = self.status_processors.pop(backup)
+        if self.admission is not None:
+            self.admission.on_finish(backup)
+        if backup.returncode:
+            print('The backup of %s failed, waiting on the original.' % status.task_spec.blend_file)
+            return
+
+        print('The backup of %s finished first.' % status.task_spec.blend_file)
+        if hasattr(processor, 'record_completed_chunk'):
+            processor.record_completed_chunk(backup)
+        self.outputs[self.status_parent_tasks[status].output_directory].statuses.append(backup)
+        # This cancels the original and moves the backup's frames into the original's output directory.
+        backup.commit_backup(status)
+        self.current_task_statuses.remove(status)
+        self._on_chunk_done(status, 0)
+
+    def _discard_backup(self, status):
+        backup = self.backups.pop(status)
+        del self.backup_originals[backup]
+        self.current_task_statuses.remove(backup)
+        self.status_processors.pop(backup)
+        if self.admission is not None:
+            self.admission.on_finish(backup)
+        backup.discard_backup()
+
     # This method looks at the work left to process
     # and the available workers and assigns a task
     # to a worker, if possible.
@@ -48,32 +466,83 @@ class RenderManager:
     def launch_next_tasks(self):
 
         # Check if there are newly completed tasks
-        still_running_statuses = []
-        for status in self.current_task_statuses:
-            if status.is_done():
-                status.finalize_task()
-            else:
-                still_running_statuses.append(status)
-        self.current_task_statuses = still_running_statuses
+        for status in [status for status in self.current_task_statuses if status.is_done()]:
+            if status not in self.current_task_statuses:
+                # It lost the race against its backup (or the other way around).
+                continue
+            self.current_task_statuses.remove(status)
+            if status in self.backup_originals:
+                self._on_backup_done(status)
+                continue
+            if status in self.backups:
+                self._discard_backup(status)
+            status.finalize_task()
+            if not status.returncode:
+                self._record_seconds_per_frame(status, self.status_parent_tasks[status])
+            self._on_chunk_done(status, status.returncode)
+        if self.journal is not None:
+            self._journal_pids()
+        self._poll_outputs()
 
         # Check if there are workers available to perform tasks
         available_processors = [processor for processor in self.processors if processor.is_available()]
 
+        # Fastest first so that the fastest processors get the biggest chunks and the next task in the queue.
+        throughputs = get_processor_throughputs(self.processors)
+        available_processors.sort(key=lambda processor: throughputs[processor], reverse=True)
+
         # Check if there are remaining tasks
         # Give those tasks to those workers, keeping the references to the ongoing
         # tasks
-        if not self.task_queue.empty() and available_processors:
+        if self.task_queue and available_processors:
 
             # TODO(mattkeller): find a less gross way to phrase this code.
-            if self.task_queue.qsize() == 1:
-                task_spec = self.task_queue.get()
-                split_tasks = split_task(task_spec, len(available_processors))
-                for index, processor in enumerate(available_processors):
-                    self.current_task_statuses.append(processor.process(split_tasks[index]))
+            if len(self.task_queue) == 1 and self.task_queue[0].tile_grid is None:
+                # Every chunk is a separate Blender process that loads the whole scene so memory limits how many of
+                # them we can run at once.
+                num_chunks = len(available_processors)
+                if self.admission is not None:
+                    num_chunks = self.admission.get_admissible_count(self.task_queue[0], num_chunks)
+                if not num_chunks or not self._acquire_output_directory(self.task_queue[0]):
+                    return
+                task_spec = self.task_queue.popleft()
+                if should_split_into_tiles(task_spec, num_chunks):
+                    # There are more processors than frames so each of them renders a part of every frame instead.
+                    (split_tasks, self.stitch_tasks[get_task_key(task_spec)]) = split_task_into_tiles(
+                        task_spec, num_chunks)
+                    if self.journal is not None:
+                        self.journal.record('tiled', task_id=self.task_ids[task_spec],
+                                            task=self.stitch_tasks[get_task_key(task_spec)].to_dict())
+                else:
+                    weights = [throughputs[processor] for processor in available_processors[:num_chunks]]
+                    if len(set(weights)) == 1:
+                        # Nothing to tell the processors apart by so they all get the same share.
+                        weights = None
+                    split_tasks = split_task(task_spec, num_chunks, weights)
+                self.outstanding_chunks[get_task_key(task_spec)] = len(split_tasks)
+                for sub_task, processor in zip(split_tasks, available_processors):
+                    self._dispatch(processor, sub_task, task_spec)
             else:
                 for processor in available_processors:
-                    task_spec = self.task_queue.get()
-                    self.current_task_statuses.append(processor.process(task_spec))
+                    if not self.task_queue:
+                        break
+                    if self.admission is not None and not self.admission.admit(self.task_queue[0]):
+                        print('Not enough memory to start %s yet.' % self.task_queue[0].blend_file)
+                        break
+                    if not self._acquire_output_directory(self.task_queue[0]):
+                        break
+                    if self.batch_duration_budget is not None and hasattr(processor, 'process_batch'):
+                        batch = self._get_next_batch(processor)
+                        if len(batch) > 1:
+                            for _ in batch:
+                                self.task_queue.popleft()
+                            self._dispatch_batch(processor, batch)
+                            continue
+                    task_spec = self.task_queue.popleft()
+                    self.outstanding_chunks[get_task_key(task_spec)] = 1
+                    self._dispatch(processor, task_spec, task_spec)
+
+        self._launch_backups(available_processors)
 
     def blocking_render(self):
         while not self.is_done():
@@ -84,100 +553,214 @@ class RenderManager:
 
     # Gives some indication of how far along we are.
     def status(self):
-        pass
+        """ Returns a snapshot of the job's progress as a plain dict that's safe to hand to another thread."""
+        total_tasks = len(set(self.task_ids.values()))
+        # A task whose chunks are running counts as one unfinished task however many chunks it was split into.
+        unfinished_tasks = len(self.task_queue) + len(self.outstanding_chunks) + len(self.attached_tasks)
+        finished_tasks = max(0, total_tasks - unfinished_tasks)
+        return {
+            'total_tasks': total_tasks,
+            'finished_tasks': finished_tasks,
+            'queued_tasks': len(self.task_queue),
+            'shared_tasks': len(self.attached_tasks),
+            'running_chunks': len(self.current_task_statuses),
+            # Frames rendered to local scratch storage that haven't been flushed to the project drive yet.
+            'flush_backlog': sum(status.get_flush_backlog() for status in self.current_task_statuses
+                                 if hasattr(status, 'get_flush_backlog')),
+            'progress': finished_tasks / total_tasks if total_tasks else 1.0,
+        }
 
     def cancel(self):
         for status in self.current_task_statuses:
             status.cancel()
+        for output in self.outputs.values():
+            if output.pipeline is not None:
+                output.pipeline.cancel()
+        self.outputs = {}
+        if self.registry is not None:
+            self.registry.release(self)
+        self._close_journal()
 
 
 def get_blend_file_task_linearized_dag_from_target_task(project_root, target_task, graph=None):
+    """ Plans the blend file tasks required to render the target in target_task.
+
+    :param project_root: the root directory for the whole project.
+    :param target_task: a target task spec dict, i.e. a blend file task spec with a 'target' instead of a
+                        'blend_file' and 'output_directory'.
+    :param graph: an optional RenderGraph to reuse.
+    :return: a list of BlendFileTasks ordered such that every task comes after the tasks it depends on.
+    """
     rg = graph
     if rg is None:
         rg = render_graph.RenderGraph()
 
     assert 'target' in target_task
-    target = target_task['target']
+    target = Target(project_root, target_task['target'])
 
-    # forgive the overly verbose name.
-    # this is the set of reasons why a dependency will be rerendered
-    # this should be a list of strings.
-    #
-    # An empty list means that we won't rerender our dependencies
-
-    dependency_invalidation_types = target_task['dependency_invalidation_types']
-
-    new_task_template = copy.copy(target_task)
-    del new_task_template['target']
+    # The preview settings are applied to the planned tasks by the RenderManager, they don't change what's planned.
+    root_task = BlendFileTask.from_dict(
+        {key: value for key, value in target_task.items() if key not in ['target', 'preview']})
 
     # The start frame and end frame are only meaningful in the context of the original target so are not forwarded to
     # dependent tasks.
     #
     # Task splitting is hooked into this so it might be good to have a way to figure this out.
-    root_start_frame = None
-    if 'start_frame' in new_task_template:
-        root_start_frame = new_task_template['start_frame']
-        del new_task_template['start_frame']
+    dependency_task_template = root_task.replace(start_frame=None, end_frame=None)
 
-    root_end_frame = None
-    if 'end_frame' in new_task_template:
-        root_end_frame = new_task_template['end_frame']
-        del new_task_template['end_frame']
+    # Dicts keep their insertion order so this doubles as an ordered set of the planned tasks.
+    planned_tasks = {}
+    _plan_target(rg, target, root_task, dependency_task_template, planned_tasks, {})
+    return list(planned_tasks)
 
-    absolute_target_directory = get_directory_for_target(project_root, target)
-    render_file = join(absolute_target_directory, 'RENDER.json')
-    rg.add_targets(project_root, render_file)
-    blend_files = []
 
-    if dependency_invalidation_types:
-        for dep_target in rg.get_deps_for_target(target):
-            dep_task = copy.copy(new_task_template)
-            dep_task['target'] = dep_target
-            for dep_blend_file_task in get_blend_file_task_linearized_dag_from_target_task(project_root, dep_task, rg):
-                scheduled = False
-
-                # if dep_blend_file_task is in blend_files already we don't need to add it again.
-                # we can probably do this more efficiently some how, possibly we build the graph and produce the dag
-                # in two passes?
-                for blend_file in blend_files:
-                    if dep_blend_file_task == blend_file:
-                        scheduled = True
-                        break
-                if scheduled:
-                    continue
-                else:
-                    blend_files.append(dep_blend_file_task)
+def _plan_target(rg, target, task_template, dependency_task_template, planned_tasks, visited_targets):
+    """ Adds the blend file tasks for target and its dependencies to planned_tasks.
 
-    # Basically, there are three reasons we'll rerender the blend file:
-    #  - the source blend file for the target has changed since the start time of the latest render
-    #  - any of this blend files dependencies have declared that they need to be rerendered (indicated by returning us
-    #    a list of blender file tasks)
-    #  - the dependency_invalidation_types list is empty (indicating a fast rerender requested)
-
-    if needs_rerender(project_root, rg, target_task) or blend_files or not dependency_invalidation_types:
-        new_task = copy.copy(new_task_template)
+    :return: True if target or any of its (transitive) dependencies will be rendered.
+    """
+    if target in visited_targets:
+        return visited_targets[target]
 
-        # If the start and end frame were set on the incoming target task, we make sure to reattach it when we render
-        # the blend file specifically associated with the target requested.
-        if root_start_frame:
-            new_task['start_frame'] = root_start_frame
-        if root_end_frame:
-            new_task['end_frame'] = root_end_frame
+    if target.name not in rg.targets:
+        rg.add_targets(target.project_root, target.render_file)
 
-        absolute_blend_file = get_absolute_blend_file(project_root, target, rg.get_blend_file_for_target(target))
-        new_task['blend_file'] = replace_absolute_project_prefix(project_root, absolute_blend_file)
-        absolute_output_directory = get_latest_image_sequence_directory_for_target(project_root, target)
-        new_task['output_directory'] = replace_absolute_project_prefix(project_root, absolute_output_directory)
-        blend_files.append(new_task)
-    return blend_files
+    # forgive the overly verbose name.
+    # this is the set of reasons why a dependency will be rerendered
+    # this should be a list of strings.
+    #
+    # An empty list means that we won't rerender our dependencies
+    dependency_invalidation_types = task_template.dependency_invalidation_types
 
+    dependency_scheduled = False
+    if dependency_invalidation_types:
+        for dep_target_name in rg.get_deps_for_target(target.name):
+            dep_target = Target(target.project_root, dep_target_name)
+            if _plan_target(rg, dep_target, dependency_task_template, dependency_task_template, planned_tasks,
+                            visited_targets):
+                dependency_scheduled = True
 
-def split_task(task_spec, num_sub_tasks):
+    # Basically, there are three reasons we'll rerender the blend file:
+    #  - the source blend file for the target has changed since the start time of the latest render
+    #  - any of this blend files dependencies have declared that they need to be rerendered
+    #  - the dependency_invalidation_types list is empty (indicating a fast rerender requested)
+    scheduled = dependency_scheduled or not dependency_invalidation_types or \
+        needs_rerender(rg, target, task_template)
+
+    if scheduled:
+        absolute_blend_file = target.get_absolute_blend_file(rg.get_blend_file_for_target(target.name))
+        new_task = task_template.replace(
+            blend_file=replace_absolute_project_prefix(target.project_root, absolute_blend_file),
+            output_directory=target.relative_latest_directory,
+            post_render_stages=rg.get_post_render_stages_for_target(target.name),
+            peak_memory_mb=rg.get_peak_memory_mb_for_target(target.name),
+            render_profile=get_render_profile(rg, target, task_template),
+            input_files=tuple(rg.get_assets_for_target(target.name)) + tuple(
+                Target(target.project_root, dep_target_name).relative_latest_directory
+                for dep_target_name in rg.get_deps_for_target(target.name)),
+        )
+        planned_tasks[new_task] = None
+
+    visited_targets[target] = scheduled
+    return scheduled
+
+
+def merge_output_tasks(tasks):
+    """ Returns a single task covering every frame that tasks rendered into their shared output directory, which is
+    what its status files record.
+    """
+    if len(tasks) == 1 or not all(task.has_frame_range() for task in tasks):
+        return tasks[-1]
+    frames = sorted(set(frame for task in tasks for frame in task.get_frames()))
+    steps = set(later - earlier for (earlier, later) in zip(frames, frames[1:]))
+    # Whoever rendered first decided whether the output directory was archived, the stitch task (if any) is last.
+    return tasks[0].replace(
+        start_frame=frames[0],
+        end_frame=frames[-1],
+        frame_step=steps.pop() if len(steps) == 1 and steps != {1} else None,
+        tile_grid=tasks[-1].tile_grid,
+    )
+
+
+def get_recorded_duration(project_root, task_spec):
+    """ Returns how many seconds the task took to render according to the DONE.json of its last render, scaled to the
+    task's frame range, or None if it hasn't been rendered before.
+    """
+    if task_spec.output_directory is None:
+        return None
+    done_file = join(replace_relative_project_prefix(project_root, task_spec.output_directory), 'DONE.json')
+    if not os.path.exists(done_file):
+        return None
+    try:
+        with open(done_file, 'r') as f:
+            done_dict = json.load(f)
+        duration = done_dict['completion_time'] - done_dict['start_time']
+        recorded_task = BlendFileTask.from_dict(done_dict['task_spec'])
+    except (ValueError, KeyError, TypeError):
+        print('Unable to read %s' % done_file)
+        return None
+    if task_spec.has_frame_range() and recorded_task.has_frame_range():
+        duration *= len(task_spec.get_frames()) / len(recorded_task.get_frames())
+    return max(0.0, duration)
+
+
+def get_processor_throughputs(processors):
+    """ Returns a dict of processor -> measured frames per second.
+
+    Processors that haven't finished a chunk yet are assumed to be as fast as the average of the ones that have.
+    """
+    measured = [processor.throughput for processor in processors if getattr(processor, 'throughput', None)]
+    default = sum(measured) / len(measured) if measured else 1.0
+    return {processor: getattr(processor, 'throughput', None) or default for processor in processors}
+
+
+def get_weighted_segment_sizes(num_frames, weights):
+    """ Divides num_frames between the weights in proportion to them.
+
+    Rounding leftovers go to the largest remainders so for non-increasing weights the sizes are non-increasing too.
+    """
+    total = sum(weights)
+    exact_sizes = [num_frames * weight / total for weight in weights]
+    sizes = [int(size) for size in exact_sizes]
+    leftovers = num_frames - sum(sizes)
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact_sizes[i] - sizes[i], reverse=True)
+    for i in by_remainder[:leftovers]:
+        sizes[i] += 1
+    return sizes
+
+
+def split_task(task_spec, num_sub_tasks, weights=None):
+    """ Splits the frame range of the task into at most num_sub_tasks tasks.
+
+    :param weights: optional relative speeds of the processors the sub tasks are meant for. Each sub task gets a share
+        of the frames proportional to its weight and the sub tasks come back in the same order as the weights. Sub
+        tasks that would be left with no frames are dropped, so pass the weights fastest first.
+    """
     # Consumers of this method expect a list so we return the task_spec wrapped in a list.
-    if 'start_frame' not in task_spec or 'end_frame' not in task_spec:
+    if not task_spec.has_frame_range():
         return [task_spec]
-    start_frame = task_spec['start_frame']
-    end_frame = task_spec['end_frame']
+
+    if weights is not None:
+        assert len(weights) == num_sub_tasks
+        frames = task_spec.get_frames()
+        sub_tasks = []
+        offset = 0
+        for size in get_weighted_segment_sizes(len(frames), weights):
+            if size:
+                sub_tasks.append(task_spec.replace(start_frame=frames[offset], end_frame=frames[offset + size - 1]))
+            offset += size
+        return sub_tasks
+
+    # Strided tasks (e.g. the passes of a progressive render) are split into runs of consecutive frames of the same
+    # stride so that every sub task can still be rendered with Blender's frame step.
+    if task_spec.frame_step and task_spec.frame_step > 1:
+        frames = task_spec.get_frames()
+        segment_size = math.ceil(len(frames) / num_sub_tasks)
+        return [task_spec.replace(start_frame=frames[i], end_frame=frames[min(i + segment_size, len(frames)) - 1])
+                for i in range(0, len(frames), segment_size)]
+
+    start_frame = task_spec.start_frame
+    end_frame = task_spec.end_frame
 
     frame_range = end_frame - start_frame
     segment_size = math.ceil(frame_range / num_sub_tasks)
@@ -192,34 +775,142 @@ def split_task(task_spec, num_sub_tasks):
     print(new_frame_ranges)
     assert new_frame_ranges[-1][1] == end_frame
 
-    new_tasks = []
-    for frame_range in new_frame_ranges:
-        new_task = copy.copy(task_spec)
-        new_task['start_frame'] = frame_range[0]
-        new_task['end_frame'] = frame_range[1]
-        new_tasks.append(new_task)
+    return [task_spec.replace(start_frame=frame_range[0], end_frame=frame_range[1])
+            for frame_range in new_frame_ranges]
+
 
-    return new_tasks
+def should_split_into_tiles(task_spec, num_sub_tasks):
+    """ Splitting the frames only keeps as many processors busy as there are frames, beyond that we split each frame."""
+    if not task_spec.has_frame_range() or task_spec.border is not None or task_spec.tile_grid is not None:
+        return False
+    return len(task_spec.get_frames()) < num_sub_tasks
+
+
+def get_tile_grid(num_tiles):
+    """ Returns the (columns, rows) of the squarest grid with at most num_tiles tiles."""
+    rows = max(1, int(math.sqrt(num_tiles)))
+    return (num_tiles // rows, rows)
+
+
+def get_tile_borders(tile_grid):
+    """ Returns the (min_x, min_y, max_x, max_y) border of each tile in the grid, row by row from the bottom left."""
+    (columns, rows) = tile_grid
+    return [(column / columns, row / rows, (column + 1) / columns, (row + 1) / rows)
+            for row in range(rows) for column in range(columns)]
+
+
+def get_tile_output_directory(output_directory, index):
+    """ Maps .../image_sequences/latest to .../image_sequences/tiles/latest_<index>."""
+    image_sequences_directory = posixpath.dirname(output_directory)
+    return posixpath.join(image_sequences_directory, 'tiles', '%s_%d' % (posixpath.basename(output_directory), index))
+
+
+def get_backup_output_directory(output_directory, start_frame):
+    """ Maps .../image_sequences/latest to .../image_sequences/backups/latest_<start_frame>."""
+    image_sequences_directory = posixpath.dirname(output_directory)
+    return posixpath.join(image_sequences_directory, 'backups',
+                          '%s_%d' % (posixpath.basename(output_directory), start_frame))
+
+
+def split_task_into_tiles(task_spec, num_sub_tasks):
+    """ Splits every frame of the task into at most num_sub_tasks tiles that are rendered separately.
+
+    :return: a (tile tasks, stitch task) tuple. The stitch task puts the tiles back together in the output directory of
+        the task once all of the tile tasks are done.
+    """
+    tile_grid = get_tile_grid(num_sub_tasks)
+    tile_tasks = [task_spec.replace(
+        output_directory=get_tile_output_directory(task_spec.output_directory, index),
+        border=border,
+        # The post-render stages run on the stitched frames.
+        post_render_stages=(),
+        append_to_output=None,
+    ) for (index, border) in enumerate(get_tile_borders(tile_grid))]
+    return (tile_tasks, task_spec.replace(tile_grid=tile_grid))
+
+
+def get_coarse_to_fine_offsets(stride):
+    """ Orders the offsets 0..stride - 1 so that each one lands as far as possible from the ones before it.
+
+    e.g. for a stride of 8 this returns [0, 4, 2, 6, 1, 3, 5, 7].
+    """
+    offsets = [0]
+    intervals = collections.deque([(0, stride)])
+    while intervals:
+        (low, high) = intervals.popleft()
+        middle = (low + high) // 2
+        if middle == low:
+            continue
+        offsets.append(middle)
+        intervals.append((low, middle))
+        intervals.append((middle, high))
+    return offsets
+
+
+def get_preview_output_directory(output_directory):
+    """ Maps .../renders/<name>/image_sequences/latest to .../renders/<name>/preview_image_sequences/latest."""
+    image_sequences_directory = posixpath.dirname(output_directory)
+    render_directory = posixpath.dirname(image_sequences_directory)
+    return posixpath.join(render_directory, 'preview_image_sequences', posixpath.basename(output_directory))
+
+
+def get_progressive_passes(task, stride, preview_resolution_percentage=None):
+    """ Splits a blend file task into passes that give artists something to look at as early as possible.
+
+    If preview_resolution_percentage is set the first pass renders every stride-th frame at that resolution into a
+    separate preview directory. The full quality frames are then rendered into the usual output directory, every
+    stride-th frame first and then filling in the gaps in coarse to fine order, so the final result is identical to a
+    regular render. The full quality passes share the output directory so the RenderManager runs their post-render
+    stages and writes DONE.json once, after the last of them.
+
+    :return: the list of passes in the order they should be rendered.
+    """
+    if not task.has_frame_range() or stride <= 1:
+        return [task]
+
+    passes = []
+    if preview_resolution_percentage:
+        passes.append(task.replace(
+            output_directory=get_preview_output_directory(task.output_directory),
+            resolution_percentage=preview_resolution_percentage,
+            frame_step=stride,
+            post_render_stages=(),
+        ))
+
+    for index, offset in enumerate(get_coarse_to_fine_offsets(stride)):
+        if task.start_frame + offset > task.end_frame:
+            continue
+        passes.append(task.replace(
+            start_frame=task.start_frame + offset,
+            frame_step=stride,
+            # Only the first full quality pass gets to archive the previous render.
+            append_to_output=True if index else task.append_to_output,
+        ))
+    return passes
+
+
+def get_render_profile(rg, target, task):
+    """ The profile requested by the task spec wins over the default declared in the target's RENDER.json."""
+    if task.render_profile is not None:
+        return task.render_profile
+    return rg.get_render_profile_for_target(target.name)
 
 
 # rg: RenderGraph
-def needs_rerender(project_root, rg, target_task):
-    target = target_task['target']
-    blend_file_mtime = os.path.getmtime(
-        get_absolute_blend_file(project_root, target, rg.get_blend_file_for_target(target)))
+def needs_rerender(rg, target, task):
+    blend_file_mtime = os.path.getmtime(target.get_absolute_blend_file(rg.get_blend_file_for_target(target.name)))
 
     relevant_mtimes = [blend_file_mtime]
-    for asset in rg.get_assets_for_target(target):
-        relevant_mtimes.append(os.path.getmtime(replace_relative_project_prefix(project_root, asset)))
+    for asset in rg.get_assets_for_target(target.name):
+        relevant_mtimes.append(os.path.getmtime(replace_relative_project_prefix(target.project_root, asset)))
 
-    latest_image_sequence_directory = get_latest_image_sequence_directory_for_target(project_root, target)
-    done_file = join(latest_image_sequence_directory, 'DONE.json')
+    done_file = join(target.latest_directory, 'DONE.json')
 
     # TODO(mattkeller): pull this out into a helper function
     if not os.path.exists(done_file):
         return True
     else:
-        dependency_invalidation_types = target_task['dependency_invalidation_types']
+        dependency_invalidation_types = task.dependency_invalidation_types
 
         with open(done_file, 'r') as f:
             completion_metadata_file = json.load(f)
@@ -230,14 +921,18 @@ def needs_rerender(project_root, rg, target_task):
         if 'task_spec' in completion_metadata_file and 'RESOLUTION_CHANGE' in dependency_invalidation_types:
             # possibly use computed dimensions here...
             # TODO(jbedard): should we only reprocess if target dimensions are higher?
-            if 'resolution_x' in completion_metadata_file and 'resolution_x' in target_task and \
-                            completion_metadata_file['resolution_x'] != target_task['resolution_x']:
-                return True
-            elif 'resolution_y' in completion_metadata_file and 'resolution_y' in target_task and \
-                            completion_metadata_file['resolution_y'] != target_task['resolution_y']:
-                return True
-            elif 'resolution_percentage' in completion_metadata_file and 'resolution_percentage' in target_task and \
-                            completion_metadata_file['resolution_percentage'] != target_task['resolution_percentage']:
+            for resolution_key in ['resolution_x', 'resolution_y', 'resolution_percentage']:
+                task_value = getattr(task, resolution_key)
+                if resolution_key in completion_metadata_file and task_value is not None and \
+                        completion_metadata_file[resolution_key] != task_value:
+                    return True
+
+        # Switching between profiles that only differ in speed settings (threads, tiles, persistent data) doesn't
+        # change the result so only the settings that affect the image are compared.
+        if 'RENDER_SETTINGS_CHANGE' in dependency_invalidation_types:
+            previous_quality_settings = get_quality_settings(completion_metadata_file.get('render_settings', {}))
+            quality_settings = get_quality_settings(get_render_settings(get_render_profile(rg, target, task)))
+            if previous_quality_settings != quality_settings:
                 return True
 
         if latest_render < max(relevant_mtimes) and 'FILE_MODIFICATION_TIME' in dependency_invalidation_types:
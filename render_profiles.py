@@ -0,0 +1,79 @@
+""" Named sets of render settings that are applied to a blend file through the generated settings script.
+
+Most of these settings only change how fast Blender renders (e.g. keeping data around between frames) but some of
+them change the rendered pixels. We keep track of which is which so that switching to a faster profile doesn't cause
+everything to be rerendered.
+"""
+
+# Maps each supported setting to the datablock path it's set on and whether it affects the rendered image.
+RENDER_SETTINGS = {
+    'use_persistent_data': ('bpy.context.scene.render', False),
+    'threads_mode': ('bpy.context.scene.render', False),
+    'threads': ('bpy.context.scene.render', False),
+    'tile_x': ('bpy.context.scene.render', False),
+    'tile_y': ('bpy.context.scene.render', False),
+    'use_progressive_refine': ('bpy.context.scene.render', False),
+    'samples': ('bpy.context.scene.cycles', True),
+    'use_square_samples': ('bpy.context.scene.cycles', True),
+    'max_bounces': ('bpy.context.scene.cycles', True),
+}
+
+RENDER_PROFILES = {
+    # Whatever is saved in the blend file.
+    'default': {},
+    # Keeps the scene in memory between frames which is a big win for animations with heavy static geometry.
+    'animation': {
+        'use_persistent_data': True,
+        'threads_mode': 'AUTO',
+    },
+    'cpu': {
+        'use_persistent_data': True,
+        'threads_mode': 'AUTO',
+        'tile_x': 32,
+        'tile_y': 32,
+    },
+    'gpu': {
+        'use_persistent_data': True,
+        'tile_x': 256,
+        'tile_y': 256,
+    },
+    # Trades quality for speed, e.g. for blocking out timing.
+    'draft': {
+        'use_persistent_data': True,
+        'threads_mode': 'AUTO',
+        'samples': 16,
+        'max_bounces': 4,
+    },
+}
+
+DEFAULT_RENDER_PROFILE = 'default'
+
+
+def get_render_settings(profile_name):
+    if profile_name is None:
+        profile_name = DEFAULT_RENDER_PROFILE
+    if profile_name not in RENDER_PROFILES:
+        raise ValueError('Unknown render profile: %s' % profile_name)
+    return dict(RENDER_PROFILES[profile_name])
+
+
+def get_quality_settings(render_settings):
+    """ Returns just the settings that affect the rendered image."""
+    return {name: value for name, value in render_settings.items()
+            if name in RENDER_SETTINGS and RENDER_SETTINGS[name][1]}
+
+
+def get_settings_script(render_settings):
+    """ Returns the lines of python that apply render_settings when run inside Blender.
+
+    Not every setting exists in every version of Blender (or for every render engine) so the script carries on if
+    one of them can't be set.
+    """
+    lines = []
+    for name in sorted(render_settings):
+        (datablock, _) = RENDER_SETTINGS[name]
+        lines.append('try:\n')
+        lines.append('    %s.%s = %r\n' % (datablock, name, render_settings[name]))
+        lines.append('except AttributeError:\n')
+        lines.append('    print(%r)\n' % ('Unable to apply render setting %s' % name))
+    return lines
@@ -0,0 +1,236 @@
+""" Lightweight, immutable representations of targets and blend file tasks.
+
+Planning used to pass raw task spec dicts around, copying them and re-parsing target strings on every call. These
+classes parse everything once and are cheap to hash so they can be deduplicated with sets and dicts.
+"""
+from os.path import abspath, join
+
+from path_utils import replace_absolute_project_prefix
+
+
+class _Immutable:
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def _init_slot(self, name, value):
+        object.__setattr__(self, name, value)
+
+
+class Target(_Immutable):
+    """ A fully qualified target (e.g. "//some/path:target_name") along with all of the directories derived from it."""
+
+    __slots__ = (
+        'project_root',
+        'name',
+        'target_name',
+        'relative_directory',
+        'directory',
+        'render_file',
+        'render_directory',
+        'image_sequence_directory',
+        'latest_directory',
+        'relative_latest_directory',
+        'blend_files_directory',
+    )
+
+    def __init__(self, project_root, name):
+        try:
+            [target_prefix, target_name] = name.split(':')
+        except ValueError:
+            raise ValueError('Invalid target name: %s. Too many colons?' % name)
+        if not target_prefix.startswith('//'):
+            raise ValueError('Invalid target name: %s. Targets must start with "//".' % name)
+
+        # We use abspath here to make sure that the slashes are all going the right way.
+        directory = abspath(join(project_root, target_prefix.replace('//', '')))
+        render_directory = join(directory, 'renders', target_name)
+        image_sequence_directory = join(render_directory, 'image_sequences')
+        latest_directory = join(image_sequence_directory, 'latest')
+
+        self._init_slot('project_root', project_root)
+        self._init_slot('name', name)
+        self._init_slot('target_name', target_name)
+        self._init_slot('relative_directory', target_prefix)
+        self._init_slot('directory', directory)
+        self._init_slot('render_file', join(directory, 'RENDER.json'))
+        self._init_slot('render_directory', render_directory)
+        self._init_slot('image_sequence_directory', image_sequence_directory)
+        self._init_slot('latest_directory', latest_directory)
+        self._init_slot('relative_latest_directory', replace_absolute_project_prefix(project_root, latest_directory))
+        self._init_slot('blend_files_directory', join(directory, 'blend_files'))
+
+    def get_absolute_blend_file(self, relative_blend_file):
+        return join(self.directory, relative_blend_file)
+
+    def __eq__(self, other):
+        if not isinstance(other, Target):
+            return NotImplemented
+        return self.project_root == other.project_root and self.name == other.name
+
+    def __hash__(self):
+        return hash((self.project_root, self.name))
+
+    def __repr__(self):
+        return 'Target(%r)' % self.name
+
+
+class PostRenderStage(_Immutable):
+    """ A step that is run over the frames of a render as they land, e.g. generating proxies or a preview movie.
+
+    per_frame is a command template run once for every finished frame and finalize is a command template run once
+    after the render and all of the per frame commands are done. Either may be None. See post_render for the
+    placeholders that can be used in the templates.
+    """
+
+    __slots__ = (
+        'name',
+        'per_frame',
+        'finalize',
+        'output',
+    )
+
+    def __init__(self, name, per_frame=None, finalize=None, output=None):
+        self._init_slot('name', name)
+        self._init_slot('per_frame', tuple(per_frame) if per_frame is not None else None)
+        self._init_slot('finalize', tuple(finalize) if finalize is not None else None)
+        self._init_slot('output', output)
+
+    @classmethod
+    def from_dict(cls, stage_spec):
+        return cls(**stage_spec)
+
+    def to_dict(self):
+        stage_spec = {'name': self.name}
+        for field in ['per_frame', 'finalize']:
+            if getattr(self, field) is not None:
+                stage_spec[field] = list(getattr(self, field))
+        if self.output is not None:
+            stage_spec['output'] = self.output
+        return stage_spec
+
+    def _values(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, PostRenderStage):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return 'PostRenderStage(%r)' % self.name
+
+
+class BlendFileTask(_Immutable):
+    """ Everything a processor needs to know to render (part of) a single blend file.
+
+    Fields that aren't set are None and are left out of the dict representation so that the task JSON format is the
+    same as it's always been.
+    """
+
+    __slots__ = (
+        'blend_file',
+        'output_directory',
+        'start_frame',
+        'end_frame',
+        'frame_step',
+        'resolution_x',
+        'resolution_y',
+        'resolution_percentage',
+        'render_profile',
+        'peak_memory_mb',
+        'dependency_invalidation_types',
+        'post_render_stages',
+        'append_to_output',
+        'border',
+        'tile_grid',
+        'input_files',
+    )
+
+    def __init__(self, blend_file=None, output_directory=None, start_frame=None, end_frame=None, frame_step=None,
+                 resolution_x=None, resolution_y=None, resolution_percentage=None, render_profile=None,
+                 peak_memory_mb=None, dependency_invalidation_types=(), post_render_stages=(), append_to_output=None,
+                 border=None, tile_grid=None, input_files=()):
+        self._init_slot('blend_file', blend_file)
+        self._init_slot('output_directory', output_directory)
+        self._init_slot('start_frame', start_frame)
+        self._init_slot('end_frame', end_frame)
+        self._init_slot('frame_step', frame_step)
+        self._init_slot('resolution_x', resolution_x)
+        self._init_slot('resolution_y', resolution_y)
+        self._init_slot('resolution_percentage', resolution_percentage)
+        self._init_slot('render_profile', render_profile)
+        self._init_slot('peak_memory_mb', peak_memory_mb)
+        self._init_slot('dependency_invalidation_types', tuple(dependency_invalidation_types or ()))
+        self._init_slot('post_render_stages', tuple(
+            stage if isinstance(stage, PostRenderStage) else PostRenderStage.from_dict(stage)
+            for stage in post_render_stages or ()))
+
+        # When set, the task adds frames to whatever is already in the output directory (e.g. a later pass of a
+        # progressive render) instead of archiving it first.
+        self._init_slot('append_to_output', append_to_output)
+
+        # (min_x, min_y, max_x, max_y) as fractions of the frame when only that region of it should be rendered,
+        # e.g. one tile of a frame that was split between processors.
+        self._init_slot('border', tuple(border) if border is not None else None)
+
+        # (columns, rows) when this task stitches the tiles of a tiled render back together instead of rendering.
+        self._init_slot('tile_grid', tuple(tile_grid) if tile_grid is not None else None)
+
+        # The assets and dependency output directories the render reads (as project relative paths) so that they can
+        # be staged on the machine that renders it.
+        self._init_slot('input_files', tuple(input_files or ()))
+
+    @classmethod
+    def from_dict(cls, task_spec):
+        unknown_keys = set(task_spec) - set(cls.__slots__)
+        if unknown_keys:
+            raise ValueError('Unknown blend file task spec keys: %s' % ', '.join(sorted(unknown_keys)))
+        return cls(**task_spec)
+
+    def to_dict(self):
+        task_spec = {}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if isinstance(value, tuple):
+                task_spec[field] = [item.to_dict() if isinstance(item, _Immutable) else item for item in value]
+            elif value is not None:
+                task_spec[field] = value
+        return task_spec
+
+    def replace(self, **changes):
+        """ Returns a copy of this task with the given fields changed."""
+        values = {field: getattr(self, field) for field in self.__slots__}
+        values.update(changes)
+        return type(self)(**values)
+
+    def has_frame_range(self):
+        if self.start_frame is not None and self.end_frame is not None:
+            return True
+        if self.start_frame is not None or self.end_frame is not None:
+            raise AssertionError('Please specify either both start_frame and end_frame or neither.')
+        return False
+
+    def get_frames(self):
+        return range(self.start_frame, self.end_frame + 1, self.frame_step or 1)
+
+    def _values(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, BlendFileTask):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return 'BlendFileTask(%s)' % ', '.join('%s=%r' % item for item in sorted(self.to_dict().items()))
@@ -0,0 +1,93 @@
+""" Runs a render job (planning included) on a background thread so that whoever started it, e.g. Blender's UI,
+doesn't have to wait on it.
+"""
+import threading
+import traceback
+
+import render_manager
+
+PLANNING = 'PLANNING'
+PLANNED = 'PLANNED'
+RENDERING = 'RENDERING'
+FINISHED = 'FINISHED'
+CANCELLED = 'CANCELLED'
+FAILED = 'FAILED'
+
+FINAL_STATES = [FINISHED, CANCELLED, FAILED]
+
+
+class RenderWorker(threading.Thread):
+    """ Plans the job and runs its scheduler loop on its own thread.
+
+    The RenderManager is only ever touched from the worker thread. Other threads read the snapshot returned by
+    status() (and the planned tasks from get_planned_tasks()) and stop the job with cancel().
+
+    A worker created with wait_for_confirmation plans the job but doesn't render it until confirm() is called, e.g. so
+    that the user can look at what's going to be rendered first.
+    """
+
+    def __init__(self, project_root, task_spec, processors, poll_interval=0.1, wait_for_confirmation=False,
+                 **render_manager_options):
+        super().__init__(name='RenderWorker', daemon=True)
+        self.project_root = project_root
+        self.task_spec = task_spec
+        self.processors = processors
+        self.poll_interval = poll_interval
+        self.render_manager_options = render_manager_options
+
+        self.cancel_requested = threading.Event()
+        self.confirmed = threading.Event()
+        if not wait_for_confirmation:
+            self.confirmed.set()
+        self.status_lock = threading.Lock()
+        self._status = {'state': PLANNING, 'progress': 0.0}
+        self._planned_tasks = None
+
+    def _set_status(self, state, **fields):
+        with self.status_lock:
+            self._status = dict(fields, state=state)
+
+    def status(self):
+        with self.status_lock:
+            return dict(self._status)
+
+    def get_planned_tasks(self):
+        """ Returns the blend file tasks of the job in the order they're rendered, None until it's been planned."""
+        with self.status_lock:
+            return self._planned_tasks
+
+    def confirm(self):
+        self.confirmed.set()
+
+    def cancel(self):
+        self.cancel_requested.set()
+
+    def run(self):
+        try:
+            rm = render_manager.RenderManager(self.project_root, self.task_spec, self.processors,
+                                              **self.render_manager_options)
+            with self.status_lock:
+                self._planned_tasks = list(rm.task_ids)
+            self._set_status(PLANNED, **rm.status())
+            while not self.confirmed.is_set():
+                if self.cancel_requested.is_set():
+                    rm.cancel()
+                    self._set_status(CANCELLED, **rm.status())
+                    return
+                self.confirmed.wait(self.poll_interval)
+            while not rm.is_done():
+                if self.cancel_requested.is_set():
+                    rm.cancel()
+                    self._set_status(CANCELLED, **rm.status())
+                    return
+                rm.launch_next_tasks()
+                self._set_status(RENDERING, **rm.status())
+                # Waiting on the event rather than sleeping means a cancel doesn't have to wait out the interval.
+                self.cancel_requested.wait(self.poll_interval)
+            self._set_status(FINISHED, **rm.status())
+        except Exception as e:
+            traceback.print_exc()
+            # Whoever reads the snapshot expects the same fields whatever the state, so we keep the last progress.
+            last_status = self.status()
+            del last_status['state']
+            self._set_status(FAILED, **dict(last_status, error=str(e)))
@@ -0,0 +1,300 @@
+""" Discrete event simulation of the render farm for trying out scheduling policies without rendering anything.
+
+    python simulator.py path/to/project --policy 3 --policy 1,1,2 [--seconds-per-frame 60]
+
+replays the renders recorded in the project's DONE.json files (arriving the way they originally started) once per
+policy and compares the results. A policy is a comma separated list of processor speeds relative to the machine the
+history was recorded on, so "3" is three processors like the ones we have and "1,1,2" adds one twice as fast.
+
+The real RenderManager schedules the work. Only the processors and the clock are simulated: a virtual processor's
+status reports that it's done once the virtual clock has passed the time its render would have taken.
+"""
+import argparse
+import collections
+import json
+import os
+from os.path import join
+
+import job_registry
+import local_processor
+import render_manager
+from render_task import BlendFileTask
+
+# Blender has to load the scene before it can render the first frame of a chunk.
+DEFAULT_SCENE_LOAD_SECONDS = 20.0
+DEFAULT_SECONDS_PER_FRAME = 60.0
+STITCH_SECONDS_PER_FRAME = 1.0
+POLL_INTERVAL = 60.0
+
+# Unlike the render graph we want to look inside the renders directories.
+SKIPPED_DIRECTORY_NAMES = ['Render Tasks', '.git']
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+
+class DurationModel:
+    """ Predicts how long a task takes on a processor of speed 1 from the seconds per frame of its blend file.
+
+    :param seconds_per_frame: blend file -> seconds per frame, e.g. from get_recorded_seconds_per_frame.
+    """
+
+    def __init__(self, seconds_per_frame=None, default_seconds_per_frame=DEFAULT_SECONDS_PER_FRAME,
+                 scene_load_seconds=DEFAULT_SCENE_LOAD_SECONDS):
+        self.seconds_per_frame = seconds_per_frame or {}
+        self.default_seconds_per_frame = default_seconds_per_frame
+        self.scene_load_seconds = scene_load_seconds
+
+    def get_duration(self, task_spec):
+        num_frames = len(task_spec.get_frames()) if task_spec.has_frame_range() else 1
+        if task_spec.tile_grid is not None:
+            return num_frames * STITCH_SECONDS_PER_FRAME
+        seconds_per_frame = self.seconds_per_frame.get(task_spec.blend_file, self.default_seconds_per_frame)
+        if task_spec.border is not None:
+            (min_x, min_y, max_x, max_y) = task_spec.border
+            seconds_per_frame *= (max_x - min_x) * (max_y - min_y)
+        return self.scene_load_seconds + num_frames * seconds_per_frame
+
+
+class VirtualStatus:
+    def __init__(self, task_spec, clock, duration):
+        self.task_spec = task_spec
+        self.clock = clock
+        self.start_time = clock.now
+        self.finish_time = clock.now + duration
+        self.render_finish_time = None
+        self.returncode = None
+
+    def is_done(self):
+        if self.returncode is None and self.clock.now >= self.finish_time:
+            self.returncode = 0
+            self.render_finish_time = self.finish_time
+        return self.returncode is not None
+
+    def get_completed_frames(self):
+        if not self.task_spec.has_frame_range():
+            return []
+        # Frames are assumed to take equally long.
+        frames = list(self.task_spec.get_frames())
+        if self.is_done():
+            return frames
+        elapsed = self.clock.now - self.start_time
+        return frames[:int(len(frames) * elapsed / (self.finish_time - self.start_time))]
+
+    def finalize_task(self):
+        assert self.is_done()
+
+    def cancel(self):
+        if self.returncode is None:
+            self.returncode = 1
+            self.finish_time = self.clock.now
+            self.render_finish_time = self.clock.now
+
+    def commit_backup(self, original):
+        original.cancel()
+
+    def discard_backup(self):
+        self.cancel()
+
+
+class VirtualProcessor(local_processor.LocalProcessor):
+    """ A LocalProcessor (including its throughput bookkeeping) that pretends to render."""
+
+    def __init__(self, clock, duration_model, speed=1.0):
+        super().__init__(None)
+        self.clock = clock
+        self.duration_model = duration_model
+        self.speed = speed
+        self.statuses = []
+
+    def process(self, task_spec):
+        duration = self.duration_model.get_duration(task_spec) / self.speed
+        self.current_task = VirtualStatus(task_spec, self.clock, duration)
+        self.statuses.append(self.current_task)
+        return self.current_task
+
+    def finalize_render(self, task_spec, statuses, returncode, post_render_status=None, job=None, resumed=False):
+        # Nothing was rendered so there are no status files to write.
+        pass
+
+    def get_busy_time(self):
+        return sum(status.finish_time - status.start_time for status in self.statuses)
+
+
+def get_recorded_renders(project_root):
+    """ Returns the (start time, duration, task spec dict, job) of every render with a DONE.json in the project.
+
+    job is the job the render was part of (see RenderManager.job) or None for renders that predate recording it.
+    """
+    renders = []
+    for (directory, directory_names, file_names) in os.walk(project_root):
+        directory_names[:] = [name for name in directory_names if name not in SKIPPED_DIRECTORY_NAMES]
+        if 'DONE.json' not in file_names:
+            continue
+        try:
+            with open(join(directory, 'DONE.json'), 'r') as f:
+                done_dict = json.load(f)
+        except ValueError:
+            print('Unable to read %s' % join(directory, 'DONE.json'))
+            continue
+        if 'task_spec' not in done_dict or 'start_time' not in done_dict or 'completion_time' not in done_dict:
+            continue
+        renders.append((done_dict['start_time'], done_dict['completion_time'] - done_dict['start_time'],
+                        done_dict['task_spec'], done_dict.get('job')))
+    return sorted(renders, key=lambda render: render[0])
+
+
+def get_recorded_seconds_per_frame(renders, scene_load_seconds=DEFAULT_SCENE_LOAD_SECONDS):
+    """ Returns blend file -> the median seconds per frame of its recorded renders."""
+    samples = {}
+    for (_, duration, task_spec, _) in renders:
+        task = BlendFileTask.from_dict(task_spec)
+        if not task.has_frame_range() or task.border is not None or task.tile_grid is not None:
+            continue
+        seconds_per_frame = max(0.0, duration - scene_load_seconds) / len(task.get_frames())
+        samples.setdefault(task.blend_file, []).append(seconds_per_frame)
+    return {blend_file: sorted(values)[len(values) // 2] for (blend_file, values) in samples.items()}
+
+
+def get_workload(renders):
+    """ Turns recorded renders into (arrival time, task spec dict, recorded blend file task spec dicts) jobs, the
+    first one arriving at 0.
+
+    Every task of a job (its dependencies included) has a DONE.json of its own so renders that recorded their job are
+    grouped into that job, arriving when it was started. Older renders don't know which job they were part of and are
+    each replayed as a job of their own.
+    """
+    jobs = {}
+    for (index, (start_time, _, task_spec, job)) in enumerate(renders):
+        if job is None:
+            jobs[index] = (start_time, task_spec, [task_spec])
+        elif job['id'] not in jobs:
+            jobs[job['id']] = (job['start_time'], job['task_spec'], [task_spec])
+        else:
+            jobs[job['id']][2].append(task_spec)
+    if not jobs:
+        return []
+    first_start_time = min(job[0] for job in jobs.values())
+    return sorted([(start_time - first_start_time, task_spec, recorded_tasks)
+                   for (start_time, task_spec, recorded_tasks) in jobs.values()], key=lambda job: job[0])
+
+
+def get_replayed_task(task_spec):
+    """ The recorded task spec of a tiled render is its stitch task, the scheduler decides whether to tile again."""
+    return BlendFileTask.from_dict(task_spec).replace(tile_grid=None, append_to_output=None)
+
+
+def get_percentile(values, percentile):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def simulate(project_root, workload, processor_speeds, duration_model, share_tasks=True):
+    """ Runs the workload through RenderManagers on virtual processors.
+
+    :param workload: (arrival time in seconds, task spec dict, recorded blend file task spec dicts or None) tuples,
+        e.g. from get_workload.
+    :param processor_speeds: the relative speed of each processor.
+    :param share_tasks: whether the jobs share a job_registry.JobRegistry like they do in autorender.
+    :return: a dict with the makespan, the utilisation of the processors and the queue wait percentiles.
+    """
+    clock = VirtualClock()
+    processors = [VirtualProcessor(clock, duration_model, speed) for speed in processor_speeds]
+    registry = job_registry.JobRegistry() if share_tasks else None
+
+    pending_jobs = collections.deque(sorted(workload, key=lambda job: job[0]))
+    arrival_times = {}
+    render_managers = []
+    seen_statuses = set()
+    queue_waits = []
+
+    while pending_jobs or render_managers:
+        while pending_jobs and pending_jobs[0][0] <= clock.now:
+            (arrival_time, task_spec, recorded_tasks) = pending_jobs.popleft()
+            if recorded_tasks is not None:
+                # Planning a recorded job against the project as it is now would find everything up to date (or its
+                # target gone) so it's replayed as the tasks that were rendered for it.
+                tasks = [get_replayed_task(recorded_task) for recorded_task in recorded_tasks]
+            elif 'blend_file' in task_spec:
+                tasks = [BlendFileTask.from_dict(task_spec)]
+            else:
+                # Target jobs are planned against the project on disk as usual.
+                tasks = None
+            rm = render_manager.RenderManager(project_root, task_spec, processors, registry, tasks=tasks,
+                                              clock=lambda: clock.now, run_post_render_stages=False)
+            arrival_times[rm] = arrival_time
+            render_managers.append(rm)
+
+        for rm in render_managers:
+            rm.launch_next_tasks()
+            for status in rm.current_task_statuses:
+                if status not in seen_statuses:
+                    seen_statuses.add(status)
+                    queue_waits.append(clock.now - arrival_times[rm])
+        render_managers = [rm for rm in render_managers if not rm.is_done()]
+
+        # Jump straight to whatever happens next.
+        next_events = [status.finish_time for rm in render_managers for status in rm.current_task_statuses]
+        if next_events and any(processor.is_available() for processor in processors):
+            # The real scheduler keeps polling, which is when it notices stragglers worth backing up.
+            next_events.append(clock.now + POLL_INTERVAL)
+        if pending_jobs:
+            next_events.append(pending_jobs[0][0])
+        if not next_events:
+            if render_managers:
+                # Nothing is running and nothing new is coming so whatever is left can never be scheduled.
+                print('%d jobs are stuck.' % len(render_managers))
+            break
+        clock.now = max(clock.now, min(next_events))
+
+    makespan = clock.now - (min(arrival_times.values()) if arrival_times else 0.0)
+    capacity = makespan * len(processors)
+    return {
+        'makespan': makespan,
+        'utilisation': sum(processor.get_busy_time() for processor in processors) / capacity if capacity else 0.0,
+        'queue_wait_p50': get_percentile(queue_waits, 50),
+        'queue_wait_p90': get_percentile(queue_waits, 90),
+        'queue_wait_p99': get_percentile(queue_waits, 99),
+        'chunks': len(queue_waits),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare scheduling policies on the recorded render history.')
+    parser.add_argument('project_root', help='The project whose DONE.json files are replayed.')
+    parser.add_argument('--policy', action='append', required=True,
+                        help='Comma separated relative processor speeds, e.g. "1,1,2". Can be given several times.')
+    parser.add_argument('--seconds-per-frame', type=float, default=DEFAULT_SECONDS_PER_FRAME,
+                        help='Assumed render time of blend files without any usable history.')
+    parser.add_argument('--scene-load', type=float, default=DEFAULT_SCENE_LOAD_SECONDS,
+                        help='Seconds Blender spends loading the scene before every chunk.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    renders = get_recorded_renders(args.project_root)
+    workload = get_workload(renders)
+    duration_model = DurationModel(get_recorded_seconds_per_frame(renders, args.scene_load), args.seconds_per_frame,
+                                   args.scene_load)
+    print('Replaying %d renders' % len(workload))
+
+    results = {}
+    for policy in args.policy:
+        results[policy] = simulate(args.project_root, workload, [float(speed) for speed in policy.split(',')],
+                                   duration_model)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for (policy, result) in results.items():
+        print('%-16s makespan %8.1fh  utilisation %5.1f%%  queue wait p50 %7.0fs p90 %7.0fs p99 %7.0fs' % (
+            policy, result['makespan'] / 3600, result['utilisation'] * 100,
+            result['queue_wait_p50'] or 0, result['queue_wait_p90'] or 0, result['queue_wait_p99'] or 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+""" Stitches the tiles of a tiled render back into whole frames. Runs inside Blender:
+
+    blender -b --factory-startup --python-exit-code 1 -P stitch_tiles.py -- path/to/stitch.json
+
+stitch.json (written by the local processor) lists the output directory and the directory and border of every tile.
+Every tile is a full size frame that only has its own border (and a little around it) rendered.
+Multilayer EXRs can't be stitched without losing layers so for those the first tile renders whole frames.
+"""
+import json
+import os
+import shutil
+import sys
+from os.path import join
+
+import bpy
+import numpy
+
+FRAME_PREFIX = 'frame_'
+
+
+def get_pixel_bounds(border, width, height):
+    (min_x, min_y, max_x, max_y) = border
+    return (round(min_x * width), round(min_y * height), round(max_x * width), round(max_y * height))
+
+
+def load_pixels(path):
+    image = bpy.data.images.load(path)
+    pixels = numpy.empty(len(image.pixels), dtype=numpy.float32)
+    image.pixels.foreach_get(pixels)
+    # Blender stores the rows bottom up, the same way the border is measured.
+    return (image, pixels.reshape(image.size[1], image.size[0], image.channels))
+
+
+def is_multilayer(path):
+    image = bpy.data.images.load(path)
+    multilayer = image.type == 'MULTILAYER'
+    bpy.data.images.remove(image)
+    return multilayer
+
+
+def stitch_frame(frame_file, tiles, output_directory):
+    output_file = join(output_directory, frame_file)
+    if is_multilayer(join(tiles[0]['directory'], frame_file)):
+        # Saving the pixels would only keep the first layer so the first tile renders whole multilayer frames instead
+        # (see the local processor's settings script).
+        shutil.copyfile(join(tiles[0]['directory'], frame_file), output_file)
+        print("Saved: '%s'" % output_file)
+        return
+
+    # We start from the first tile and copy every other tile's region over it.
+    (frame_image, frame_pixels) = load_pixels(join(tiles[0]['directory'], frame_file))
+    (height, width) = frame_pixels.shape[:2]
+    for tile in tiles[1:]:
+        (tile_image, tile_pixels) = load_pixels(join(tile['directory'], frame_file))
+        (min_x, min_y, max_x, max_y) = get_pixel_bounds(tile['border'], width, height)
+        frame_pixels[min_y:max_y, min_x:max_x] = tile_pixels[min_y:max_y, min_x:max_x]
+        bpy.data.images.remove(tile_image)
+
+    frame_image.pixels.foreach_set(frame_pixels.ravel())
+    frame_image.filepath_raw = output_file
+    frame_image.save()
+    bpy.data.images.remove(frame_image)
+    # Same format as Blender's own output so that the local processor counts the frame as done.
+    print("Saved: '%s'" % output_file)
+
+
+def main():
+    with open(sys.argv[sys.argv.index('--') + 1], 'r') as f:
+        stitch_spec = json.load(f)
+    tiles = stitch_spec['tiles']
+    frame_files = sorted(file for file in os.listdir(tiles[0]['directory']) if file.startswith(FRAME_PREFIX))
+    for frame_file in frame_files:
+        stitch_frame(frame_file, tiles, stitch_spec['output_directory'])
+
+
+main()
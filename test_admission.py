@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+import admission
+import render_manager
+from render_task import BlendFileTask
+
+
+class FakeStatus:
+    def __init__(self, task_spec):
+        self.task_spec = task_spec
+        self.returncode = None
+        self.finalized = False
+
+    def is_done(self):
+        return self.returncode is not None
+
+    def finalize_task(self):
+        self.finalized = True
+
+    def cancel(self):
+        self.returncode = 1
+
+
+class FakeProcessor:
+    def __init__(self):
+        self.statuses = []
+
+    def process(self, task_spec):
+        self.statuses.append(FakeStatus(task_spec))
+        return self.statuses[-1]
+
+    def is_available(self):
+        return not self.statuses or self.statuses[-1].is_done()
+
+
+class TestMemoryAdmissionController(TestCase):
+    def test_memory_admission_limits_chunks(self):
+        task = {
+            'blend_file': '//heavy/blend_files/heavy.blend',
+            'output_directory': '//heavy/renders/heavy/image_sequences/latest',
+            'start_frame': 1,
+            'end_frame': 10,
+            'peak_memory_mb': 3000,
+        }
+        controller = admission.MemoryAdmissionController('/project', headroom_mb=500,
+                                                         available_memory=lambda: 4000)
+        processors = [FakeProcessor(), FakeProcessor()]
+
+        rm = render_manager.RenderManager('/project', task, processors, admission=controller)
+        rm.launch_next_tasks()
+
+        launched = [status.task_spec for processor in processors for status in processor.statuses]
+        assert len(launched) == 1
+        assert (launched[0].start_frame, launched[0].end_frame) == (1, 10)
+
+    def test_memory_admission_always_admits_when_idle(self):
+        controller = admission.MemoryAdmissionController('/project', available_memory=lambda: 1000)
+        assert controller.admit(BlendFileTask(blend_file='//huge.blend', peak_memory_mb=64000))
@@ -0,0 +1,93 @@
+import os
+import tempfile
+from os.path import exists, join
+from unittest import TestCase
+
+import asset_cache
+
+
+def write_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+
+class TestAssetCache(TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.project_root = join(self.temporary_directory.name, 'project')
+        self.cache_directory = join(self.temporary_directory.name, 'cache')
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_input_files_are_staged(self):
+        write_file(join(self.project_root, 'assets', 'wood.png'), 10)
+        write_file(join(self.project_root, 'dep', 'latest', 'frame_00001.png'), 10)
+        write_file(join(self.project_root, 'dep', 'latest', 'frame_00002.png'), 10)
+        cache = asset_cache.AssetCache(self.cache_directory)
+
+        (files, directories) = asset_cache.get_source_files(
+            self.project_root, ['//assets/wood.png', '//dep/latest', '//missing.png'])
+        staged_files = cache.stage(files)
+
+        assert staged_files == files
+        assert len(files) == 3
+        assert directories == [join(self.project_root, 'dep', 'latest')]
+        assert all(exists(cache.get_cached_path(file)) for file in files)
+        assert cache.get_size() == 30
+
+        settings_script = ''.join(cache.get_settings_script(staged_files, directories))
+        assert repr(os.path.normpath(join(self.project_root, 'dep', 'latest'))) in settings_script
+
+    def test_changed_files_are_copied_again(self):
+        source = join(self.project_root, 'assets', 'wood.png')
+        write_file(source, 10)
+        cache = asset_cache.AssetCache(self.cache_directory)
+        cache.stage([source])
+        cache.release([source])
+
+        write_file(source, 20)
+        # Picked up by a new cache too.
+        cache = asset_cache.AssetCache(self.cache_directory)
+        cache.stage([source])
+
+        assert os.path.getsize(cache.get_cached_path(source)) == 20
+
+    def test_least_recently_used_unpinned_files_are_evicted(self):
+        cache = asset_cache.AssetCache(self.cache_directory, max_size_mb=2)
+        sources = [join(self.project_root, 'assets', name) for name in ['a.png', 'b.png', 'c.png']]
+        for source in sources:
+            write_file(source, asset_cache.BYTES_PER_MB)
+
+        cache.stage(sources[:1])
+        cache.stage(sources[1:2])
+        cache.release(sources[1:2])
+        # a.png is still pinned so b.png has to go even though it was used more recently.
+        cache.stage(sources[2:])
+
+        assert sorted(cache.index) == [sources[0], sources[2]]
+        assert not exists(cache.get_cached_path(sources[1]))
+        assert cache.get_size() <= 2 * asset_cache.BYTES_PER_MB
+
+    def test_files_are_pinned_while_they_are_checked(self):
+        sources = [join(self.project_root, 'assets', name) for name in ['a.png', 'b.png']]
+        for source in sources:
+            write_file(source, asset_cache.BYTES_PER_MB)
+        cache = asset_cache.AssetCache(self.cache_directory, max_size_mb=1)
+        cache.stage(sources[:1])
+        cache.release(sources[:1])
+
+        class RacingCache(asset_cache.AssetCache):
+            def _fetch(self, source):
+                result = super()._fetch(source)
+                if source == sources[0]:
+                    # Another render stages its files right after we found a.png up to date.
+                    self.stage(sources[1:])
+                return result
+
+        cache = RacingCache(self.cache_directory, max_size_mb=1)
+        cache.stage(sources[:1])
+
+        assert exists(cache.get_cached_path(sources[0]))
+        assert sources[0] in cache.index
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+import blender_output
+
+BLENDER_2_7_OUTPUT = [
+    'Fra:3 Mem:10.00M (0.00M, Peak 12.50M) | Time:00:00.10 | Preparing Scene data\n',
+    'Fra:3 Mem:40.00M (0.00M, Peak 80.25M) | Time:00:01.10 | Path Tracing Tile 4/4\n',
+    'Saved: /renders/latest/frame_00003.png Time: 00:01.52 (Saving: 00:00.03)\n',
+    'Fra:4 Mem:41.00M (0.00M, Peak 60.00M) | Time:00:00.90 | Path Tracing Tile 4/4\n',
+    'Saved: /renders/latest/frame_00004.png Time: 01:00.50 (Saving: 00:00.03)\n',
+]
+
+BLENDER_2_8_OUTPUT = [
+    'Fra:7 Mem:10.00M (Peak 12.00M) | Time:00:00.10 | Mem:0.00M, Peak:0.00M | Scene, View Layer | Synchronizing\n',
+    'Fra:7 Mem:181.20M (Peak 183.27M) | Time:00:01.90 | Mem:98.00M, Peak:99.00M | Scene, View Layer | Sample 1/64\n',
+    "Saved: '/renders/latest/frame_00007.png'\n",
+    ' Time: 00:02.25 (Saving: 00:00.10)\n',
+]
+
+
+class TestBlenderOutputParser(TestCase):
+    def test_parse_2_7_output(self):
+        parser = blender_output.BlenderOutputParser()
+        for line in BLENDER_2_7_OUTPUT:
+            parser.feed(line)
+
+        assert parser.get_completed_frames() == [3, 4]
+        assert parser.to_dict()['frames'] == [[3, 1.52, 80.25], [4, 60.5, 60.0]]
+
+        summary = parser.get_summary()
+        assert summary['frames_rendered'] == 2
+        assert summary['peak_memory_mb'] == 80.25
+        assert summary['max_frame_time'] == 60.5
+
+    def test_parse_2_8_output(self):
+        parser = blender_output.BlenderOutputParser()
+        for line in BLENDER_2_8_OUTPUT:
+            parser.feed(line)
+
+        assert parser.to_dict()['frames'] == [[7, 2.25, 183.27]]
+        assert parser.get_summary()['peak_memory_mb'] == 183.27
+
+    def test_parse_duration(self):
+        assert blender_output.parse_duration('01:02:03.50') == 3723.5
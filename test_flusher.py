@@ -0,0 +1,41 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists, join
+from unittest import TestCase
+
+import flusher
+from test_postRender import wait_for, write_frame
+
+
+class TestFrameFlusher(TestCase):
+    def test_saved_frames_are_flushed_in_batches(self):
+        with tempfile.TemporaryDirectory() as scratch_directory, tempfile.TemporaryDirectory() as output_directory, \
+                ThreadPoolExecutor(max_workers=2) as pool:
+            frame_flusher = flusher.FrameFlusher(scratch_directory, output_directory, pool, batch_size=2)
+            for frame_number in range(1, 4):
+                write_frame(scratch_directory, frame_number)
+                frame_flusher.add(join(scratch_directory, 'frame_%05d.png' % frame_number))
+            # Adding the same frame twice doesn't flush it twice.
+            frame_flusher.add(join(scratch_directory, 'frame_00001.png'))
+            assert frame_flusher.get_backlog() == 3
+
+            wait_for(frame_flusher, render_finished=False)
+
+            assert frame_flusher.is_done()
+            assert frame_flusher.get_backlog() == 0
+            assert frame_flusher.flushed_frames == 3
+            assert sorted(os.listdir(output_directory)) == ['frame_00001.png', 'frame_00002.png', 'frame_00003.png']
+            assert not os.listdir(scratch_directory)
+
+    def test_unreported_frames_are_flushed_once_the_render_finishes(self):
+        with tempfile.TemporaryDirectory() as scratch_directory, tempfile.TemporaryDirectory() as output_directory, \
+                ThreadPoolExecutor() as pool:
+            frame_flusher = flusher.FrameFlusher(scratch_directory, output_directory, pool)
+            write_frame(scratch_directory, 7)
+
+            wait_for(frame_flusher, render_finished=False)
+            assert not exists(join(output_directory, 'frame_00007.png'))
+
+            wait_for(frame_flusher, render_finished=True)
+            assert exists(join(output_directory, 'frame_00007.png'))
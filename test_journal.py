@@ -0,0 +1,145 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import journal
+import render_manager
+from render_task import BlendFileTask
+
+
+class FakeStatus:
+    def __init__(self, task_spec):
+        self.task_spec = task_spec
+        self.returncode = None
+        self.finalized = False
+
+    def is_done(self):
+        return self.returncode is not None
+
+    def finalize_task(self):
+        self.finalized = True
+
+    def cancel(self):
+        self.returncode = 1
+
+
+class FakeProcessor:
+    def __init__(self):
+        self.statuses = []
+
+    def process(self, task_spec):
+        self.statuses.append(FakeStatus(task_spec))
+        return self.statuses[-1]
+
+    def is_available(self):
+        return not self.statuses or self.statuses[-1].is_done()
+
+
+class FinalizingProcessor(FakeProcessor):
+    def __init__(self, finalized_renders):
+        super().__init__()
+        self.finalized_renders = finalized_renders
+
+    def finalize_render(self, task_spec, statuses, returncode, post_render_status=None, job=None, resumed=False):
+        self.finalized_renders.append((task_spec, statuses, returncode, post_render_status))
+
+
+class TestSchedulerJournal(TestCase):
+    def test_journal_resumes_unfinished_chunks(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            task = {
+                'blend_file': '//shot/blend_files/shot.blend',
+                'output_directory': '//shot/renders/shot/image_sequences/latest',
+                'start_frame': 1,
+                'end_frame': 4,
+            }
+            processors = [FakeProcessor(), FakeProcessor()]
+            scheduler_journal = journal.SchedulerJournal.create(project_root)
+
+            rm = render_manager.RenderManager(project_root, task, processors, journal=scheduler_journal)
+            rm.launch_next_tasks()
+            processors[0].statuses[0].returncode = 0
+            rm.launch_next_tasks()
+
+            # The scheduler dies here, before the second chunk finishes.
+            scheduler_journal.sync()
+            [recovered_job] = journal.recover_jobs(project_root)
+
+            assert recovered_job.task_spec == task
+            assert recovered_job.job == rm.job
+            [unfinished_task] = recovered_job.get_unfinished_tasks()
+            assert (unfinished_task.start_frame, unfinished_task.end_frame) == (3, 4)
+            assert unfinished_task.append_to_output
+
+    def test_journal_finalizes_resumed_outputs_with_the_whole_task(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            task = {
+                'blend_file': '//shot/blend_files/shot.blend',
+                'output_directory': '//shot/renders/shot/image_sequences/latest',
+                'start_frame': 1,
+                'end_frame': 4,
+            }
+            scheduler_journal = journal.SchedulerJournal.create(project_root)
+            rm = render_manager.RenderManager(project_root, task, [FakeProcessor(), FakeProcessor()],
+                                              journal=scheduler_journal)
+            rm.launch_next_tasks()
+            # The scheduler dies with the first chunk done and the second one still running.
+            scheduler_journal.record('finished', chunk_id=0, returncode=0)
+            scheduler_journal.close()
+
+            [recovered_job] = journal.recover_jobs(project_root)
+            finalized_renders = []
+            resumed_journal = journal.SchedulerJournal.create(project_root)
+            rm = render_manager.RenderManager(project_root, recovered_job.task_spec,
+                                              [FinalizingProcessor(finalized_renders)], journal=resumed_journal,
+                                              tasks=recovered_job.get_unfinished_tasks(),
+                                              resumed_outputs=recovered_job.get_resumed_outputs())
+            os.remove(recovered_job.path)
+            rm.launch_next_tasks()
+            # The resumed job dies as well, after the last chunk finished but before the directory was finalized.
+            resumed_journal.record('finished', chunk_id=0, returncode=0)
+            resumed_journal.close()
+
+            [recovered_job] = journal.recover_jobs(project_root)
+            assert recovered_job.get_unfinished_tasks() == []
+            rm = render_manager.RenderManager(project_root, recovered_job.task_spec,
+                                              [FinalizingProcessor(finalized_renders)],
+                                              tasks=recovered_job.get_unfinished_tasks(),
+                                              resumed_outputs=recovered_job.get_resumed_outputs())
+            rm.launch_next_tasks()
+
+            [(finalized_task, _, returncode, _)] = finalized_renders
+            assert (finalized_task.start_frame, finalized_task.end_frame, returncode) == (1, 4, 0)
+            assert rm.is_done()
+
+    def test_journal_stitches_recovered_tiles(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            task = {
+                'blend_file': '//shot/blend_files/shot.blend',
+                'output_directory': '//shot/renders/shot/image_sequences/latest',
+                'start_frame': 1,
+                'end_frame': 1,
+            }
+            processors = [FakeProcessor() for _ in range(4)]
+            scheduler_journal = journal.SchedulerJournal.create(project_root)
+
+            rm = render_manager.RenderManager(project_root, task, processors, journal=scheduler_journal)
+            rm.launch_next_tasks()
+            for processor in processors[:3]:
+                processor.statuses[0].returncode = 0
+            rm.launch_next_tasks()
+
+            # The scheduler dies while the last tile is still rendering, the task is tiled again from scratch.
+            scheduler_journal.sync()
+            [recovered_job] = journal.recover_jobs(project_root)
+            assert recovered_job.get_unfinished_tasks() == [BlendFileTask.from_dict(task)]
+
+            # The scheduler dies after the last tile finished but before it got around to stitching them.
+            scheduler_journal.record('finished', chunk_id=3, returncode=0)
+            scheduler_journal.sync()
+            [recovered_job] = journal.recover_jobs(project_root)
+            [stitch_task] = recovered_job.get_unfinished_tasks()
+            assert stitch_task.tile_grid == (2, 2)
+            assert stitch_task.border is None
+            assert stitch_task.output_directory == task['output_directory']
+            scheduler_journal.close()
@@ -1,6 +1,25 @@
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+from os.path import join
+from subprocess import PIPE, Popen, STDOUT
 from unittest import TestCase
 
 import local_processor
+from render_task import BlendFileTask
+
+# Stands in for Blender running batch_render.py: the first task renders a frame, the second fails and the process
+# exits before the third is started.
+FAKE_BATCH_OUTPUT = '''
+print('Batch task 0 started')
+print('Fra:1 Mem:10.00M (0.00M, Peak 20.00M) | Time:00:01.00')
+print("Saved: '/renders/frame_00001.png'")
+print('Batch task 0 finished: 0')
+print('Batch task 1 started')
+print('Batch task 1 finished: 1')
+'''
 
 
 class TestLocalProcessor(TestCase):
@@ -11,3 +30,94 @@ class TestLocalProcessor(TestCase):
         task_spec = {'blend_file': '//episode_1/subsequences/target_root_1/blend_files/simple_target.blend',
                      'output_directory': '//episode_1/subsequences/target_root_1/renders/seq/image_sequences/latest'}
         lp.process(task_spec)
+
+    def test_appending_to_existing_frames_skips_scratch(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            lp = local_processor.LocalProcessor(project_root, scratch_directory=join(project_root, 'scratch'))
+            task_spec = BlendFileTask(blend_file='//shot/shot.blend', output_directory='//shot/latest',
+                                      append_to_output=True)
+            os.makedirs(join(project_root, 'shot', 'latest'))
+            assert lp._should_render_to_scratch(task_spec)
+
+            with open(join(project_root, 'shot', 'latest', 'frame_00001.png'), 'w'):
+                pass
+            assert not lp._should_render_to_scratch(task_spec)
+            assert lp._should_render_to_scratch(task_spec.replace(append_to_output=None))
+
+    def test_blender_starts_once_files_are_staged(self):
+        starting = Future()
+        status = local_processor.SubprocessStatus('/project', BlendFileTask(blend_file='//shot.blend'), None,
+                                                  starting=starting)
+        assert not status.is_done()
+        assert status.process is None
+
+        starting.set_result((Popen([sys.executable, '-c', 'pass'], stdout=PIPE, stderr=STDOUT,
+                                   universal_newlines=True), []))
+        while not status.is_done():
+            time.sleep(0.01)
+        assert status.returncode == 0
+
+    def test_cancel_while_staging(self):
+        starting = Future()
+        status = local_processor.SubprocessStatus('/project', BlendFileTask(blend_file='//shot.blend'), None,
+                                                  starting=starting)
+        status.cancel()
+
+        assert starting.cancelled()
+        assert status.is_done()
+        assert status.returncode
+
+
+class TestBlenderBatch(TestCase):
+    def test_output_is_split_between_tasks(self):
+        process = Popen([sys.executable, '-c', FAKE_BATCH_OUTPUT], stdout=PIPE, stderr=STDOUT,
+                        universal_newlines=True)
+        batch = local_processor.BlenderBatch(process, '/nonexistent/batch.json')
+        batch.statuses = [local_processor.BatchTaskStatus('/project', BlendFileTask(blend_file='//shot_%d.blend' % i),
+                                                          batch) for i in range(3)]
+
+        while not batch.is_done():
+            time.sleep(0.01)
+
+        assert [status.returncode for status in batch.statuses] == [0, 1, 1]
+        assert batch.statuses[0].get_completed_frames() == [1]
+        assert batch.statuses[0].get_peak_memory_mb() == 20.0
+        assert not batch.statuses[1].get_completed_frames()
+
+    def test_batched_frames_are_flushed_from_scratch(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            scratch_directory = join(project_root, 'scratch')
+            os.makedirs(scratch_directory)
+            frame = join(scratch_directory, 'frame_00001.png')
+            process = Popen([sys.executable, '-c', '\n'.join([
+                "open(%r, 'w').close()" % frame,
+                "print('Batch task 0 started')",
+                "print(\"Saved: '%s'\")" % frame,
+                "print('Batch task 0 finished: 0')",
+            ])], stdout=PIPE, stderr=STDOUT, universal_newlines=True)
+            batch = local_processor.BlenderBatch(process, join(project_root, 'batch.json'))
+            task_spec = BlendFileTask(blend_file='//shot.blend', output_directory='//shot/latest')
+            os.makedirs(join(project_root, 'shot', 'latest'))
+            batch.statuses = [local_processor.BatchTaskStatus(project_root, task_spec, batch, scratch_directory)]
+
+            while not batch.is_done():
+                time.sleep(0.01)
+
+            assert batch.statuses[0].returncode == 0
+            assert os.listdir(join(project_root, 'shot', 'latest')) == ['frame_00001.png']
+
+    def test_batch_starts_once_files_are_staged(self):
+        starting = Future()
+        batch = local_processor.BlenderBatch(None, None, starting=starting)
+        batch.statuses = [local_processor.BatchTaskStatus('/project', BlendFileTask(blend_file='//shot_%d.blend' % i),
+                                                          batch) for i in range(2)]
+        assert not batch.is_done()
+        assert batch.statuses[0].process is None
+
+        process = Popen([sys.executable, '-c', FAKE_BATCH_OUTPUT], stdout=PIPE, stderr=STDOUT,
+                        universal_newlines=True)
+        starting.set_result((process, None, [[], []]))
+        while not batch.is_done():
+            time.sleep(0.01)
+        assert [status.returncode for status in batch.statuses] == [0, 1]
+        assert batch.statuses[0].process is process
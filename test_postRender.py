@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists, join
+from unittest import TestCase
+
+import post_render
+from render_task import PostRenderStage
+
+COPY_FRAME = [sys.executable, '-c', 'import shutil, sys; shutil.copy(sys.argv[1], sys.argv[2])', '{frame}', '{output}']
+COUNT_FRAMES = [sys.executable, '-c', 'import sys; open(sys.argv[1], "w").write(str(len(sys.argv) - 2))',
+                '{output}', '{frames}']
+
+
+def write_frame(directory, frame_number):
+    with open(join(directory, 'frame_%05d.png' % frame_number), 'w') as f:
+        f.write('pixels')
+
+
+def wait_for(pipeline, render_finished):
+    for _ in range(100):
+        pipeline.poll(render_finished)
+        if pipeline.is_done():
+            return
+        time.sleep(0.05)
+
+
+class TestPostRenderPipeline(TestCase):
+    def test_frames_are_processed_as_they_land(self):
+        with tempfile.TemporaryDirectory() as output_directory, ThreadPoolExecutor() as pool:
+            stages = [PostRenderStage('copy', per_frame=COPY_FRAME),
+                      PostRenderStage('count', finalize=COUNT_FRAMES, output='count.txt')]
+            pipeline = post_render.PostRenderPipeline(output_directory, stages, pool)
+
+            write_frame(output_directory, 1)
+            pipeline.poll()
+            # The frame has to be the same size on two consecutive polls before it's picked up.
+            assert pipeline.submitted_frames == []
+            pipeline.poll()
+            assert pipeline.submitted_frames == ['frame_00001.png']
+
+            write_frame(output_directory, 2)
+            wait_for(pipeline, render_finished=True)
+
+            assert pipeline.is_done()
+            assert exists(join(output_directory, 'copy', 'frame_00001.png'))
+            assert exists(join(output_directory, 'copy', 'frame_00002.png'))
+            with open(join(output_directory, 'count', 'count.txt')) as f:
+                assert f.read() == '2'
+
+            status = pipeline.status()
+            assert status['copy'] == {'frames_done': 2, 'frames_failed': 0, 'complete': True}
+            assert status['count']['finalize_returncode'] == 0
+
+    def test_built_in_stages_can_be_overridden(self):
+        stage = post_render.resolve_stage(PostRenderStage('preview_movie', finalize=['encode', '{output}']))
+        assert stage.finalize == ('encode', '{output}')
+        assert stage.output == 'preview.mp4'
+
+    def test_deduplicate_stage(self):
+        with tempfile.TemporaryDirectory() as image_sequences, ThreadPoolExecutor() as pool:
+            output_directory = join(image_sequences, 'latest')
+            archived_directory = join(image_sequences, '2017-01-01_00-00-00')
+            os.makedirs(output_directory)
+            os.makedirs(archived_directory)
+            for directory in [output_directory, archived_directory]:
+                for frame_number in [1, 2, 3]:
+                    write_frame(directory, frame_number)
+            with open(join(output_directory, 'frame_00004.png'), 'w') as f:
+                f.write('moving')
+
+            pipeline = post_render.PostRenderPipeline(output_directory, [PostRenderStage('deduplicate')], pool)
+            wait_for(pipeline, render_finished=True)
+
+            with open(join(output_directory, 'deduplicate', 'report.json')) as f:
+                report = json.load(f)
+            assert report == {'bytes_saved': 5 * len('pixels'), 'files_linked': 5}
+
+            inodes = {os.stat(join(directory, 'frame_%05d.png' % frame_number)).st_ino
+                      for directory in [output_directory, archived_directory] for frame_number in [1, 2, 3]}
+            assert len(inodes) == 1
@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+import time
+from os.path import join
+from unittest import TestCase
+
+import impact
+import render_graph
+
+
+def make_target(project_root, directory, name, deps=(), **target_fields):
+    os.makedirs(join(project_root, directory, 'blend_files'))
+    open(join(project_root, directory, 'blend_files', name + '.blend'), 'w').close()
+    target_dict = {'name': name, 'src': 'blend_files/%s.blend' % name, 'deps': list(deps)}
+    target_dict.update(target_fields)
+    with open(join(project_root, directory, 'RENDER.json'), 'w') as f:
+        json.dump({'targets': [target_dict]}, f)
+    return '//%s:%s' % (directory, name)
+
+
+def write_done_file(project_root, directory, name, **done_fields):
+    latest_directory = join(project_root, directory, 'renders', name, 'image_sequences', 'latest')
+    os.makedirs(latest_directory)
+    done_dict = {'start_time': time.time() + 60, 'task_spec': {}}
+    done_dict.update(done_fields)
+    with open(join(latest_directory, 'DONE.json'), 'w') as f:
+        json.dump(done_dict, f)
+
+class TestRenderGraph(TestCase):
+    def test_reverse_index_updates_incrementally(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            base = make_target(project_root, 'base', 'base', assets=['//textures/brick.png'])
+            shot = make_target(project_root, 'shot', 'shot', [base])
+            sequence = make_target(project_root, 'sequence', 'sequence', [shot])
+
+            rg = render_graph.RenderGraph()
+            rg.add_project(project_root)
+
+            assert rg.get_direct_dependents('//textures/brick.png') == {base}
+            assert rg.get_transitive_dependents('//textures/brick.png') == [base, shot, sequence]
+            assert rg.get_transitive_dependents('//shot/blend_files/shot.blend') == [shot, sequence]
+
+            # The shot stops depending on base.
+            render_file = join(project_root, 'shot', 'RENDER.json')
+            with open(render_file, 'w') as f:
+                json.dump({'targets': [{'name': 'shot', 'src': 'blend_files/shot.blend'}]}, f)
+            rg.add_targets(project_root, render_file)
+
+            assert rg.get_transitive_dependents(base) == []
+            assert rg.get_transitive_dependents('//textures/brick.png') == [base]
+
+    def test_impacted_targets_are_estimated_from_their_last_render(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            base = make_target(project_root, 'base', 'base', assets=['//textures/brick.png'])
+            shot = make_target(project_root, 'shot', 'shot', [base])
+            other = make_target(project_root, 'other', 'other')
+            write_done_file(project_root, 'base', 'base', start_time=100, completion_time=400,
+                            render_telemetry={'summary': {'total_render_time': 120}})
+            write_done_file(project_root, 'shot', 'shot', start_time=100, completion_time=130)
+
+            # The telemetry's render time wins over the wall clock time of the render.
+            assert impact.get_impacted_targets(project_root, ['//textures/brick.png']) == [(base, 120), (shot, 30)]
+            assert impact.get_impacted_targets(project_root, [shot]) == [(shot, 30)]
+            assert impact.get_impacted_targets(project_root, [other]) == [(other, None)]
+            assert impact.get_impacted_targets(project_root, ['//textures/unused.png']) == []
+
+    def test_changes_are_normalized_to_project_paths(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            assert impact.normalize_change(project_root, '//shot:shot') == '//shot:shot'
+            assert impact.normalize_change(project_root, join(project_root, 'textures', 'brick.png')) == \
+                '//textures/brick.png'
@@ -1,56 +1,601 @@
+import json
+import os
+import tempfile
+import time
 import unittest
+from os.path import join
 from unittest import TestCase
 
+import job_registry
 import render_manager
+from render_task import BlendFileTask, PostRenderStage
+from test_postRender import COPY_FRAME, COUNT_FRAMES, write_frame
+
+
+def make_target(project_root, directory, name, deps=(), **target_fields):
+    os.makedirs(join(project_root, directory, 'blend_files'))
+    open(join(project_root, directory, 'blend_files', name + '.blend'), 'w').close()
+    target_dict = {'name': name, 'src': 'blend_files/%s.blend' % name, 'deps': list(deps)}
+    target_dict.update(target_fields)
+    with open(join(project_root, directory, 'RENDER.json'), 'w') as f:
+        json.dump({'targets': [target_dict]}, f)
+    return '//%s:%s' % (directory, name)
+
+
+def write_done_file(project_root, directory, name, **done_fields):
+    latest_directory = join(project_root, directory, 'renders', name, 'image_sequences', 'latest')
+    os.makedirs(latest_directory)
+    done_dict = {'start_time': time.time() + 60, 'task_spec': {}}
+    done_dict.update(done_fields)
+    with open(join(latest_directory, 'DONE.json'), 'w') as f:
+        json.dump(done_dict, f)
+
+
+class FakeStatus:
+    def __init__(self, task_spec):
+        self.task_spec = task_spec
+        self.returncode = None
+        self.finalized = False
+
+    def is_done(self):
+        return self.returncode is not None
+
+    def finalize_task(self):
+        self.finalized = True
+
+    def cancel(self):
+        self.returncode = 1
+
+
+class FakeProcessor:
+    def __init__(self):
+        self.statuses = []
+
+    def process(self, task_spec):
+        self.statuses.append(FakeStatus(task_spec))
+        return self.statuses[-1]
+
+    def is_available(self):
+        return not self.statuses or self.statuses[-1].is_done()
+
+
+class FinalizingProcessor(FakeProcessor):
+    def __init__(self, finalized_renders):
+        super().__init__()
+        self.finalized_renders = finalized_renders
+
+    def finalize_render(self, task_spec, statuses, returncode, post_render_status=None, job=None, resumed=False):
+        self.finalized_renders.append((task_spec, statuses, returncode, post_render_status))
+
+
+class SpeculativeStatus(FakeStatus):
+    def __init__(self, task_spec, clock):
+        super().__init__(task_spec)
+        self.start_time = clock()
+        self.completed_frames = []
+        self.committed_to = None
+        self.discarded = False
+
+    def get_completed_frames(self):
+        return self.completed_frames
+
+    def commit_backup(self, original):
+        original.cancel()
+        self.committed_to = original
+
+    def discard_backup(self):
+        self.cancel()
+        self.discarded = True
+
+
+class SpeculativeProcessor(FakeProcessor):
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.throughput = 1.0
+
+    def process(self, task_spec):
+        self.statuses.append(SpeculativeStatus(task_spec, self.clock))
+        return self.statuses[-1]
+
+
+class BatchingProcessor(FakeProcessor):
+    def __init__(self):
+        super().__init__()
+        self.throughput = 1.0
+        self.batches = []
+
+    def process_batch(self, task_specs):
+        self.batches.append([FakeStatus(task_spec) for task_spec in task_specs])
+        self.statuses.extend(self.batches[-1])
+        return self.batches[-1]
+
+    def is_available(self):
+        return all(status.is_done() for status in self.statuses)
 
 
 class TestRenderManager(TestCase):
     def test_split_tasks(self):
-        task = {
-            'start_frame': 1,
-            'end_frame': 3,
-        }
+        task = BlendFileTask(start_frame=1, end_frame=3)
 
         sub_tasks = render_manager.split_task(task, 3)
 
         assert len(sub_tasks) == 3
 
         first_sub_task = sub_tasks[0]
-        assert first_sub_task['start_frame'] == 1
-        assert first_sub_task['end_frame'] == 1
+        assert first_sub_task.start_frame == 1
+        assert first_sub_task.end_frame == 1
 
         second_sub_task = sub_tasks[1]
-        assert second_sub_task['start_frame'] == 2
-        assert second_sub_task['end_frame'] == 2
+        assert second_sub_task.start_frame == 2
+        assert second_sub_task.end_frame == 2
 
         third_sub_task = sub_tasks[2]
-        assert third_sub_task['start_frame'] == 3
-        assert third_sub_task['end_frame'] == 3
+        assert third_sub_task.start_frame == 3
+        assert third_sub_task.end_frame == 3
 
 
     def test_split_tasks_2(self):
-        task = {
-            'start_frame': 1,
-            'end_frame': 4,
-        }
+        task = BlendFileTask(start_frame=1, end_frame=4)
 
         sub_tasks = render_manager.split_task(task, 3)
 
         assert len(sub_tasks) == 3
 
         last_sub_task = sub_tasks[-1]
-        assert last_sub_task['end_frame'] == 4
+        assert last_sub_task.end_frame == 4
         
     def test_split_tasks_into_one(self):
-        task = {
-            'start_frame': 0,
-            'end_frame': 10,
-        }
+        task = BlendFileTask(start_frame=0, end_frame=10)
 
         sub_tasks = render_manager.split_task(task, 1)
 
         assert len(sub_tasks) == 1
 
         last_sub_task = sub_tasks[-1]
-        assert last_sub_task['start_frame'] == 0
-        assert last_sub_task['end_frame'] == 10
+        assert last_sub_task.start_frame == 0
+        assert last_sub_task.end_frame == 10
+
+    def test_shared_task_is_rendered_once(self):
+        task = {
+            'blend_file': '//shared/blend_files/shared.blend',
+            'output_directory': '//shared/renders/shared/image_sequences/latest',
+        }
+        registry = job_registry.JobRegistry()
+        processor = FakeProcessor()
+
+        first_job = render_manager.RenderManager('/project', dict(task), [processor], registry)
+        second_job = render_manager.RenderManager('/project', dict(task), [processor], registry)
+
+        first_job.launch_next_tasks()
+        second_job.launch_next_tasks()
+        assert len(processor.statuses) == 1
+        assert not second_job.is_done()
+
+        processor.statuses[0].returncode = 0
+        first_job.launch_next_tasks()
+
+        assert first_job.is_done()
+        assert second_job.is_done()
+        assert len(processor.statuses) == 1
+
+    def test_jobs_take_turns_rendering_into_an_output_directory(self):
+        task = {
+            'blend_file': '//s/blend_files/s.blend',
+            'output_directory': '//s/renders/s/image_sequences/latest',
+        }
+        registry = job_registry.JobRegistry()
+        (first_processor, second_processor) = (FakeProcessor(), FakeProcessor())
+
+        first_job = render_manager.RenderManager('/project', dict(task, resolution_x=1920), [first_processor],
+                                                 registry)
+        second_job = render_manager.RenderManager('/project', dict(task, resolution_x=1280), [second_processor],
+                                                  registry)
+
+        first_job.launch_next_tasks()
+        second_job.launch_next_tasks()
+        assert len(first_processor.statuses) == 1
+        assert not second_processor.statuses
+
+        first_processor.statuses[0].returncode = 0
+        first_job.launch_next_tasks()
+        second_job.launch_next_tasks()
+        assert first_job.is_done()
+        assert second_processor.statuses[0].task_spec.resolution_x == 1280
+
+    def test_cancelled_owner_hands_task_over(self):
+        task = {
+            'blend_file': '//shared/blend_files/shared.blend',
+            'output_directory': '//shared/renders/shared/image_sequences/latest',
+        }
+        registry = job_registry.JobRegistry()
+        processor = FakeProcessor()
+
+        first_job = render_manager.RenderManager('/project', dict(task), [processor], registry)
+        second_job = render_manager.RenderManager('/project', dict(task), [processor], registry)
+        first_job.cancel()
+
+        second_job.launch_next_tasks()
+        assert len(processor.statuses) == 1
+        assert processor.statuses[0].task_spec.blend_file == task['blend_file']
+
+    def test_plan_diamond_dependencies_once(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            base = make_target(project_root, 'base', 'base')
+            left = make_target(project_root, 'left', 'left', [base])
+            right = make_target(project_root, 'right', 'right', [base])
+            top = make_target(project_root, 'top', 'top', [left, right])
+
+            tasks = render_manager.get_blend_file_task_linearized_dag_from_target_task(project_root, {
+                'target': top,
+                'start_frame': 1,
+                'end_frame': 10,
+                'dependency_invalidation_types': ['FILE_MODIFICATION_TIME'],
+            })
+
+            assert [task.blend_file for task in tasks] == [
+                '//base/blend_files/base.blend',
+                '//left/blend_files/left.blend',
+                '//right/blend_files/right.blend',
+                '//top/blend_files/top.blend',
+            ]
+            assert tasks[0].start_frame is None
+            assert tasks[-1].start_frame == 1
+            assert tasks[-1].end_frame == 10
+            assert tasks[-1].output_directory == '//top/renders/top/image_sequences/latest'
+
+    def test_split_strided_task(self):
+        task = BlendFileTask(start_frame=1, end_frame=20, frame_step=4)
+
+        sub_tasks = render_manager.split_task(task, 2)
+
+        assert [list(sub_task.get_frames()) for sub_task in sub_tasks] == [[1, 5, 9], [13, 17]]
+
+    def test_faster_processors_get_bigger_chunks(self):
+        slow_processor = FakeProcessor()
+        fast_processor = FakeProcessor()
+        fast_processor.throughput = 3.0
+        slow_processor.throughput = 1.0
+        task_spec = {'blend_file': '//shot/blend_files/shot.blend', 'start_frame': 1, 'end_frame': 20}
+        rm = render_manager.RenderManager('/project', task_spec, [slow_processor, fast_processor])
+
+        rm.launch_next_tasks()
+
+        fast_chunk = fast_processor.statuses[0].task_spec
+        slow_chunk = slow_processor.statuses[0].task_spec
+        assert (fast_chunk.start_frame, fast_chunk.end_frame) == (1, 15)
+        assert (slow_chunk.start_frame, slow_chunk.end_frame) == (16, 20)
+
+    def test_short_task_is_split_into_tiles_and_stitched(self):
+        processors = [FakeProcessor() for _ in range(4)]
+        task_spec = {'blend_file': '//shot/blend_files/shot.blend',
+                     'output_directory': '//shot/renders/shot/image_sequences/latest',
+                     'start_frame': 1, 'end_frame': 1}
+        rm = render_manager.RenderManager('/project', task_spec, processors)
+
+        rm.launch_next_tasks()
+
+        tiles = [processor.statuses[0].task_spec for processor in processors]
+        assert [tile.border for tile in tiles] == [
+            (0, 0, 0.5, 0.5), (0.5, 0, 1, 0.5), (0, 0.5, 0.5, 1), (0.5, 0.5, 1, 1)]
+        assert tiles[0].output_directory == '//shot/renders/shot/image_sequences/tiles/latest_0'
+        assert all(tile.start_frame == 1 and tile.end_frame == 1 for tile in tiles)
+
+        for processor in processors:
+            processor.statuses[0].returncode = 0
+        rm.launch_next_tasks()
+
+        stitch_tasks = [status.task_spec for processor in processors for status in processor.statuses[1:]]
+        assert len(stitch_tasks) == 1
+        assert stitch_tasks[0].tile_grid == (2, 2)
+        assert stitch_tasks[0].border is None
+        assert stitch_tasks[0].output_directory == task_spec['output_directory']
+        assert not rm.is_done()
+
+        for processor in processors:
+            processor.statuses[-1].returncode = 0
+        rm.launch_next_tasks()
+        assert rm.is_done()
+
+    def test_straggler_is_backed_up(self):
+        now = [0]
+        clock = lambda: now[0]
+        slow_processor = SpeculativeProcessor(clock)
+        fast_processor = SpeculativeProcessor(clock)
+        task_spec = {'blend_file': '//shot/blend_files/shot.blend',
+                     'output_directory': '//shot/renders/shot/image_sequences/latest',
+                     'start_frame': 1, 'end_frame': 10}
+        rm = render_manager.RenderManager('/project', task_spec, [slow_processor, fast_processor], clock=clock)
+        rm.launch_next_tasks()
+        straggler = slow_processor.statuses[0]
+
+        # Both chunks are predicted to take 5 seconds.
+        now[0] = 5
+        fast_processor.statuses[0].returncode = 0
+        rm.launch_next_tasks()
+        assert len(fast_processor.statuses) == 1
+
+        now[0] = 12
+        straggler.completed_frames = [1, 2]
+        rm.launch_next_tasks()
+        backup = fast_processor.statuses[1]
+        assert (backup.task_spec.start_frame, backup.task_spec.end_frame) == (3, 5)
+        assert backup.task_spec.output_directory == '//shot/renders/shot/image_sequences/backups/latest_3'
+
+        backup.returncode = 0
+        rm.launch_next_tasks()
+        assert backup.committed_to is straggler
+        assert straggler.returncode == 1
+        assert not straggler.finalized
+        assert rm.is_done()
+
+    def test_stragglers_are_predicted_from_their_sibling_chunks(self):
+        now = [0]
+        clock = lambda: now[0]
+        processors = [SpeculativeProcessor(clock), SpeculativeProcessor(clock)]
+        # Measured on some other, much lighter, scene.
+        for processor in processors:
+            processor.throughput = 100.0
+        task_spec = {'blend_file': '//shot/blend_files/shot.blend',
+                     'output_directory': '//shot/renders/shot/image_sequences/latest',
+                     'start_frame': 1, 'end_frame': 10}
+        rm = render_manager.RenderManager('/project', task_spec, processors, clock=clock)
+        rm.launch_next_tasks()
+
+        now[0] = 5
+        processors[1].statuses[0].returncode = 0
+        rm.launch_next_tasks()
+        now[0] = 8
+        rm.launch_next_tasks()
+
+        assert len(processors[1].statuses) == 1
+
+    def test_no_backups_while_other_jobs_have_queued_tasks(self):
+        now = [0]
+        clock = lambda: now[0]
+        processors = [SpeculativeProcessor(clock), SpeculativeProcessor(clock)]
+        registry = job_registry.JobRegistry()
+        task_spec = {'blend_file': '//shot/blend_files/shot.blend',
+                     'output_directory': '//shot/renders/shot/image_sequences/latest',
+                     'start_frame': 1, 'end_frame': 10}
+        other_task_spec = {'blend_file': '//other/blend_files/other.blend',
+                           'output_directory': '//other/renders/other/image_sequences/latest',
+                           'start_frame': 1, 'end_frame': 10}
+        rm = render_manager.RenderManager('/project', task_spec, processors, registry, clock=clock)
+        rm.launch_next_tasks()
+        other_rm = render_manager.RenderManager('/project', other_task_spec, processors, registry, clock=clock)
+
+        now[0] = 5
+        processors[1].statuses[0].returncode = 0
+        rm.launch_next_tasks()
+        now[0] = 20
+        rm.launch_next_tasks()
+        assert len(processors[1].statuses) == 1
+
+        other_rm.launch_next_tasks()
+        assert processors[1].statuses[1].task_spec.blend_file == other_task_spec['blend_file']
+
+    def test_original_beats_its_backup(self):
+        now = [0]
+        clock = lambda: now[0]
+        processors = [SpeculativeProcessor(clock), SpeculativeProcessor(clock)]
+        task_spec = {'blend_file': '//shot/blend_files/shot.blend',
+                     'output_directory': '//shot/renders/shot/image_sequences/latest',
+                     'start_frame': 1, 'end_frame': 10}
+        rm = render_manager.RenderManager('/project', task_spec, processors, clock=clock)
+        rm.launch_next_tasks()
+        now[0] = 5
+        processors[1].statuses[0].returncode = 0
+        rm.launch_next_tasks()
+        now[0] = 20
+        rm.launch_next_tasks()
+        straggler = processors[0].statuses[0]
+        backup = processors[1].statuses[1]
+
+        straggler.returncode = 0
+        rm.launch_next_tasks()
+        assert backup.discarded
+        assert straggler.finalized
+        assert rm.is_done()
+
+    def test_weighted_split_drops_empty_chunks(self):
+        task = BlendFileTask(start_frame=1, end_frame=3)
+
+        sub_tasks = render_manager.split_task(task, 3, weights=[10.0, 1.0, 1.0])
+
+        assert [(sub_task.start_frame, sub_task.end_frame) for sub_task in sub_tasks] == [(1, 3)]
+
+    def test_progressive_passes_cover_every_frame_once(self):
+        task = BlendFileTask(blend_file='//shot/blend_files/shot.blend',
+                             output_directory='//shot/renders/shot/image_sequences/latest',
+                             start_frame=1, end_frame=30)
+
+        passes = render_manager.get_progressive_passes(task, 8, preview_resolution_percentage=25)
+
+        preview_pass = passes[0]
+        assert preview_pass.output_directory == '//shot/renders/shot/preview_image_sequences/latest'
+        assert preview_pass.resolution_percentage == 25
+        assert list(preview_pass.get_frames()) == [1, 9, 17, 25]
+
+        final_passes = passes[1:]
+        assert [final_pass.start_frame for final_pass in final_passes] == [1, 5, 3, 7, 2, 4, 6, 8]
+        assert not final_passes[0].append_to_output
+        assert all(final_pass.append_to_output for final_pass in final_passes[1:])
+
+        rendered_frames = [frame for final_pass in final_passes for frame in final_pass.get_frames()]
+        assert sorted(rendered_frames) == list(range(1, 31))
+
+    def test_preview_settings_are_ignored_when_planning(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            target = make_target(project_root, 'shot', 'shot')
+            task_spec = {'target': target, 'preview': {'stride': 8, 'resolution_percentage': 25}}
+
+            [task] = render_manager.get_blend_file_task_linearized_dag_from_target_task(project_root, task_spec)
+
+            assert task.blend_file == '//shot/blend_files/shot.blend'
+            assert task.resolution_percentage is None
+
+    def test_only_quality_settings_invalidate_renders(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            target = make_target(project_root, 'shot', 'shot', render_profile='animation')
+            write_done_file(project_root, 'shot', 'shot', render_settings={'use_persistent_data': False})
+
+            def plan(**task_fields):
+                task_spec = {'target': target, 'dependency_invalidation_types': ['RENDER_SETTINGS_CHANGE']}
+                task_spec.update(task_fields)
+                return render_manager.get_blend_file_task_linearized_dag_from_target_task(project_root, task_spec)
+
+            assert plan() == []
+            assert plan(render_profile='gpu') == []
+
+            tasks = plan(render_profile='draft')
+            assert len(tasks) == 1
+            assert tasks[0].render_profile == 'draft'
+
+    def test_small_tasks_are_batched_up_to_the_budget(self):
+        tasks = [BlendFileTask(blend_file='//shot_%d/shot.blend' % index, start_frame=1, end_frame=2,
+                               output_directory='//shot_%d/latest' % index) for index in range(5)]
+        # The last task reads what the one before it renders so it can't be in the same batch.
+        tasks[4] = tasks[4].replace(input_files=('//shot_3/latest',))
+        processor = BatchingProcessor()
+        rm = render_manager.RenderManager('/project', {}, [processor], tasks=tasks, batch_duration_budget=5.0)
+
+        rm.launch_next_tasks()
+        assert [status.task_spec for status in processor.batches[0]] == tasks[:2]
+
+        for status in processor.statuses:
+            status.returncode = 0
+        rm.launch_next_tasks()
+        assert [status.task_spec for status in processor.batches[1]] == tasks[2:4]
+
+        # Failures are per task.
+        processor.batches[1][0].returncode = 1
+        processor.batches[1][1].returncode = 0
+        rm.launch_next_tasks()
+        assert len(processor.batches) == 2
+        assert processor.statuses[-1].task_spec == tasks[4]
+        assert all(status.finalized for status in processor.statuses[:4])
+
+    def test_recorded_durations_win_over_processor_throughput(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            tasks = [BlendFileTask(blend_file='//shot_%d/blend_files/shot_%d.blend' % (index, index), start_frame=1,
+                                   end_frame=2, output_directory='//shot_%d/renders/shot_%d/image_sequences/latest' % (
+                                       index, index)) for index in range(2)]
+            # The processor renders 1 frame per second on average but this shot took a minute per frame last time.
+            write_done_file(project_root, 'shot_0', 'shot_0', start_time=100, completion_time=220,
+                            task_spec=tasks[0].to_dict())
+            processor = BatchingProcessor()
+            rm = render_manager.RenderManager(project_root, {}, [processor], tasks=tasks, batch_duration_budget=5.0)
+
+            rm.launch_next_tasks()
+
+            assert processor.batches == []
+            assert [status.task_spec for status in processor.statuses] == tasks[:1]
+
+    def test_tasks_without_a_predicted_duration_are_not_batched(self):
+        tasks = [BlendFileTask(blend_file='//shot_%d/shot.blend' % index, output_directory='//shot_%d/latest' % index)
+                 for index in range(3)]
+        processor = BatchingProcessor()
+        rm = render_manager.RenderManager('/project', {}, [processor], tasks=tasks, batch_duration_budget=60.0)
+
+        rm.launch_next_tasks()
+
+        assert not processor.batches
+        assert [status.task_spec for status in processor.statuses] == tasks[:1]
+
+    def test_chunks_share_one_post_render_pipeline(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            task = BlendFileTask(blend_file='//shot/shot.blend', output_directory='//shot/latest', start_frame=1,
+                                 end_frame=4,
+                                 post_render_stages=(PostRenderStage('count', finalize=COUNT_FRAMES, output='n.txt'),))
+            finalized_renders = []
+            processors = [FinalizingProcessor(finalized_renders), FinalizingProcessor(finalized_renders)]
+            rm = render_manager.RenderManager(project_root, {}, processors, tasks=[task])
+            rm.launch_next_tasks()
+
+            output_directory = join(project_root, 'shot', 'latest')
+            os.makedirs(output_directory)
+            for frame_number in range(1, 5):
+                write_frame(output_directory, frame_number)
+            processors[0].statuses[0].returncode = 0
+            rm.launch_next_tasks()
+            # The stages don't finalize on a partial set of frames.
+            assert not finalized_renders
+            assert not os.path.exists(join(output_directory, 'count'))
+
+            processors[1].statuses[0].returncode = 0
+            for _ in range(100):
+                rm.launch_next_tasks()
+                if rm.is_done():
+                    break
+                time.sleep(0.05)
+
+            [(finalized_task, statuses, returncode, post_render_status)] = finalized_renders
+            assert (finalized_task.start_frame, finalized_task.end_frame) == (1, 4)
+            assert len(statuses) == 2
+            assert returncode == 0
+            assert post_render_status['count']['finalize_returncode'] == 0
+            with open(join(output_directory, 'count', 'n.txt')) as f:
+                assert f.read() == '4'
+
+    def test_progressive_passes_are_finalized_together(self):
+        task = {'blend_file': '//shot/blend_files/shot.blend',
+                'output_directory': '//shot/renders/shot/image_sequences/latest',
+                'start_frame': 1, 'end_frame': 4, 'preview': {'stride': 2, 'resolution_percentage': 25}}
+        finalized_renders = []
+        processors = [FinalizingProcessor(finalized_renders) for _ in range(3)]
+        rm = render_manager.RenderManager('/project', task, processors)
+        rm.launch_next_tasks()
+        [preview_status] = processors[0].statuses
+        [first_pass_status] = processors[1].statuses
+        [second_pass_status] = processors[2].statuses
+
+        # The pass that fills in the gaps finishes before the one that archived the directory.
+        second_pass_status.returncode = 0
+        preview_status.returncode = 0
+        rm.launch_next_tasks()
+        assert [finalized_task.output_directory for (finalized_task, _, _, _) in finalized_renders] == [
+            '//shot/renders/shot/preview_image_sequences/latest']
+
+        first_pass_status.returncode = 0
+        rm.launch_next_tasks()
+        assert rm.is_done()
+        (finalized_task, statuses, _, _) = finalized_renders[1]
+        assert finalized_task.output_directory == '//shot/renders/shot/image_sequences/latest'
+        assert list(finalized_task.get_frames()) == [1, 2, 3, 4]
+        assert not finalized_task.append_to_output
+        assert statuses == [second_pass_status, first_pass_status]
+
+    def test_committed_backup_frames_get_post_render_outputs(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            output_directory = join(project_root, 'shot', 'latest')
+            os.makedirs(output_directory)
+            now = [0]
+            clock = lambda: now[0]
+            processors = [SpeculativeProcessor(clock), SpeculativeProcessor(clock)]
+            task = BlendFileTask(blend_file='//shot/shot.blend', output_directory='//shot/latest', start_frame=1,
+                                 end_frame=4, post_render_stages=(PostRenderStage('copy', per_frame=COPY_FRAME),))
+            rm = render_manager.RenderManager(project_root, {}, processors, tasks=[task], clock=clock)
+            rm.launch_next_tasks()
+            for frame_number in [1, 2]:
+                write_frame(output_directory, frame_number)
+            now[0] = 2
+            processors[1].statuses[0].returncode = 0
+            rm.launch_next_tasks()
+            now[0] = 20
+            rm.launch_next_tasks()
+            backup = processors[1].statuses[1]
+
+            # Stands in for moving the backup's frames into the output directory.
+            for frame_number in [3, 4]:
+                write_frame(output_directory, frame_number)
+            backup.returncode = 0
+            for _ in range(100):
+                rm.launch_next_tasks()
+                if rm.is_done():
+                    break
+                time.sleep(0.05)
+
+            assert rm.is_done()
+            assert sorted(os.listdir(join(output_directory, 'copy'))) == [
+                'frame_%05d.png' % frame_number for frame_number in range(1, 5)]
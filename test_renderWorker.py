@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+import render_worker
+
+
+class FakeStatus:
+    def __init__(self, task_spec):
+        self.task_spec = task_spec
+        self.returncode = None
+        self.finalized = False
+
+    def is_done(self):
+        return self.returncode is not None
+
+    def finalize_task(self):
+        self.finalized = True
+
+    def cancel(self):
+        self.returncode = 1
+
+
+class FakeProcessor:
+    def __init__(self):
+        self.statuses = []
+
+    def process(self, task_spec):
+        self.statuses.append(FakeStatus(task_spec))
+        return self.statuses[-1]
+
+    def is_available(self):
+        return not self.statuses or self.statuses[-1].is_done()
+
+
+class InstantProcessor(FakeProcessor):
+    def process(self, task_spec):
+        status = super().process(task_spec)
+        status.returncode = 0
+        return status
+
+
+def make_task_spec():
+    return {'blend_file': '//shot/blend_files/shot.blend',
+            'output_directory': '//shot/renders/shot/image_sequences/latest',
+            'start_frame': 1, 'end_frame': 10}
+
+
+class TestRenderWorker(TestCase):
+    def test_worker_renders_in_the_background(self):
+        processors = [InstantProcessor(), InstantProcessor()]
+        worker = render_worker.RenderWorker('/project', make_task_spec(), processors, poll_interval=0.01)
+
+        worker.start()
+        worker.join(5)
+
+        status = worker.status()
+        assert status['state'] == render_worker.FINISHED
+        assert status['progress'] == 1.0
+        assert all(processor.statuses for processor in processors)
+
+    def test_waits_for_confirmation_after_planning(self):
+        processor = InstantProcessor()
+        worker = render_worker.RenderWorker('/project', make_task_spec(), [processor], poll_interval=0.01,
+                                            wait_for_confirmation=True)
+
+        worker.start()
+        while worker.status()['state'] == render_worker.PLANNING:
+            worker.join(0.01)
+        worker.join(0.05)
+
+        assert worker.status()['state'] == render_worker.PLANNED
+        [planned_task] = worker.get_planned_tasks()
+        assert planned_task.blend_file == '//shot/blend_files/shot.blend'
+        assert not processor.statuses
+
+        worker.confirm()
+        worker.join(5)
+        assert worker.status()['state'] == render_worker.FINISHED
+        assert processor.statuses
+
+    def test_cancel_is_forwarded(self):
+        processor = FakeProcessor()
+        worker = render_worker.RenderWorker('/project', make_task_spec(), [processor], poll_interval=0.01)
+
+        worker.start()
+        while worker.status()['state'] == render_worker.PLANNING:
+            worker.join(0.01)
+        worker.cancel()
+        worker.join(5)
+
+        assert worker.status()['state'] == render_worker.CANCELLED
+        # FakeStatus.cancel sets a failing return code.
+        assert processor.statuses[0].returncode == 1
+
+    def test_planning_errors_are_reported(self):
+        worker = render_worker.RenderWorker('/project', {}, [FakeProcessor()])
+
+        worker.start()
+        worker.join(5)
+
+        status = worker.status()
+        assert status['state'] == render_worker.FAILED
+        # Everything the addon reads from the snapshot.
+        assert status['progress'] == 0.0
+        assert status['error']
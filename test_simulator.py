@@ -0,0 +1,70 @@
+import json
+import os
+import tempfile
+from os.path import join
+from unittest import TestCase
+
+import simulator
+
+
+def make_job(name, start_frame, end_frame):
+    return {'blend_file': '//%s/blend_files/%s.blend' % (name, name),
+            'output_directory': '//%s/renders/%s/image_sequences/latest' % (name, name),
+            'start_frame': start_frame, 'end_frame': end_frame}
+
+
+class TestSimulator(TestCase):
+    def test_frames_are_split_between_processors(self):
+        duration_model = simulator.DurationModel(default_seconds_per_frame=10, scene_load_seconds=0)
+        workload = [(0, make_job('shot', 1, 10), None)]
+
+        result = simulator.simulate('/project', workload, [1, 1], duration_model)
+
+        assert result['makespan'] == 50
+        assert result['utilisation'] == 1
+        assert result['chunks'] == 2
+        assert result['queue_wait_p99'] == 0
+
+    def test_shared_tasks_render_once(self):
+        duration_model = simulator.DurationModel(default_seconds_per_frame=10, scene_load_seconds=0)
+        workload = [(0, make_job('shot', 1, 2), None), (5, make_job('shot', 1, 2), None),
+                    (5, make_job('other', 1, 2), None)]
+
+        result = simulator.simulate('/project', workload, [1, 1], duration_model)
+
+        # The second copy of shot attaches to the first so other has to wait for a processor.
+        assert result['chunks'] == 4
+        assert result['queue_wait_p99'] == 5
+        assert result['makespan'] == 20
+
+    def test_renders_are_replayed_as_their_jobs(self):
+        job = {'id': 'job', 'start_time': 100, 'task_spec': {'target': '//shot:shot'}}
+        with tempfile.TemporaryDirectory() as project_root:
+            for (name, start_time, done_job) in [('base', 100, job), ('shot', 200, job), ('old', 150, None)]:
+                output_directory = join(project_root, name, 'latest')
+                os.makedirs(output_directory)
+                done_dict = {'start_time': start_time, 'completion_time': start_time + 10,
+                             'task_spec': make_job(name, 1, 2)}
+                if done_job is not None:
+                    done_dict['job'] = done_job
+                with open(join(output_directory, 'DONE.json'), 'w') as f:
+                    json.dump(done_dict, f)
+
+            renders = simulator.get_recorded_renders(project_root)
+            workload = simulator.get_workload(renders)
+
+        assert len(renders) == 3
+        # The dependency and the target it was rendered for are one job.
+        assert workload == [(0, job['task_spec'], [make_job('base', 1, 2), make_job('shot', 1, 2)]),
+                            (50, make_job('old', 1, 2), [make_job('old', 1, 2)])]
+
+    def test_recorded_target_job_replays_its_tasks(self):
+        duration_model = simulator.DurationModel(default_seconds_per_frame=10, scene_load_seconds=0)
+        job = {'id': 'job', 'start_time': 100, 'task_spec': {'target': '//deleted:deleted'}}
+        renders = [(100, 1000, make_job('base', 1, 100), job), (1100, 1000, make_job('shot', 1, 100), job)]
+
+        # The target doesn't exist in /project (anymore) and would be up to date if it did.
+        result = simulator.simulate('/project', simulator.get_workload(renders), [1, 1], duration_model)
+
+        assert result['chunks'] == 2
+        assert result['makespan'] == 1000
@@ -0,0 +1,107 @@
+import json
+import os
+import tempfile
+import time
+from os.path import join
+from unittest import TestCase
+
+import watch
+
+
+def make_target(project_root, directory, name, deps=(), **target_fields):
+    os.makedirs(join(project_root, directory, 'blend_files'))
+    open(join(project_root, directory, 'blend_files', name + '.blend'), 'w').close()
+    target_dict = {'name': name, 'src': 'blend_files/%s.blend' % name, 'deps': list(deps)}
+    target_dict.update(target_fields)
+    with open(join(project_root, directory, 'RENDER.json'), 'w') as f:
+        json.dump({'targets': [target_dict]}, f)
+    return '//%s:%s' % (directory, name)
+
+
+class FakeInotify:
+    def __init__(self):
+        self.directories = []
+
+    def watch_directory(self, directory):
+        self.directories.append(directory)
+
+
+class TestProjectWatcher(TestCase):
+    def test_asset_change_enqueues_dependents(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            texture = join(project_root, 'textures', 'brick.png')
+            os.makedirs(os.path.dirname(texture))
+            open(texture, 'w').close()
+
+            base = make_target(project_root, 'base', 'base', assets=['//textures/brick.png'])
+            shot = make_target(project_root, 'shot', 'shot', [base])
+            make_target(project_root, 'other', 'other')
+
+            enqueued = []
+            watcher = watch.ProjectWatcher(project_root, enqueued.extend, debounce_seconds=0)
+            watcher.inotify = None
+            watcher.load()
+
+            with open(texture, 'w') as f:
+                f.write('new pixels')
+            watcher.handle_changed_paths(watcher._poll_fingerprints())
+
+            assert watcher.get_dirty_closure() == {base, shot}
+            watcher.flush()
+            assert enqueued == [shot]
+
+    def test_debounce(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            shot = make_target(project_root, 'shot', 'shot')
+
+            enqueued = []
+            watcher = watch.ProjectWatcher(project_root, enqueued.extend, debounce_seconds=60)
+            watcher.inotify = None
+            watcher.load()
+
+            blend_file = join(project_root, 'shot', 'blend_files', 'shot.blend')
+            os.utime(blend_file, (time.time() + 10, time.time() + 10))
+            watcher.handle_changed_paths({blend_file})
+
+            watcher.flush()
+            assert enqueued == []
+            watcher.last_change_time -= 60
+            watcher.flush()
+            assert enqueued == [shot]
+
+    def test_polling_picks_up_new_render_files(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            make_target(project_root, 'shot', 'shot')
+
+            enqueued = []
+            watcher = watch.ProjectWatcher(project_root, enqueued.extend, debounce_seconds=0, poll_interval=0,
+                                           rescan_interval=60)
+            watcher.inotify = None
+            watcher.load()
+
+            new_shot = make_target(project_root, 'new_shot', 'new_shot')
+            assert watcher.wait_for_changes() == set()
+
+            watcher.last_rescan_time -= 60
+            watcher.handle_changed_paths(watcher.wait_for_changes())
+            watcher.flush()
+            assert enqueued == [new_shot]
+
+    def test_new_directories_are_watched_with_their_contents(self):
+        with tempfile.TemporaryDirectory() as project_root:
+            make_target(project_root, 'shot', 'shot')
+
+            enqueued = []
+            watcher = watch.ProjectWatcher(project_root, enqueued.extend, debounce_seconds=0)
+            watcher.inotify = FakeInotify()
+            watcher.load()
+
+            # e.g. a shot copied into the project along with its renders.
+            new_shot = make_target(project_root, 'new_shot', 'new_shot')
+            os.makedirs(join(project_root, 'new_shot', 'renders', 'new_shot'))
+            watcher.handle_changed_paths({join(project_root, 'new_shot')})
+            watcher.flush()
+
+            assert enqueued == [new_shot]
+            assert join(project_root, 'new_shot', 'blend_files') in watcher.inotify.directories
+            assert not [directory for directory in watcher.inotify.directories if 'renders' in directory]
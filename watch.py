@@ -0,0 +1,297 @@
+""" Long running watch mode that keeps the render graph in memory and enqueues targets as their inputs change.
+
+    python watch.py [--debounce SECONDS] [--local NUM_PROCESSORS]
+
+By default dirty targets are written as task files to "Render Tasks/new" for the farm (autorender) to pick up. With
+--local they're rendered in this process using the in-memory render graph.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+from os.path import basename, join
+
+import job_registry
+import local_processor
+import render_graph
+import render_manager
+from render_graph import IGNORED_DIRECTORY_NAMES, RENDER_FILE_NAME, find_render_files
+from path_utils import replace_absolute_project_prefix, replace_relative_project_prefix
+from render_task import Target
+
+WATCH_INVALIDATION_TYPES = ['FILE_MODIFICATION_TIME', 'RENDER_SETTINGS_CHANGE']
+
+
+def get_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+class InotifyEvents:
+    """ Minimal ctypes binding for inotify. Raises OSError if inotify isn't available (e.g. not on Linux)."""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        library_name = ctypes.util.find_library('c')
+        if library_name is None:
+            raise OSError('libc not found')
+        self.libc = ctypes.CDLL(library_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not supported on this platform')
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+
+    def watch_directory(self, directory):
+        if directory in self.directories.values():
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd >= 0:
+            self.directories[wd] = directory
+
+    def read_changed_paths(self, timeout):
+        """ Waits up to timeout seconds for events and returns the paths that changed."""
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed_paths = set()
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            (wd, _, _, name_length) = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            if wd in self.directories and name:
+                changed_paths.add(join(self.directories[wd], os.fsdecode(name)))
+        return changed_paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ProjectWatcher:
+    """ Keeps a RenderGraph of every target in the project and fingerprints of every file that affects them.
+
+    Changes mark the targets that use the changed file dirty. Once nothing has changed for debounce_seconds the dirty
+    targets (and everything that depends on them) are handed to enqueue_targets.
+    """
+
+    def __init__(self, project_root, enqueue_targets, debounce_seconds=10.0, poll_interval=2.0, rescan_interval=60.0):
+        self.project_root = project_root
+        self.enqueue_targets = enqueue_targets
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval = poll_interval
+
+        # Without inotify, new render files (and the directories they're in) only turn up by walking the whole tree
+        # which is too slow to do on every poll.
+        self.rescan_interval = rescan_interval
+        self.last_rescan_time = time.time()
+
+        # The render graph's reverse index tells us which targets a changed file affects.
+        self.rg = render_graph.RenderGraph()
+        self.fingerprints = {}
+
+        self.dirty_targets = set()
+        self.last_change_time = None
+
+        try:
+            self.inotify = InotifyEvents()
+        except OSError as e:
+            print('inotify unavailable (%s), falling back to polling.' % e)
+            self.inotify = None
+
+    def load(self):
+        self.rg.add_project(self.project_root)
+        for render_file in list(self.rg.render_file_targets):
+            self._fingerprint_render_file(render_file)
+        if self.inotify is not None:
+            self._watch_directory_tree(self.project_root)
+
+    def _watch_directory_tree(self, directory):
+        """ Watches directory and the directories below it (except ignored ones like renders).
+
+        :return: the render files in them.
+        """
+        render_files = []
+        for (path, directory_names, file_names) in os.walk(directory):
+            directory_names[:] = [name for name in directory_names if name not in IGNORED_DIRECTORY_NAMES]
+            self.inotify.watch_directory(path)
+            if RENDER_FILE_NAME in file_names:
+                render_files.append(join(path, RENDER_FILE_NAME))
+        return render_files
+
+    def _load_render_file(self, render_file):
+        if not os.path.exists(render_file):
+            self.rg.remove_render_file(render_file)
+            return
+        try:
+            self.rg.add_targets(self.project_root, render_file)
+        except (ValueError, KeyError):
+            print('Unable to parse %s, ignoring it until it changes.' % render_file)
+            self.rg.remove_render_file(render_file)
+        self._fingerprint_render_file(render_file)
+
+    def _fingerprint_render_file(self, render_file):
+        """ Records the fingerprints of the render file and every input of its targets that we haven't seen yet."""
+        self.fingerprints[render_file] = get_fingerprint(render_file)
+        for target_name in self.rg.get_targets_for_render_file(render_file):
+            for input_file in self._get_input_files(target_name):
+                if input_file not in self.fingerprints:
+                    self.fingerprints[input_file] = get_fingerprint(input_file)
+
+    def _get_input_files(self, target_name):
+        target = Target(self.project_root, target_name)
+        input_files = [target.get_absolute_blend_file(self.rg.get_blend_file_for_target(target_name))]
+        for asset in self.rg.get_assets_for_target(target_name):
+            input_files.append(replace_relative_project_prefix(self.project_root, asset))
+        return input_files
+
+    def _poll_fingerprints(self):
+        changed_paths = set()
+        for path in list(self.fingerprints):
+            if get_fingerprint(path) != self.fingerprints[path]:
+                changed_paths.add(path)
+        return changed_paths
+
+    def _find_new_render_files(self):
+        self.last_rescan_time = time.time()
+        return {render_file for render_file in find_render_files(self.project_root)
+                if render_file not in self.fingerprints}
+
+    def handle_changed_paths(self, changed_paths):
+        for path in changed_paths:
+            if basename(path) == RENDER_FILE_NAME:
+                targets_before = set(self.rg.get_targets_for_render_file(path))
+                self._load_render_file(path)
+                targets_after = self.rg.get_targets_for_render_file(path)
+                self.dirty_targets.update(targets_after)
+                self.dirty_targets.difference_update(targets_before - targets_after)
+                continue
+
+            if self.inotify is not None and os.path.isdir(path):
+                # A directory that was created (or moved) into the project can already have files in it by the time
+                # we get around to watching it, e.g. a copied shot.
+                if basename(path) not in IGNORED_DIRECTORY_NAMES:
+                    self.handle_changed_paths(self._watch_directory_tree(path))
+                continue
+
+            fingerprint = get_fingerprint(path)
+            if path in self.fingerprints and fingerprint == self.fingerprints[path]:
+                continue
+            self.fingerprints[path] = fingerprint
+            self.dirty_targets.update(self.rg.get_direct_dependents(
+                replace_absolute_project_prefix(self.project_root, path)))
+
+        if changed_paths:
+            self.last_change_time = time.time()
+
+    def get_dirty_closure(self):
+        """ Returns the dirty targets along with all of their transitive dependents."""
+        closure = set(self.dirty_targets)
+        for target_name in self.dirty_targets:
+            closure.update(self.rg.get_transitive_dependents(target_name))
+        return closure
+
+    def flush(self):
+        """ Enqueues the dirty targets once things have been quiet for long enough."""
+        if not self.dirty_targets or time.time() - self.last_change_time < self.debounce_seconds:
+            return
+        closure = self.get_dirty_closure()
+
+        # Planning a target plans its dependencies as well so we only need to enqueue the targets that nothing else in
+        # the closure depends on.
+        roots = sorted(target_name for target_name in closure
+                       if target_name in self.rg.targets and not self.rg.get_direct_dependents(target_name) & closure)
+        self.dirty_targets = set()
+        if roots:
+            self.enqueue_targets(roots)
+
+    def wait_for_changes(self):
+        if self.inotify is not None:
+            changed_paths = self.inotify.read_changed_paths(self.poll_interval)
+            return {path for path in changed_paths
+                    if path in self.fingerprints or basename(path) == RENDER_FILE_NAME or os.path.isdir(path)}
+        time.sleep(self.poll_interval)
+        changed_paths = self._poll_fingerprints()
+        if time.time() - self.last_rescan_time >= self.rescan_interval:
+            changed_paths.update(self._find_new_render_files())
+        return changed_paths
+
+    def run(self, on_idle=None):
+        self.load()
+        print('Watching %d targets in %s' % (len(self.rg.targets), self.project_root))
+        while True:
+            self.handle_changed_paths(self.wait_for_changes())
+            self.flush()
+            if on_idle is not None:
+                on_idle()
+
+
+def write_task_files(project_root, targets):
+    new_tasks_directory = join(project_root, 'Render Tasks', 'new')
+    os.makedirs(new_tasks_directory, exist_ok=True)
+    for target_name in targets:
+        print('Enqueuing %s' % target_name)
+        file_name = '%s_%d.json' % (target_name.strip('/').replace('/', '_').replace(':', '_'), time.time())
+        # We write to a temporary file first so that autorender never sees half a task.
+        temporary_file = join(new_tasks_directory, file_name + '.tmp')
+        with open(temporary_file, 'w') as f:
+            json.dump({'target': target_name, 'dependency_invalidation_types': WATCH_INVALIDATION_TYPES}, f)
+        os.replace(temporary_file, join(new_tasks_directory, file_name))
+
+
+def watch(project_root, debounce_seconds, num_local_processors=0):
+    if not num_local_processors:
+        ProjectWatcher(project_root, lambda targets: write_task_files(project_root, targets), debounce_seconds).run()
+        return
+
+    processors = [local_processor.LocalProcessor(project_root) for _ in range(num_local_processors)]
+    registry = job_registry.JobRegistry()
+    render_managers = []
+
+    def enqueue_targets(targets):
+        for target_name in targets:
+            task_spec = {'target': target_name, 'dependency_invalidation_types': WATCH_INVALIDATION_TYPES}
+            render_managers.append(render_manager.RenderManager(
+                project_root, task_spec, processors, registry, graph=watcher.rg))
+
+    def launch_next_tasks():
+        for rm in render_managers:
+            rm.launch_next_tasks()
+        render_managers[:] = [rm for rm in render_managers if not rm.is_done()]
+
+    watcher = ProjectWatcher(project_root, enqueue_targets, debounce_seconds)
+    watcher.run(on_idle=launch_next_tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Watch the project and render targets as they go out of date.')
+    parser.add_argument('--debounce', type=float, default=10.0,
+                        help='How long things have to be quiet before dirty targets are enqueued.')
+    parser.add_argument('--local', type=int, default=0,
+                        help='Render in this process with this many processors instead of writing task files.')
+    args = parser.parse_args()
+    watch(os.environ['ANIMATION_PROJECT_ROOT'], args.debounce, args.local)